@@ -0,0 +1,502 @@
+"""
+Benchmarks for daqconf tools run on synthetic configurations
+"""
+import json
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+import tracemalloc
+from logging import getLogger
+log = getLogger('daqconf.benchmark')
+
+
+class SyntheticDal:
+    """Minimal stand-in for a conffwk DAL object"""
+    def __init__(self, uid: str, class_name: str):
+        self.id = uid
+        self._class_name = class_name
+        self.uses = []
+        self.description = f"Synthetic {class_name} object {uid}"
+
+    def className(self):
+        return self._class_name
+
+    def __repr__(self):
+        return f"<{self._class_name} '{self.id}'>"
+
+
+class SyntheticConfigurationHandler:
+    """Provides the parts of the cider ConfigurationHandler interface used to build the relational graph"""
+    _REL_INFO = {'type': 'SyntheticDal', 'multivalue': True, 'not-null': False}
+    _ATTRIBUTES = {'description': {'type': 'string', 'multivalue': False, 'init-value': ''}}
+
+    def __init__(self, n_objects: int, max_fanout: int = 4, n_shared: int = 10, seed: int = 0):
+        """Generate a layered configuration with a few objects shared by everything,
+        similar to OpMonConf/Service objects in a real session
+
+        Arguments:
+            n_objects -- Total number of objects in the configuration
+            max_fanout -- Maximum number of objects each object refers to
+            n_shared -- Number of objects referenced from every layer
+            seed -- Random seed
+        """
+        rng = random.Random(seed)
+        self._loaded_dals = [SyntheticDal(f"obj-{i}", f"Class{i%7}") for i in range(n_objects)]
+
+        shared = self._loaded_dals[-n_shared:] if n_shared < n_objects else []
+        for i, dal in enumerate(self._loaded_dals[:n_objects-len(shared)]):
+            # Only point "down" so the configuration forms a DAG
+            children = range(i+1, n_objects-len(shared))
+            if len(children):
+                dal.uses = [self._loaded_dals[c] for c in
+                            rng.sample(children, min(len(children), rng.randint(1, max_fanout)))]
+            if shared:
+                dal.uses.append(rng.choice(shared))
+
+        self._conf_obj_ids = {self.conf_obj_key(dal): i for i, dal in enumerate(self._loaded_dals)}
+
+    @staticmethod
+    def conf_obj_key(conf_obj)->str:
+        return f"{conf_obj.id}@{conf_obj.className()}"
+
+    def get_conf_obj_id(self, conf_obj)->int | None:
+        return self._conf_obj_ids.get(self.conf_obj_key(conf_obj))
+
+    @property
+    def n_conf_obj_ids(self)->int:
+        return len(self._conf_obj_ids)
+
+    @property
+    def conf_obj_list(self):
+        return self._loaded_dals
+
+    @property
+    def n_dals(self)->int:
+        return len(self._loaded_dals)
+
+    def get_conf_obj_from_id(self, conf_obj_id: int):
+        return self._loaded_dals[conf_obj_id]
+
+    def get_relationships_for_conf_object(self, conf_object):
+        return [{'uses': conf_object.uses, 'rel_info': self._REL_INFO}]
+
+    def get_class_attributes(self, class_id: str):
+        return self._ATTRIBUTES
+
+
+class SyntheticDatabase:
+    """Provides the parts of the conffwk Configuration interface used by jsonify"""
+    def __init__(self, n_objects: int):
+        self._handler = SyntheticConfigurationHandler(n_objects)
+
+    def get_all_dals(self):
+        return {SyntheticConfigurationHandler.conf_obj_key(dal): dal for dal in self._handler.conf_obj_list}
+
+    def attributes(self, class_name: str, all: bool = False):
+        return SyntheticConfigurationHandler._ATTRIBUTES
+
+    def relations(self, class_name: str, all: bool = False):
+        return {'uses': SyntheticConfigurationHandler._REL_INFO}
+
+
+def benchmark_cider_graph(sizes: list[int], repeats: int = 1):
+    """Time the construction of cider's RelationalGraph on synthetic configurations
+
+    Arguments:
+        sizes -- Number of objects in each configuration
+        repeats -- Number of times to build each graph
+
+    Returns:
+        dictionary of n_objects : best build time in seconds
+    """
+    from daqconf.cider.data_structures.relational_graph import RelationalGraph
+
+    results = {}
+    for n_objects in sizes:
+        handler = SyntheticConfigurationHandler(n_objects)
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            graph = RelationalGraph(handler)
+            timings.append(time.perf_counter()-start)
+
+        results[n_objects] = min(timings)
+        log.info(f"Built relational graph for {n_objects} objects "
+                 f"({len(graph.top_level_nodes)} top level) in {results[n_objects]:.3f} s")
+
+    return results
+
+
+def benchmark_cider_search(sizes: list[int], queries: list[str], repeats: int = 1):
+    """Time building cider's search index and searching it on synthetic configurations
+
+    Arguments:
+        sizes -- Number of objects in each configuration
+        queries -- Queries to time
+        repeats -- Number of times to run each query
+
+    Returns:
+        dictionary of n_objects : (index build time, {query : best search time}) in seconds
+    """
+    from daqconf.cider.data_structures.search_index import SearchIndex
+
+    results = {}
+    for n_objects in sizes:
+        handler = SyntheticConfigurationHandler(n_objects)
+
+        start = time.perf_counter()
+        index = SearchIndex(handler)
+        build_time = time.perf_counter()-start
+
+        query_times = {}
+        for query in queries:
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                matches = index.search(query)
+                timings.append(time.perf_counter()-start)
+
+            query_times[query] = min(timings)
+            log.info(f"Searched {n_objects} objects for '{query}' in {query_times[query]*1000:.1f} ms, "
+                     f"best match {matches[0] if matches else None}")
+
+        results[n_objects] = (build_time, query_times)
+
+    return results
+
+
+def synthetic_readout_map(n_connections: int, streams_per_connection: int = 4):
+    """Generate a JSON readout map of WIB ethernet streams, each connection (i.e. readout
+    application) gets its own receiving NIC and a single sending NIC
+
+    Arguments:
+        n_connections -- Number of DetectorToDaqConnections
+        streams_per_connection -- Number of detector streams in each connection
+
+    Returns:
+        list of readout map entries, in the format read by dromap2oks
+    """
+    entries = []
+    for conn in range(n_connections):
+        for stream in range(streams_per_connection):
+            entries.append({
+                "src_id": conn*streams_per_connection + stream,
+                "geo_id": {"det_id": 3, "crate_id": conn//16, "slot_id": conn%16, "stream_id": stream},
+                "kind": "eth",
+                "parameters": {
+                    "protocol": "udp",
+                    "mode": "fix_rate",
+                    "rx_iface": 0,
+                    "rx_host": f"rx-host-{conn}",
+                    "rx_mac": f"00:00:00:{conn//65536%256:02x}:{conn//256%256:02x}:{conn%256:02x}",
+                    "rx_ip": f"10.{conn//65536%256}.{conn//256%256}.{conn%256}",
+                    "tx_host": f"wib-{conn}",
+                    "tx_mac": f"00:00:01:{conn//65536%256:02x}:{conn//256%256:02x}:{conn%256:02x}",
+                    "tx_ip": f"10.{128+conn//65536%128}.{conn//256%256}.{conn%256}",
+                },
+            })
+    return entries
+
+
+def benchmark_generate_readout(n_connections: int, include: list[str], workdir: str | None = None):
+    """Time generate_readout on a synthetic readout map, writing the output once
+    at the end compared to writing it after every connection
+
+    Needs conffwk and a DUNEDAQ_DB_PATH containing the appmodel/confmodel files
+
+    Arguments:
+        n_connections -- Number of DetectorToDaqConnections in the readout map
+        include -- OKS files to include, as passed to generate_readoutOKS
+        workdir -- Directory to write the generated files to, a temporary directory is used if not given
+
+    Returns:
+        dictionary of mode : time in seconds
+    """
+    from daqconf.dromap2oks import dro_json_to_oks
+    from daqconf.generate import generate_readout
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = os.path.abspath(workdir if workdir is not None else tmpdir)
+
+        jsonfile = os.path.join(workdir, f"synthetic-{n_connections}.json")
+        with open(jsonfile, "w") as f:
+            json.dump(synthetic_readout_map(n_connections), f)
+
+        readoutmap = os.path.join(workdir, f"synthetic-{n_connections}.data.xml")
+        start = time.perf_counter()
+        dro_json_to_oks(jsonfile, readoutmap, 0, False, "1,2,3,4")
+        log.info(f"Converted readout map with {n_connections} connections in {time.perf_counter()-start:.3f} s")
+
+        results = {}
+        for mode, commit_per_connection in [("commit per connection", True), ("single commit", False)]:
+            oksfile = os.path.join(workdir, f"readout-{'per-connection' if commit_per_connection else 'single'}.data.xml")
+            start = time.perf_counter()
+            generate_readout(readoutmap, oksfile, include, generate_segment=False,
+                             commit_per_connection=commit_per_connection)
+            results[mode] = time.perf_counter()-start
+            log.info(f"Generated {n_connections} readout applications ({mode}) in {results[mode]:.3f} s")
+
+    return results
+
+
+def benchmark_dromap2oks(n_streams: int, convert: bool = True, workdir: str | None = None):
+    """Time reading a synthetic readout map all at once compared to streaming it, and
+    optionally the full dro_json_to_oks conversion (needs conffwk)
+
+    Arguments:
+        n_streams -- Number of detector streams in the readout map, 4 per connection
+        convert -- Also time dro_json_to_oks
+        workdir -- Directory to write the generated files to, a temporary directory is used if not given
+
+    Returns:
+        dictionary of stage : (time in seconds, peak python memory in MiB or None if not measured)
+    """
+    from daqconf.utils import iter_json_file
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = os.path.abspath(workdir if workdir is not None else tmpdir)
+
+        jsonfile = os.path.join(workdir, f"synthetic-{n_streams}.json")
+        with open(jsonfile, "w") as f:
+            json.dump(synthetic_readout_map(max(1, n_streams//4)), f)
+        log.info(f"Wrote synthetic readout map with {n_streams} streams ({os.path.getsize(jsonfile)/2**20:.1f} MiB)")
+
+        def read_all():
+            with open(jsonfile) as f:
+                for entry in json.loads(f.read()):
+                    pass
+
+        def read_streaming():
+            for entry in iter_json_file(jsonfile):
+                pass
+
+        results = {}
+        for stage, read in [("json.loads", read_all), ("streaming", read_streaming)]:
+            start = time.perf_counter()
+            read()
+            elapsed = time.perf_counter()-start
+
+            # tracemalloc slows everything down so measure the memory separately
+            tracemalloc.start()
+            read()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[stage] = (elapsed, peak/2**20)
+            log.info(f"Read {n_streams} streams ({stage}) in {elapsed:.3f} s, peak memory {peak/2**20:.1f} MiB")
+
+        if convert:
+            from daqconf.dromap2oks import dro_json_to_oks
+            start = time.perf_counter()
+            dro_json_to_oks(jsonfile, os.path.join(workdir, f"synthetic-{n_streams}.data.xml"), 0, False, "1,2,3,4")
+            results["dro_json_to_oks"] = (time.perf_counter()-start, None)
+            log.info(f"Converted {n_streams} streams in {results['dro_json_to_oks'][0]:.3f} s")
+
+    return results
+
+
+def benchmark_generate_hwmap(sizes: list[int], n_apps: int = 100, legacy_max: int = 2000, workdir: str | None = None):
+    """Time generate_hwmap writing everything with one commit compared to committing after
+    every stream (needs conffwk)
+
+    Arguments:
+        sizes -- Total number of streams in each hardware map, split evenly between the applications
+        n_apps -- Number of DetectorToDaqConnections
+        legacy_max -- Largest size to also time with a commit per stream
+        workdir -- Directory to write the generated files to, a temporary directory is used if not given
+
+    Returns:
+        dictionary of n_streams : {mode : time in seconds}
+    """
+    from daqconf.generate_hwmap import generate_hwmap
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = os.path.abspath(workdir if workdir is not None else tmpdir)
+
+        for n_streams in sizes:
+            results[n_streams] = {}
+            modes = [("single commit", False)] + ([("commit per stream", True)] if n_streams <= legacy_max else [])
+            for mode, commit_per_stream in modes:
+                oksfile = os.path.join(workdir, f"hwmap-{n_streams}-{'per-stream' if commit_per_stream else 'single'}.data.xml")
+                start = time.perf_counter()
+                generate_hwmap(oksfile, max(1, n_streams//n_apps), n_apps=n_apps, streams_per_slot=64,
+                               hosts=["host-a", "host-b"], commit_per_stream=commit_per_stream)
+                results[n_streams][mode] = time.perf_counter()-start
+                log.info(f"Generated hardware map with {n_streams} streams ({mode}) in {results[n_streams][mode]:.3f} s")
+
+    return results
+
+
+def _jsonify_in_memory(db, output: str):
+    """jsonify_xml_data before objects were streamed: build the whole document then dump it"""
+    from daqconf.jsonify import convert_to_dict
+
+    dals = db.get_all_dals()
+    the_big_dict = {}
+    for dal_str in dals:
+        dal = dals[dal_str]
+        the_big_dict[f"{dal.id}@{dal.className()}"] = convert_to_dict(db, dal)
+
+    with open(output, 'w') as f:
+        json.dump(dict(sorted(the_big_dict.items())), f, indent=4)
+
+
+def _run_jsonify(mode: str, n_objects: int, output: str):
+    """Export a synthetic database in a fresh process so its peak RSS can be measured
+
+    Returns:
+        (time in seconds, peak RSS increase while exporting in MiB)
+    """
+    from daqconf.jsonify import write_json
+
+    db = SyntheticDatabase(n_objects)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if mode == "in memory":
+        _jsonify_in_memory(db, output)
+    else:
+        with open(output, 'w') as f:
+            write_json(db, f, mode)
+    elapsed = time.perf_counter()-start
+
+    # ru_maxrss is in KiB on Linux
+    return elapsed, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before)/1024
+
+
+def benchmark_jsonify(sizes: list[int], workdir: str | None = None):
+    """Compare exporting synthetic databases to JSON by building the whole document in memory
+    (the old jsonify_xml_data) with streaming each output format
+
+    Arguments:
+        sizes -- Number of objects in each database
+        workdir -- Directory to write the generated files to, a temporary directory is used if not given
+
+    Returns:
+        dictionary of n_objects : {mode : (objects per second, peak RSS increase in MiB)}
+    """
+    from daqconf.jsonify import json_formats
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = os.path.abspath(workdir if workdir is not None else tmpdir)
+
+        for n_objects in sizes:
+            results[n_objects] = {}
+            for mode in ["in memory"] + json_formats:
+                output = os.path.join(workdir, f"jsonify-{n_objects}-{mode.replace(' ', '-')}.json")
+                with context.Pool(1) as pool:
+                    elapsed, peak_rss = pool.apply(_run_jsonify, (mode, n_objects, output))
+                results[n_objects][mode] = (n_objects/elapsed, peak_rss)
+                log.info(f"Exported {n_objects} objects ({mode}) in {elapsed:.3f} s, "
+                         f"{os.path.getsize(output)/2**20:.1f} MiB, peak RSS +{peak_rss:.1f} MiB")
+
+    return results
+
+
+def synthetic_multifile_configuration(workdir: str, n_files: int, hosts_per_file: int, n_shared: int = 10):
+    """Write a configuration split over several data files (needs conffwk). Each file has its own
+    PhysicalHosts/VirtualHosts and an identical copy of a set of shared ProcessingResources,
+    like segment files which all define the same common objects
+
+    Arguments:
+        workdir -- Directory to write the files to
+        n_files -- Number of data files
+        hosts_per_file -- Number of hosts defined in each file, each host has 3 objects
+        n_shared -- Number of objects defined in every file
+
+    Returns:
+        list of the files written
+    """
+    import conffwk
+
+    schemafiles = ["schema/confmodel/dunedaq.schema.xml"]
+    dal = conffwk.dal.module("generated", schemafiles[-1])
+
+    files = []
+    for f in range(n_files):
+        oksfile = os.path.join(workdir, f"part-{f}.data.xml")
+        db = conffwk.Configuration("oksconflibs")
+        db.create_db(oksfile, schemafiles)
+        shared = [dal.ProcessingResource(f"shared-cpus-{i}", cpu_cores=[i]) for i in range(n_shared)]
+        for s in shared:
+            db.update_dal(s)
+        for h in range(hosts_per_file):
+            cpus = dal.ProcessingResource(f"cpus-{f}-{h}", cpu_cores=[0, 1, 2, 3])
+            phdal = dal.PhysicalHost(f"host-{f}-{h}", contains=[cpus, shared[h % n_shared]] if shared else [cpus])
+            db.update_dal(dal.VirtualHost(f"vhost-{f}-{h}", runs_on=phdal, uses=[cpus]))
+        db.commit()
+        files.append(oksfile)
+    return files
+
+
+def _consolidate_files_per_object(oksfile, *input_files):
+    """consolidate_files before objects were indexed: look up and commit every object of every input"""
+    import conffwk
+    from daqconf.consolidate import get_all_includes
+
+    includes = []
+    dbs = []
+    for input_file in input_files:
+        dbs.append(conffwk.Configuration("oksconflibs:" + input_file))
+        includes += get_all_includes(input_file)
+    includes = [i for i in set(includes) if i not in input_files]
+
+    new_db = conffwk.Configuration("oksconflibs")
+    new_db.create_db(oksfile, includes)
+    new_db.commit()
+
+    for db in dbs:
+        dals = db.get_all_dals()
+        for dal in dals:
+            try:
+                new_db.get_dal(dals[dal].className(), dals[dal].id)
+            except:
+                new_db.add_dal(dals[dal])
+            new_db.commit()
+    new_db.commit()
+
+
+def benchmark_consolidate(n_files: int, sizes: list[int], n_shared: int = 10, legacy_max: int = 2000,
+                          workdir: str | None = None):
+    """Time consolidate_files on synthetic multi-file configurations, compared to committing after
+    every object (needs conffwk)
+
+    Arguments:
+        n_files -- Number of input data files
+        sizes -- Number of hosts in each configuration, split evenly between the files
+        n_shared -- Number of objects duplicated in every file
+        legacy_max -- Largest size to also time with a commit per object
+        workdir -- Directory to write the files to, a temporary directory is used if not given
+
+    Returns:
+        dictionary of n_hosts : {"phases": {phase : time in seconds}, "commit per object": time in seconds or None}
+    """
+    from daqconf.consolidate import consolidate_files
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = os.path.abspath(workdir if workdir is not None else tmpdir)
+
+        for n_hosts in sizes:
+            sizedir = os.path.join(workdir, f"consolidate-{n_hosts}")
+            os.makedirs(sizedir, exist_ok=True)
+            input_files = synthetic_multifile_configuration(sizedir, n_files, max(1, n_hosts//n_files), n_shared)
+
+            phases = consolidate_files(os.path.join(sizedir, "consolidated.data.xml"), *input_files)
+            log.info(f"Consolidated {n_files} files with {n_hosts} hosts in {phases['total']:.3f} s")
+
+            legacy = None
+            if n_hosts <= legacy_max:
+                start = time.perf_counter()
+                _consolidate_files_per_object(os.path.join(sizedir, "consolidated-per-object.data.xml"), *input_files)
+                legacy = time.perf_counter()-start
+                log.info(f"Consolidated {n_files} files with {n_hosts} hosts committing every object in {legacy:.3f} s")
+
+            results[n_hosts] = {"phases": phases, "commit per object": legacy}
+
+    return results
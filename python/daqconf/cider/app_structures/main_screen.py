@@ -9,11 +9,13 @@ from daqconf.cider.widgets.configuration_controller import ConfigurationControll
 from daqconf.cider.widgets.popups.file_io import SaveWithMessageScreen, OpenFileScreen
 from daqconf.cider.widgets.popups.dropdown_selector import SelectSessionScreen
 from daqconf.cider.app_structures.selection_panel import SelectionPanel
+from daqconf.cider.widgets.selection_menu import SelectionMenu
 from daqconf.cider.widgets.popups.quit_screen import QuitScreen
 from daqconf.cider.widgets.popups.config_object_modifier_screen import ConfigObjectModifierScreen
 from daqconf.cider.widgets.popups.add_objects import AddNewObjectScreen
 from daqconf.cider.widgets.popups.delete_object_screen import DeleteConfigObjectScreen
 from daqconf.cider.widgets.popups.file_io import RenameConfigObjectScreen
+from daqconf.cider.widgets.popups.search_screen import SearchScreen
 
 from os import path
 
@@ -33,6 +35,9 @@ class MainScreen(Screen):
                 Binding("d", "toggle_disable", "Toggle Disable"),
                 Binding("ctrl+a", "add_configuration", "Add Conf Object"),
                 Binding("ctrl+d", "destroy_configuration", "Delete Conf Object"),
+                Binding("ctrl+f", "search_configuration", "Search Conf Objects"),
+                Binding("ctrl+z", "undo", "Undo"),
+                Binding("ctrl+y", "redo", "Redo"),
             ]
     
     _config_controller = None
@@ -68,16 +73,22 @@ class MainScreen(Screen):
 
     def update_with_new_input(self, input_file_name: str):
         '''
-        Update main screen to have a new input file.
+        Update main screen to have a new input file. The file is loaded in the background,
+        see on_configuration_controller_index_ready/on_configuration_controller_graph_ready
         '''
         self._init_input = input_file_name
         
-        self._config_controller.new_handler_from_str(input_file_name)
+        self._config_controller.load_configuration(input_file_name)
+
+    def on_configuration_controller_index_ready(self, event: ConfigurationController.IndexReady):
+        '''
+        All objects are loaded, mount the selection panel so the class view can be browsed
+        while the session view is being built
+        '''
+        # Remove panel for any previous configuration
+        for selection_panel in self.query(SelectionPanel):
+            selection_panel.remove()
 
-        # Add interfaces
-        self._config_controller.add_interface("class-selection")
-        self._config_controller.add_interface("relation-selection")
-        
         # Mount the selection panel
         try:
             self.mount(SelectionPanel())
@@ -87,12 +98,12 @@ class MainScreen(Screen):
         # Mount config table
         try:
             config_table = self.query_one(ConfigTable)
-            config_table.update_table(self._config_controller.current_dal)
+            config_table.clear_table()
         except:
             config_table = ConfigTable(id="main_table")
             self.mount(config_table)
 
-        # Refresh the screen for safety
+        # Refresh the screen for safety
         self.refresh()
         
         # Get logger (defined at the start)
@@ -104,7 +115,34 @@ class MainScreen(Screen):
         # Print everything!
         self.logger.write(f"[bold green]Opened new configuration file: [/bold green][bold red]{data_base_name}[/bold red][bold green].\nConnected databases are:[/bold green]\n" \
                      + "".join([f"   - [red]{db}[/red] \n" for db in self._config_controller.configuration.get_includes()]))
-            
+
+    def on_configuration_controller_graph_ready(self, event: ConfigurationController.GraphReady):
+        '''
+        Relational graph has been built, the session view can now be shown
+        '''
+        # Menu may not have been composed yet, in which case it picks up the interface when it is
+        for selection_menu in self.query(SelectionMenu):
+            selection_menu.refresh(recompose=True)
+        self.logger.write(f"[bold green]Finished loading[/bold green] [bold red]{path.basename(event.file_name)}[/bold red]")
+
+        # Warn about anything which can't be placed in the session view
+        cyclic_objects = self._config_controller.handler.relational_graph.cyclic_nodes
+        if cyclic_objects:
+            self.logger.write_error("Configuration contains cyclic relationships between: "\
+                                    + ", ".join([self._config_controller.generate_rich_string(c) for c in cyclic_objects]))
+
+    def on_configuration_controller_loading_abandoned(self, event: ConfigurationController.LoadingAbandoned):
+        '''
+        Loading was cancelled/failed, show whatever configuration the controller went back to
+        '''
+        for selection_menu in self.query(SelectionMenu):
+            selection_menu.refresh(recompose=True)
+        for config_table in self.query(ConfigTable):
+            if self._config_controller.current_dal is None:
+                config_table.clear_table()
+            else:
+                config_table.update_table(self._config_controller.current_dal)
+
     def on_configuration_controller_changed(self, event):
         """Updates table based on global state of the configuration controller
         """        
@@ -168,6 +206,40 @@ class MainScreen(Screen):
         except Exception as e:
             self.query_one(RichLogWError).write_error(e)
     
+    def __refresh_after_history_change(self)->None:
+        """Rebuild the views after undo/redo"""
+        for selection_panel in self.query(SelectionPanel):
+            selection_panel.save_menu_state()
+            selection_panel.refresh(recompose=True)
+            selection_panel.restore_menu_state()
+
+        config_table = self.query_one(ConfigTable)
+        if self._config_controller.current_dal is None:
+            config_table.clear_table()
+        else:
+            config_table.update_table(self._config_controller.current_dal)
+
+    async def action_undo(self)->None:
+        try:
+            self._config_controller.undo()
+        except Exception as e:
+            self.query_one(RichLogWError).write_error(e)
+        self.__refresh_after_history_change()
+
+    async def action_redo(self)->None:
+        try:
+            self._config_controller.redo()
+        except Exception as e:
+            self.query_one(RichLogWError).write_error(e)
+        self.__refresh_after_history_change()
+
+    async def action_search_configuration(self)->None:
+        if "search-selection" not in self._config_controller.get_interface():
+            self.query_one(RichLogWError).write_error("No configuration has been loaded")
+            return
+
+        self.app.push_screen(SearchScreen())
+
     async def action_rename_configuration(self)->None:
         self.app.push_screen(RenameConfigObjectScreen())
         
\ No newline at end of file
@@ -0,0 +1,29 @@
+"""
+Change events emitted when the configuration is edited. These let the relational graph and selection
+interfaces update just the part of the configuration which was touched rather than being rebuilt
+"""
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, List
+
+class ChangeType(Enum):
+    NODE_ADDED = "node-added"
+    NODE_REMOVED = "node-removed"
+    EDGES_CHANGED = "edges-changed"
+    # Attribute values or uid changed, relationships are unaffected
+    ATTRIBUTES_CHANGED = "attributes-changed"
+
+@dataclass
+class ConfigurationChange:
+    """Single edit to the configuration
+
+    Arguments:
+        change_type -- What happened to the object
+        conf_obj -- Configuration object which was added/removed/had its relationships or attributes changed
+        affected_objs -- Objects which (indirectly) refer to conf_obj
+        relayered_objs -- Objects whose layer in the relational graph changed as a result of the edit
+    """
+    change_type: ChangeType
+    conf_obj: Any
+    affected_objs: List[Any] = field(default_factory=list)
+    relayered_objs: List[Any] = field(default_factory=list)
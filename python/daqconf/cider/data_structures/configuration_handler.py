@@ -1,25 +1,52 @@
 import os
-from typing import Any, Dict, List
+import time
+from typing import Any, Callable, Dict, List, Set, Tuple
 
 import conffwk 
 
+from daqconf.cider.data_structures.configuration_change import ChangeType
+from daqconf.cider.data_structures.edit_journal import EditJournal, EditType, JournalEdit
+
+# Called with (stage, number of steps done, total number of steps) while loading
+ProgressCallback = Callable[[str, int, int], None]
 
 class ConfigurationHandler:
     # Contains the full configuration of a single configuration instance
-    def __init__(self, configuration_file_name: str):
+    def __init__(self, configuration_file_name: str, progress_callback: ProgressCallback | None=None):
         """Configuration handler object, essentially a wrapper around a conffwk.Configuration object
 
         Arguments:
             configuration_file_name -- name of the configuration .database.xml file to open
+
+        Keyword Arguments:
+            progress_callback -- Called as each class is indexed, any exception it raises aborts loading (default: {None})
         """        
         
         # Load configuration
         self._configuration = self.__open_configuration(configuration_file_name)
+
+        # Schema lookups, the schema can't change without re-opening the file so these are only built once
+        # class -> {relationship name : relationship info}
+        self._class_relations: Dict[str, Dict[str, Any]] = {}
+        # class -> {attribute name : attribute info}
+        self._class_attributes: Dict[str, Dict[str, Any]] = {}
+        # class -> the class + every class derived from it
+        self._derived_classes: Dict[str, Set[str]] = {}
+        self.__cache_schema()
         
-        # To be filled with ALL config objects (as DALs)
-        self._loaded_dals = []
-        # Fills self._loaded_dals,
-        self.__cache_all_conf_objects()
+        # To be filled with ALL config objects (as DALs), indexed by an integer ID. IDs are never reused
+        # so removed objects are left as None
+        self._loaded_dals: List[Any] = []
+        # uid@class -> integer ID, kept after an object is destroyed so it gets the same ID if re-added
+        self._conf_obj_ids: Dict[str, int] = {}
+        # class -> {integer ID : DAL} for every object of the class or a derived class
+        self._class_index: Dict[str, Dict[int, Any]] = {}
+        # Number of objects which haven't been destroyed
+        self._n_loaded_dals = 0
+        # Undo history + objects modified since the last commit
+        self._journal = EditJournal()
+        # Fills the index
+        self.__cache_all_conf_objects(progress_callback)
         
     def __open_configuration(self, configuration_file_name: str)->conffwk.Configuration:
         '''Opens configuration object safely '''
@@ -33,14 +60,66 @@ class ConfigurationHandler:
 
         return configuration
     
-    def __cache_all_conf_objects(self)->None:
-        """Adds all loaded dals to self._loaded_dals
+    def __cache_schema(self)->None:
+        """Caches the relationships/attributes of every class along with the classes derived from it
+        """
+        for conf_class in self._configuration.classes():
+            self._class_relations[conf_class] = self._configuration.relations(conf_class, True)
+            self._class_attributes[conf_class] = self._configuration.attributes(conf_class, True)
+
+            self._derived_classes.setdefault(conf_class, set()).add(conf_class)
+            for super_class in self._configuration.superclasses(conf_class, True):
+                self._derived_classes.setdefault(super_class, set()).add(conf_class)
+
+    def __cache_all_conf_objects(self, progress_callback: ProgressCallback | None=None)->None:
+        """Adds all loaded dals to the object index
+
+        Keyword Arguments:
+            progress_callback -- Called after each class is indexed (default: {None})
+        """
+        conf_classes = self._configuration.classes()
+        for i, conf_class in enumerate(conf_classes):
+            class_objs = self._class_index.setdefault(conf_class, {})
+            for conf_obj in self._configuration.get_dals(conf_class):
+                class_objs[self.__index_conf_obj(conf_obj)] = conf_obj
+
+            if progress_callback is not None:
+                progress_callback("Indexing classes", i+1, len(conf_classes))
+
+    def __index_conf_obj(self, conf_obj)->int:
+        """Add a dal to the index if it's not already there
+
+        Arguments:
+            conf_obj -- DAL object
+
+        Returns:
+            Integer ID of the object
+        """
+        key = self.conf_obj_key(conf_obj)
+        conf_obj_id = self._conf_obj_ids.get(key)
+
+        if conf_obj_id is None:
+            conf_obj_id = len(self._loaded_dals)
+            self._conf_obj_ids[key] = conf_obj_id
+            self._loaded_dals.append(None)
+
+        if self._loaded_dals[conf_obj_id] is None:
+            self._loaded_dals[conf_obj_id] = conf_obj
+            self._n_loaded_dals += 1
+
+        return conf_obj_id
+
+    @staticmethod
+    def conf_obj_key(conf_obj)->str:
+        """Unique key for a configuration object
+
+        Arguments:
+            conf_obj -- DAL object
+
+        Returns:
+            uid@class string
         """
-        for conf_class in  self._configuration.classes():
-            for conf_obj in self._configuration.get_dals(conf_class):                
-                if conf_obj in self._loaded_dals: continue
-                
-                self._loaded_dals.append(conf_obj)
+        return f"{getattr(conf_obj, 'id')}@{conf_obj.className()}"
 
     #==============================  Getters + Setters ==============================#
     def get_relationships_for_conf_object(self, conf_object)->List[Any]:
@@ -54,18 +133,20 @@ class ConfigurationHandler:
         """        
         relations =  self.get_related_classes(conf_object.className())
 
-        relations_list = []
-        
         # Loop over relations                
-        for rel, rel_info in relations.items():
-            rel_val = getattr(conf_object, rel)
-            # Hacky but pybind got fussy about casting list(dal)
-            if not isinstance(rel_val, list):
-                rel_val = [rel_val]
+        return [{rel: self.__get_relationship_values(conf_object, rel), 'rel_info': rel_info}
+                for rel, rel_info in relations.items()]
 
-            relations_list.append({rel: [v for v in rel_val if v is not None], 'rel_info': rel_info})
+    @staticmethod
+    def __get_relationship_values(conf_object, relationship_name: str)->List[Any]:
+        """Objects a single relationship of a configuration object points to
+        """
+        rel_val = getattr(conf_object, relationship_name)
+        # Hacky but pybind got fussy about casting list(dal)
+        if not isinstance(rel_val, list):
+            rel_val = [rel_val]
 
-        return relations_list
+        return [v for v in rel_val if v is not None]
     
     def get_conf_objects_class(self, conf_class: str):
         """Get all configuration objects of a given class
@@ -76,32 +157,83 @@ class ConfigurationHandler:
         Returns:
             List of configuration objects of the given class
         """        
-        return self._configuration.get_dals(conf_class)
-        
+        return list(self._class_index.get(conf_class, {}).values())
+
     def get_all_conf_classes(self)->Dict[str, Any]:
         """Gets all classes + objects of that class in the configuration
 
         Returns:
             dictionary of class : dal objects
         """        
-        return {conf_class: self.get_conf_objects_class(conf_class)
-                for conf_class in self._configuration.classes()}
+        return {conf_class: list(conf_objs.values())
+                for conf_class, conf_objs in self._class_index.items()}
+
+    @property
+    def conf_classes(self)->List[str]:
+        """Names of all classes in the configuration
+        """
+        return list(self._class_index.keys())
+
+    def is_conf_obj_of_class(self, conf_obj, conf_class: str)->bool:
+        """Check if an object belongs to a class (or a class derived from it)
+
+        Arguments:
+            conf_obj -- DAL object
+            conf_class -- Class name
+        """
+        return self.get_conf_obj_id(conf_obj) in self._class_index.get(conf_class, {})
+
+    def is_class_compatible(self, class_id: str, target_class: str)->bool:
+        """Check if objects of a class can be used where the target class is expected,
+        i.e. the class is the target class or derived from it
+
+        Arguments:
+            class_id -- Class name
+            target_class -- Expected class name
+        """
+        return class_id in self._derived_classes.get(target_class, ())
     
-    def get_related_classes(self, class_id: str)->List[str]:
+    def get_related_classes(self, class_id: str)->Dict[str, Any]:
         """Get all related to classes to a given input class
 
         Arguments:
             class_id -- Name of class
 
         Returns:
-            List of all related classses
+            dictionary of relationship name : relationship info
         """        
-        return self._configuration.relations(class_id, True)
+        return self._class_relations.get(class_id, {})
+
+    def get_relation_info(self, class_id: str, relationship_name: str)->Dict[str, Any] | None:
+        """Get info (type, multivalue etc.) for a single relationship of a class
+
+        Arguments:
+            class_id -- Name of class
+            relationship_name -- Name of relationship
+
+        Returns:
+            Relationship info, None if the class has no such relationship
+        """
+        return self.get_related_classes(class_id).get(relationship_name)
+
+    def get_class_attributes(self, class_id: str)->Dict[str, Any]:
+        """Get all attributes of a given input class
+
+        Arguments:
+            class_id -- Name of class
+
+        Returns:
+            dictionary of attribute name : attribute info
+        """
+        return self._class_attributes.get(class_id, {})
         
     def get_inherited_classes(self, class_id: str)->List[str]:
-        inherited_classes = [class_ for class_ in self._configuration.classes()\
-                                if self._configuration.is_subclass(class_, class_id)]
-        return inherited_classes            
+        """Get all classes derived from a given input class
+
+        Arguments:
+            class_id -- Name of class
+        """
+        return sorted(class_ for class_ in self._derived_classes.get(class_id, ()) if class_ != class_id)
 
     
     @property
@@ -120,8 +252,31 @@ class ConfigurationHandler:
     def conf_obj_list(self):
         """List of loaded in dals
         """        
-        return self._loaded_dals
-    
+        return [dal for dal in self._loaded_dals if dal is not None]
+
+    def get_conf_obj_id(self, conf_obj)->int | None:
+        """Integer ID of a configuration object, these are never reused so destroyed
+        objects keep their ID
+
+        Arguments:
+            conf_obj -- DAL object
+
+        Returns:
+            Integer ID or None if the object has never been loaded
+        """
+        return self._conf_obj_ids.get(self.conf_obj_key(conf_obj))
+
+    def get_conf_obj_from_id(self, conf_obj_id: int):
+        """Configuration object with a given integer ID, None if it has been destroyed
+        """
+        return self._loaded_dals[conf_obj_id]
+
+    @property
+    def n_conf_obj_ids(self)->int:
+        """Upper bound on integer IDs of configuration objects
+        """
+        return len(self._loaded_dals)
+
     def get_obj(self, class_id: str, uid: str):
         """Get a particular configuration object 
 
@@ -131,92 +286,250 @@ class ConfigurationHandler:
 
         Returns:
             DAL object satisfying the input
-        """        
-        return self.configuration.get_obj(class_id, uid)
+        """
+        conf_obj_id = self._conf_obj_ids.get(f"{uid}@{class_id}")
+        if conf_obj_id is not None and self._loaded_dals[conf_obj_id] is not None:
+            return self._loaded_dals[conf_obj_id]
+
+        # Class could be a base class of the object
+        return self._loaded_dals[self._conf_obj_ids[self.conf_obj_key(self.configuration.get_dal(class_id, uid))]]
     
-    def commit(self, update_message: str):
-        """Commit changes to the database
+    def commit(self, update_message: str)->float:
+        """Commit changes to the database, every object modified since the last commit is updated in one go
 
         Arguments:
             update_message -- Add message to the update
+
+        Returns:
+            Time taken to write the configuration [s]
         """        
+        start = time.perf_counter()
+        for class_id, uid in self._journal.take_pending():
+            self.configuration.update_dal(self.get_obj(class_id, uid))
+
         self.configuration.commit(update_message)
+        return time.perf_counter() - start
+
+    @property
+    def journal(self)->EditJournal:
+        """Undo history + objects modified since the last commit
+        """
+        return self._journal
 
     @property
     def n_dals(self)->int:
         """Lists the total number of loaded objects
             _description_
         """        
-        return len(self._loaded_dals)
+        return self._n_loaded_dals
     
     def add_new_conf_obj(self, class_id: str, uid: str):
         """Add new configuration object
 
-    Arguments:
+        Arguments:
             class_id -- Class name
             uid -- Unique object ID
+
+        Returns:
+            The new DAL object
         """        
+        config_as_dal = self.__create_conf_obj(class_id, uid)
+        self._journal.record(JournalEdit(EditType.CREATE, class_id, uid), f"Add {uid}@{class_id}")
+        return config_as_dal
+
+    def __create_conf_obj(self, class_id: str, uid: str):
+        """Create + index a new configuration object"""
         self.configuration.create_obj(class_id, uid, at=self.configuration.active_database)
         config_as_dal = self.configuration.get_dal(class_id, uid)
         self.configuration.update_dal(config_as_dal)
-        self._loaded_dals.append(config_as_dal)
 
-    def destroy_conf_obj(self, class_id: str, uid: str):
+        conf_obj_id = self.__index_conf_obj(config_as_dal)
+        for conf_class in config_as_dal.oksTypes():
+            self._class_index.setdefault(conf_class, {})[conf_obj_id] = config_as_dal
+
+        return config_as_dal
+
+    def destroy_conf_obj(self, class_id: str, uid: str, referrers: List[Any] | None=None):
         """Destroy a configuration object
 
         Arguments:
             class_id -- class name
             uid -- unique object ID
+
+        Keyword Arguments:
+            referrers -- Objects referring to the object, the object is removed from their relationships (default: {None})
         """
-        dal = self.configuration.get_dal(class_id, uid)
+        dal = self.get_obj(class_id, uid)
+        key = self.conf_obj_key(dal)
+
+        with self._journal.batch(f"Delete {key}"):
+            # Avoid leaving references to an object which doesn't exist
+            for referrer in referrers or []:
+                for rel_name, rel_info in self.get_related_classes(referrer.className()).items():
+                    rel_val = self.__get_relationship_values(referrer, rel_name)
+                    if all(self.conf_obj_key(v) != key for v in rel_val):
+                        continue
+
+                    rel_val = [v for v in rel_val if self.conf_obj_key(v) != key]
+                    self.set_conf_obj_attribute(referrer, rel_name, rel_val if rel_info['multivalue'] else None)
+
+            # Everything needed to recreate the object
+            snapshot = {name: self.__to_journal_value(getattr(dal, name), name in self.get_related_classes(dal.className()))
+                        for name in [*self.get_class_attributes(dal.className()), *self.get_related_classes(dal.className())]}
+
+            self.__destroy_conf_obj(dal)
+            self._journal.record(JournalEdit(EditType.DESTROY, dal.className(), uid, snapshot=snapshot), f"Delete {key}")
+
+    def __destroy_conf_obj(self, dal)->None:
+        """Destroy + remove a configuration object from the index"""
         self.configuration.destroy_dal(dal)
-        self._loaded_dals.remove(dal)
+        self._journal.discard_pending(self.conf_obj_key(dal))
+
+        conf_obj_id = self.get_conf_obj_id(dal)
+        self._loaded_dals[conf_obj_id] = None
+        self._n_loaded_dals -= 1
+        for conf_objs in self._class_index.values():
+            conf_objs.pop(conf_obj_id, None)
+
+    def set_conf_obj_attribute(self, conf_obj, name: str, value)->None:
+        """Set an attribute/relationship of a configuration object. The change is only written to
+        the database on commit
+
+        Arguments:
+            conf_obj -- DAL object
+            name -- Name of attribute/relationship
+            value -- New value
+        """
+        is_relationship = name in self.get_related_classes(conf_obj.className())
+        self._journal.record(JournalEdit(EditType.SET, conf_obj.className(), getattr(conf_obj, 'id'), name,
+                                         old_value=self.__to_journal_value(getattr(conf_obj, name), is_relationship),
+                                         new_value=self.__to_journal_value(value, is_relationship)),
+                             f"Set {name} of {self.conf_obj_key(conf_obj)}")
+        self.__set_conf_obj_attribute(conf_obj, name, value)
+
+    def rename_conf_obj(self, conf_obj, new_name: str)->None:
+        """Rename a configuration object, it keeps its integer ID. Renaming is pushed to the database
+        straight away and can't be undone, so any history referring to the old name is forgotten
+
+        Arguments:
+            conf_obj -- DAL object
+            new_name -- New unique object ID
+        """
+        old_key = self.conf_obj_key(conf_obj)
+        self._journal.discard_pending(old_key)
+        conf_obj.rename(new_name)
+        self.configuration.update_dal(conf_obj)
+        self._conf_obj_ids[self.conf_obj_key(conf_obj)] = self._conf_obj_ids.pop(old_key)
+        self._journal.clear()
+
+    def __set_conf_obj_attribute(self, conf_obj, name: str, value)->None:
+        setattr(conf_obj, name, value)
+        self._journal.mark_pending(self.conf_obj_key(conf_obj), conf_obj.className(), getattr(conf_obj, 'id'))
+
+    def __to_journal_value(self, value, is_relationship: bool):
+        """Copy of a value which is safe to store in the journal, relationships are stored as (class, uid)
+        since the objects they point to can be destroyed + recreated"""
+        if not is_relationship:
+            return list(value) if isinstance(value, list) else value
+
+        if isinstance(value, list):
+            return [(v.className(), getattr(v, 'id')) for v in value if v is not None]
+
+        return None if value is None else (value.className(), getattr(value, 'id'))
+
+    def __from_journal_value(self, value, is_relationship: bool):
+        """Inverse of __to_journal_value"""
+        if not is_relationship:
+            return list(value) if isinstance(value, list) else value
+
+        if isinstance(value, list):
+            return [self.get_obj(*v) for v in value]
+
+        return None if value is None else self.get_obj(*value)
+
+    #==============================  Undo/Redo ==============================#
+    def undo(self)->List[Tuple[ChangeType, Any]]:
+        """Undo the most recent journal entry
+
+        Returns:
+            (type of change, configuration object) for each object which changed
+        """
+        entry = self._journal.pop_undo()
+        if entry is None:
+            return []
+
+        return [change for edit in reversed(entry.edits) for change in self.__apply_edit(edit, undo=True)]
+
+    def redo(self)->List[Tuple[ChangeType, Any]]:
+        """Redo the most recently undone journal entry
+
+        Returns:
+            (type of change, configuration object) for each object which changed
+        """
+        entry = self._journal.pop_redo()
+        if entry is None:
+            return []
+
+        return [change for edit in entry.edits for change in self.__apply_edit(edit, undo=False)]
+
+    def __apply_edit(self, edit: JournalEdit, undo: bool)->List[Tuple[ChangeType, Any]]:
+        """Apply (or revert) a single edit without recording it"""
+        creating = (edit.edit_type == EditType.CREATE) != undo
+
+        match edit.edit_type:
+            case EditType.SET:
+                conf_obj = self.get_obj(edit.class_id, edit.uid)
+                is_relationship = edit.name in self.get_related_classes(edit.class_id)
+                self.__set_conf_obj_attribute(conf_obj, edit.name,
+                                              self.__from_journal_value(edit.old_value if undo else edit.new_value, is_relationship))
+                return [(ChangeType.EDGES_CHANGED if is_relationship else ChangeType.ATTRIBUTES_CHANGED, conf_obj)]
+
+            case EditType.CREATE | EditType.DESTROY if creating:
+                conf_obj = self.__create_conf_obj(edit.class_id, edit.uid)
+                for name, value in edit.snapshot.items():
+                    self.__set_conf_obj_attribute(conf_obj, name,
+                                                  self.__from_journal_value(value, name in self.get_related_classes(edit.class_id)))
+
+                return [(ChangeType.NODE_ADDED, conf_obj)]
+
+            case _:
+                conf_obj = self.get_obj(edit.class_id, edit.uid)
+                self.__destroy_conf_obj(conf_obj)
+                return [(ChangeType.NODE_REMOVED, conf_obj)]
         
     def modify_relationship(self, class_id, uid, relationship_name: str, updated_value,
                             append: bool=False):
-        """Modify TODO: EDIT THIS
-
-        :param class_id: _description_
-        :type class_id: _type_
-        :param uid: _description_
-        :type uid: _type_
-        :param relationship_name: _description_
-        :type relationship_name: str
-        :param updated_value: _description_
-        :type updated_value: _type_
-        :param append: _description_, defaults to False
-        :type append: bool, optional
-        """
-        # Firstly we need to find the relationship this is referring to
-        selected_dal = self.configuration.get_dal(class_id, uid)
-        # Okay need a better way of doing this...
-        rel_list = self.get_relationships_for_conf_object(selected_dal)
-        
-        for relations in rel_list:
-            # Need to find our dal
-            if list(relations.keys())[0] != relationship_name:
-                continue
-            
-            # Next we need to check the type of our object is okay
-            if updated_value not in self.get_conf_objects_class(relations['rel_info']['type']):
-                raise Exception(updated_value)
-                # raise TypeError(f"Cannot use object {updated_value} for relation expecting type {relations['rel_info']['type']}")
-            
-            # Need to make sure everything is typed correctly
-            if append and relations['rel_info']['multivalue']:
-                rel = list(relations.items)[0]
-                rel.append(updated_value)
-            
-            elif relations['rel_info']['multivalue']:
-                rel = [updated_value]
-            else:
-                rel = updated_value
-
-            # Should update the dal 
-            setattr(selected_dal, relationship_name, rel)
-            self.configuration.update_dal(selected_dal)
-            
-            
-            return
-        
-        raise RuntimeError(f"Cannot find relationship with name {relationship_name}")
\ No newline at end of file
+        """Modify a relationship of a configuration object
+
+        Arguments:
+            class_id -- Class name
+            uid -- Unique object ID
+            relationship_name -- Name of the relationship to modify
+            updated_value -- Object to set the relationship to, None to clear it
+
+        Keyword Arguments:
+            append -- Append to (rather than replace) multi-value relationships (default: {False})
+        """
+        selected_dal = self.get_obj(class_id, uid)
+        rel_info = self.get_relation_info(selected_dal.className(), relationship_name)
+
+        if rel_info is None:
+            raise RuntimeError(f"Cannot find relationship with name {relationship_name}")
+
+        # Next we need to check the type of our object is okay
+        if updated_value is not None and not self.is_class_compatible(updated_value.className(), rel_info['type']):
+            raise TypeError(f"Cannot use object {updated_value} for relation expecting type {rel_info['type']}")
+
+        # Need to make sure everything is typed correctly
+        if updated_value is None:
+            rel = [] if rel_info['multivalue'] else None
+        elif append and rel_info['multivalue']:
+            rel = self.__get_relationship_values(selected_dal, relationship_name)
+            rel.append(updated_value)
+        elif rel_info['multivalue']:
+            rel = [updated_value]
+        else:
+            rel = updated_value
+
+        # Should update the dal 
+        self.set_conf_obj_attribute(selected_dal, relationship_name, rel)
@@ -0,0 +1,169 @@
+"""
+Journal of edits made to a configuration.
+
+Edits are only applied to the in memory DAL objects, objects touched since the last commit are tracked
+so they can be pushed to conffwk in one go when the configuration is committed. Every edit is also recorded
+on an undo stack, several edits can be grouped into a single undo step with `batch`.
+
+Objects are referred to by class + uid rather than DAL object since undoing/redoing can destroy and recreate objects
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Dict, List, Tuple
+
+class EditType(Enum):
+    SET = "set"
+    CREATE = "create"
+    DESTROY = "destroy"
+
+@dataclass
+class JournalEdit:
+    """Single edit to a configuration object
+
+    Arguments:
+        edit_type -- What happened to the object
+        class_id -- Class name of the object
+        uid -- Unique object ID
+        name -- Attribute/relationship set [SET only]
+        old_value -- Value before the edit [SET only]
+        new_value -- Value after the edit [SET only]
+        snapshot -- Every attribute/relationship of the object before it was destroyed [DESTROY only]
+    """
+    edit_type: EditType
+    class_id: str
+    uid: str
+    name: str | None = None
+    old_value: Any = None
+    new_value: Any = None
+    snapshot: Dict[str, Any] = field(default_factory=dict)
+
+@dataclass
+class JournalEntry:
+    """Group of edits which are undone/redone together"""
+    description: str
+    edits: List[JournalEdit] = field(default_factory=list)
+
+class EditJournal:
+    def __init__(self, max_undo: int=100):
+        """Edit journal
+
+        Keyword Arguments:
+            max_undo -- Maximum number of undo steps kept (default: {100})
+        """
+        self._max_undo = max_undo
+        self._undo_stack: List[JournalEntry] = []
+        self._redo_stack: List[JournalEntry] = []
+        # Entry edits are currently being grouped into
+        self._batch: JournalEntry | None = None
+        # uid@class -> (class, uid) of objects modified since the last commit
+        self._pending: Dict[str, Tuple[str, str]] = {}
+
+    def record(self, edit: JournalEdit, description: str)->None:
+        """Record a new edit, anything which had been undone can no longer be redone
+
+        Arguments:
+            edit -- Edit made
+            description -- Description of the edit, ignored if the edit is part of a batch
+        """
+        self._redo_stack.clear()
+
+        if self._batch is not None:
+            self._batch.edits.append(edit)
+            return
+
+        self.__push_undo(JournalEntry(description, [edit]))
+
+    @contextmanager
+    def batch(self, description: str):
+        """Group all edits made inside the context into a single undo step
+
+        Arguments:
+            description -- Description of the group of edits
+        """
+        # Nested batches just join the outer batch
+        if self._batch is not None:
+            yield
+            return
+
+        self._batch = JournalEntry(description)
+        try:
+            yield
+        finally:
+            if self._batch.edits:
+                self.__push_undo(self._batch)
+            self._batch = None
+
+    def __push_undo(self, entry: JournalEntry)->None:
+        self._undo_stack.append(entry)
+        if len(self._undo_stack) > self._max_undo:
+            self._undo_stack.pop(0)
+
+    def pop_undo(self)->JournalEntry | None:
+        """Take the most recent entry off the undo stack, it can then be redone
+
+        Returns:
+            Entry to undo, None if there is nothing to undo
+        """
+        if not self._undo_stack:
+            return None
+
+        entry = self._undo_stack.pop()
+        self._redo_stack.append(entry)
+        return entry
+
+    def pop_redo(self)->JournalEntry | None:
+        """Take the most recently undone entry off the redo stack, it can then be undone again
+
+        Returns:
+            Entry to redo, None if there is nothing to redo
+        """
+        if not self._redo_stack:
+            return None
+
+        entry = self._redo_stack.pop()
+        self._undo_stack.append(entry)
+        return entry
+
+    def clear(self)->None:
+        """Forget all undo/redo history
+        """
+        self._undo_stack.clear()
+        self._redo_stack.clear()
+
+    #==============================  Pending changes ==============================#
+    def mark_pending(self, key: str, class_id: str, uid: str)->None:
+        """Mark an object as modified since the last commit
+
+        Arguments:
+            key -- uid@class key of the object
+            class_id -- Class name
+            uid -- Unique object ID
+        """
+        self._pending[key] = (class_id, uid)
+
+    def discard_pending(self, key: str)->None:
+        """Stop tracking an object, i.e. if it has been destroyed
+        """
+        self._pending.pop(key, None)
+
+    def take_pending(self)->List[Tuple[str, str]]:
+        """(class, uid) of every object modified since the last commit, these are no longer tracked
+        """
+        pending = list(self._pending.values())
+        self._pending.clear()
+        return pending
+
+    @property
+    def n_pending(self)->int:
+        """Number of objects modified since the last commit
+        """
+        return len(self._pending)
+
+    @property
+    def undo_description(self)->str | None:
+        return self._undo_stack[-1].description if self._undo_stack else None
+
+    @property
+    def redo_description(self)->str | None:
+        return self._redo_stack[-1].description if self._redo_stack else None
@@ -5,124 +5,354 @@ The RelationalGraph class is used to generate a graph of the relationships betwe
 The class is used to generate a topological ordering of the DALs, and to calculate the longest path in the graph.
 The reasoning is that the configuration should naturally group similar objects together based on how far they are from the session object
 
+Each object is assigned a layer, the longest path to it (weighted by the number of connections) from a "top level"
+object, i.e. one nothing else refers to. Objects in or below a cycle have no well defined layer, they go on the last layer.
+
+The graph is stored sparsely as an adjacency list, each node maps the IDs of the nodes it points to onto
+the number of connections between the two. Node IDs are the integer IDs of the objects in the
+ConfigurationHandler index so building the graph is linear in the number of objects + relationships.
+
+Once built the graph is kept up to date via `apply_change`, object IDs are never reused so adding/removing
+objects only touches the objects connected to them. Layers are then only recalculated for nodes below the edit.
+
 Current this is only really used to find "top level" objects
 
 '''
 
-import numpy as np
-from numpy.typing import NDArray
 from collections import deque
+from typing import Any, Dict, Iterable, List, Set
 
-from daqconf.cider.data_structures.configuration_handler import ConfigurationHandler
+from daqconf.cider.data_structures.configuration_handler import ConfigurationHandler, ProgressCallback
+from daqconf.cider.data_structures.configuration_change import ChangeType, ConfigurationChange
 
 class RelationalGraph:
-    def __init__(self, config_handler: ConfigurationHandler):
+    # Number of progress updates to send while finding edges
+    _N_PROGRESS_UPDATES = 100
+
+    def __init__(self, config_handler: ConfigurationHandler, progress_callback: ProgressCallback | None=None):
         """Construct relational graph
 
         Arguments:
             config_handler -- ConfigurationHandler object
-        """        
+
+        Keyword Arguments:
+            progress_callback -- Called periodically while the graph is built, any exception it raises aborts the build (default: {None})
+        """
 
         # Configuration handler
         self._handler = config_handler
-        self.generate_graph()
-        
-    def generate_graph(self):
-        # Matrices etc. we require [maybe don't need to be defined at the constructor level, could be
-        # class methods]
-        self._topological_ordered_matrix = np.array([[]])
-
-        # Adjacency matrix has 1 for direct connection, 0 for no connection
-        self._adjacency_matrix = np.zeros((self._handler.n_dals, self._handler.n_dals))
-        # Maximum distance from the "top level" to a given node
-        self._max_distance = np.zeros(self._handler.n_dals)-np.inf
+        self.generate_graph(progress_callback)
+
+    def generate_graph(self, progress_callback: ProgressCallback | None=None):
+        # Configuration object for each node ID, None if the object has been removed
+        self._nodes: List[Any] = [None]*self._handler.n_conf_obj_ids
+        for dal in self._handler.conf_obj_list:
+            self._nodes[self._handler.get_conf_obj_id(dal)] = dal
+        # Number of nodes which haven't been removed
+        self._n_nodes = self._handler.n_dals
+        # Adjacency list, node -> {connected node : number of connections}
+        self._adjacency_list: List[Dict[int, int]] = [{} for _ in self._nodes]
+        # Reverse adjacency list, node -> nodes connected to it
+        self._incoming: List[Set[int]] = [set() for _ in self._nodes]
+        # Maximum distance from the "top level" to a given node, -1 for nodes in/downstream of a cycle
+        self._layer: List[int] = [0]*len(self._nodes)
+        # Node IDs which are part of (or connect) cycles
+        self._cyclic_node_ids: List[int] = []
 
         # Generate the graph
-        self.__generate_adjacency_matrix()
+        progress_step = max(1, self._n_nodes//self._N_PROGRESS_UPDATES)
+        for i, node in enumerate(self.__live_nodes()):
+            self.__set_node_edges(node, self.__find_node_edges(node))
+
+            if progress_callback is not None and (i+1)%progress_step==0:
+                progress_callback("Finding relationships", i+1, self._n_nodes)
+
         # Sort topologically and get longest paths
-        self.__calculate_longest_paths()
+        if progress_callback is not None:
+            progress_callback("Calculating layers", 0, 1)
+
+        self.__calculate_layers()
+
+    def __live_nodes(self)->Iterable[int]:
+        """IDs of nodes which haven't been removed"""
+        return (node for node, dal in enumerate(self._nodes) if dal is not None)
 
-            
-    def __generate_adjacency_matrix(self):
-        """Generates adjacency matrix from configuration handler object i.e. finds connected DALs
+    def __find_node_edges(self, node: int)->Dict[int, int]:
+        """Finds DALs connected to a node from the configuration handler
+
+        Arguments:
+            node -- ID of the node
         """
-        for i, dal in enumerate(self._handler.conf_obj_list):
-            for connection_category in self._handler.get_relationships_for_conf_object(dal):
-                # Allows for multiply connected nodes
-                for connection in list(connection_category.values())[0]:
-                    # Loop over just conf objects
-                    self._adjacency_matrix[i][self._handler.conf_obj_list.index(connection)] += 1
-                    
-    
-    def __compute_degree(self):
-        """Get number of incoming nodes for each node"""
-        return np.sum(self._adjacency_matrix !=0, axis=0)
-    
-    def __get_topological_order(self):
+        node_edges: Dict[int, int] = {}
+        for connection_category in self._handler.get_relationships_for_conf_object(self._nodes[node]):
+            # Allows for multiply connected nodes
+            for connection in list(connection_category.values())[0]:
+                # Loop over just conf objects [skipping anything which has been destroyed]
+                connection_id = self._handler.get_conf_obj_id(connection)
+                if connection_id is not None and self._nodes[connection_id] is not None:
+                    node_edges[connection_id] = node_edges.get(connection_id, 0) + 1
+        return node_edges
+
+    def __set_node_edges(self, node: int, node_edges: Dict[int, int])->Set[int]:
+        """Replace the outgoing edges of a node
+
+        Arguments:
+            node -- ID of the node
+            node_edges -- New {connected node : number of connections}
+
+        Returns:
+            IDs of nodes which have gained or lost a connection to node
         """
-        Topological sort of the adjacency graph
-        
+        old_edges = self._adjacency_list[node]
+        for connected_node in old_edges.keys() - node_edges.keys():
+            self._incoming[connected_node].discard(node)
+        for connected_node in node_edges.keys() - old_edges.keys():
+            self._incoming[connected_node].add(node)
+
+        self._adjacency_list[node] = node_edges
+        return old_edges.keys() ^ node_edges.keys()
+
+    def __calculate_layers(self)->None:
+        '''
+        Topological sort of the adjacency graph, calculating the longest path from any top level node
+        to each node as we go. Since every incoming edge of a node is processed before the node is dequeued
+        the layer each item lives on is final once it's added to the topological ordering
+
         Algorithm implementation roughly based on: https://en.wikipedia.org/wiki/Topological_sorting#Kahn's_algorithm
-        
+        '''
+        in_degree = [len(incoming) for incoming in self._incoming]
+        queue = deque(node for node in self.__live_nodes() if in_degree[node] == 0)
+        n_sorted = 0
+
+        for node in self.__live_nodes():
+            self._layer[node] = 0
+
+        while queue:
+            node = queue.popleft()
+            n_sorted += 1
+
+            for connected_node, n_connections in self._adjacency_list[node].items():
+                # Update maximum distance to each connected node
+                self._layer[connected_node] = max(self._layer[connected_node], self._layer[node] + n_connections)
+                # Reduce the number of incoming edges for each outgoing edge
+                in_degree[connected_node] -= 1
+                # Add any nodes with no remaining incoming edges to the queue
+                if in_degree[connected_node] == 0:
+                    queue.append(connected_node)
+
+        self._cyclic_node_ids = []
+        # Anything left over has no well defined layer
+        if n_sorted != self._n_nodes:
+            unsorted_nodes = [node for node, degree in enumerate(in_degree) if degree > 0]
+            for node in unsorted_nodes:
+                self._layer[node] = -1
+
+            self._cyclic_node_ids = self.__find_cyclic_nodes(unsorted_nodes)
+
+    def __find_cyclic_nodes(self, unsorted_nodes: List[int])->List[int]:
+        """Strip nodes which are only downstream of a cycle from the unsorted nodes,
+        what remains are nodes in cycles (or nodes connecting two cycles)
+
+        Arguments:
+            unsorted_nodes -- Nodes which could not be topologically sorted
         """
-        in_degree = self.__compute_degree()
-        queue = deque(np.where(in_degree == 0)[0])
-        topological_ordering = []
-        
+        remaining = set(unsorted_nodes)
+        out_degree = {node: sum(1 for c in self._adjacency_list[node] if c in remaining) for node in remaining}
+
+        queue = deque(node for node, degree in out_degree.items() if degree == 0)
         while queue:
             node = queue.popleft()
-            # Add node to topological ordering
-            topological_ordering.append(node)
-            # Check out going edges
-            outgoing_edges = np.where(self._adjacency_matrix != 0)[0]
-            # Reduce the number of incoming edges for each outgoing edge
-            in_degree[outgoing_edges] -= 1
-            # Change the number of nodes with no outgoing edges
-            zero_in_degree_nodes = outgoing_edges[in_degree[outgoing_edges] == 0]
-            # Add to the queue
-            queue.extend(zero_in_degree_nodes)
-        
-        return topological_ordering
-    
-    def __update_distances(self, distance: NDArray, node_id: int):
-        """Update maximum distance to each node
+            remaining.discard(node)
+            for incoming_node in self._incoming[node]:
+                if incoming_node not in remaining:
+                    continue
+                out_degree[incoming_node] -= 1
+                if out_degree[incoming_node] == 0:
+                    queue.append(incoming_node)
+
+        return sorted(remaining)
+
+    #==============================  Incremental updates ==============================#
+    def apply_change(self, change: ConfigurationChange)->List[Any]:
+        """Update the graph following an edit to the configuration
 
         Arguments:
-            distance -- List of distancezs to each node
-            node_id -- ID of a node
-        """        
-        outgoing_edges = np.where(self._adjacency_matrix[node_id] != 0)[0]
-        distance[outgoing_edges] = np.maximum(distance[outgoing_edges], distance[node_id] + self._adjacency_matrix[node_id][outgoing_edges])
-        
-    def __longest_path(self, start_id: int):
-        """Calculate the longest path in a DAG from the start node."""
-        dist = np.full(self._handler.n_dals, -np.inf)
-        dist[start_id] = 0
-
-        for u in self._topological_ordered_matrix:
-            if dist[u] != -np.inf:
-                self.__update_distances(dist, u)
-        return dist
-    
-    def __calculate_longest_paths(self)->None:
-        '''
-        Idea is to find shortest paths on -G for each top level node where G is the connection graph.
-        Layer each item lives on is then simply max(longest_path) for each top level item
-        '''
-        
-        self._topological_ordered_matrix = self.__get_topological_order()
-        for node_id in range(self._handler.n_dals):
-            self._max_distance = np.maximum(self._max_distance, self.__longest_path(node_id))
+            change -- Change made to the configuration
+
+        Returns:
+            List of configuration objects whose layer has changed
+        """
+        match change.change_type:
+            case ChangeType.NODE_ADDED:
+                node = self._handler.get_conf_obj_id(change.conf_obj)
+                # Objects which have been destroyed + re-added keep their ID
+                for _ in range(len(self._nodes), self._handler.n_conf_obj_ids):
+                    self._nodes.append(None)
+                    self._adjacency_list.append({})
+                    self._incoming.append(set())
+                    self._layer.append(-1)
+
+                self._nodes[node] = change.conf_obj
+                self._n_nodes += 1
+                # Guarantees the new node is picked up when layers are updated
+                self._layer[node] = -1
+                changed_nodes = self.__set_node_edges(node, self.__find_node_edges(node)) | {node}
+
+            case ChangeType.NODE_REMOVED:
+                node = self._handler.get_conf_obj_id(change.conf_obj)
+                changed_nodes = self.__set_node_edges(node, {})
+                for incoming_node in self._incoming[node]:
+                    self._adjacency_list[incoming_node].pop(node)
+                self._incoming[node] = set()
+                self._nodes[node] = None
+                self._n_nodes -= 1
+                self._layer[node] = -1
+                self._cyclic_node_ids = [n for n in self._cyclic_node_ids if n != node]
+
+            case ChangeType.EDGES_CHANGED:
+                node = self._handler.get_conf_obj_id(change.conf_obj)
+                new_edges = self.__find_node_edges(node)
+                added_nodes = new_edges.keys() - self._adjacency_list[node].keys()
+                changed_nodes = self.__set_node_edges(node, new_edges)
+
+                # Adding an edge to anything above the node would create a cycle
+                if node in self.__reachable(added_nodes, self._adjacency_list):
+                    self._cyclic_node_ids.append(node)
+
+            case ChangeType.ATTRIBUTES_CHANGED:
+                # Nodes are keyed by integer ID, which renaming keeps
+                return []
+
+            case _:
+                raise ValueError(f"Unknown change type {change.change_type}")
+
+        # Can't do anything clever if the graph isn't a DAG
+        if self._cyclic_node_ids:
+            old_layers = list(self._layer)
+            self.__calculate_layers()
+            return [self._nodes[n] for n in self.__live_nodes() if old_layers[n] != self._layer[n]]
+
+        return [self._nodes[n] for n in self.__update_layers(changed_nodes)]
+
+    def __update_layers(self, start_nodes: Iterable[int])->Set[int]:
+        """Propagate layer changes down from the given nodes, stopping wherever the layer is unchanged
+
+        Arguments:
+            start_nodes -- Nodes whose incoming edges have changed
+
+        Returns:
+            IDs of nodes whose layer changed
+        """
+        queue = deque(n for n in start_nodes if self._nodes[n] is not None)
+        changed_nodes = set()
+
+        while queue:
+            node = queue.popleft()
+            layer = max((self._layer[incoming_node] + self._adjacency_list[incoming_node][node]
+                         for incoming_node in self._incoming[node]), default=0)
+            if layer == self._layer[node]:
+                continue
+
+            self._layer[node] = layer
+            changed_nodes.add(node)
+            queue.extend(self._adjacency_list[node])
+
+        return changed_nodes
+
+    @staticmethod
+    def __reachable(start_nodes: Iterable[int], edges: List[Any])->Set[int]:
+        """All nodes which can be reached from the start nodes (inclusive) by following edges"""
+        visited = set(start_nodes)
+        queue = deque(visited)
+        while queue:
+            for connected_node in edges[queue.popleft()]:
+                if connected_node not in visited:
+                    visited.add(connected_node)
+                    queue.append(connected_node)
+        return visited
+
+    #==============================  Getters ==============================#
+    def ancestors(self, conf_obj)->List[Any]:
+        """All configuration objects which (indirectly) refer to a configuration object
+
+        Arguments:
+            conf_obj -- Configuration object
+        """
+        node = self._handler.get_conf_obj_id(conf_obj)
+        if node is None or node >= len(self._nodes):
+            return []
+
+        return [self._nodes[n] for n in self.__reachable([node], self._incoming) if n != node]
+
+    def parents(self, conf_obj)->List[Any]:
+        """Configuration objects which directly refer to a configuration object
+
+        Arguments:
+            conf_obj -- Configuration object
+        """
+        node = self._handler.get_conf_obj_id(conf_obj)
+        if node is None or node >= len(self._nodes):
+            return []
+
+        return [self._nodes[n] for n in self._incoming[node]]
+
+    def is_top_level(self, conf_obj)->bool:
+        """Check if nothing refers to a configuration object
+
+        Arguments:
+            conf_obj -- Configuration object
+        """
+        node = self._handler.get_conf_obj_id(conf_obj)
+        return node is not None and node < len(self._nodes) and self._nodes[node] is not None and self._layer[node]==0
+
+    def layers(self)->List[List[Any]]:
+        """Group configuration objects by their maximum distance from a top level object
+
+        Returns:
+            List of configuration objects on each layer, the first layer being the top level objects. Layers
+            can be empty, as edges are weighted by their number of connections. Objects in or below a cycle
+            are on an extra last layer
+        """
+        self.__check_up_to_date()
+
+        live_nodes = list(self.__live_nodes())
+        conf_obj_layers: List[List[Any]] = [[] for _ in range(max((self._layer[n] for n in live_nodes), default=-1)+1)]
+        cyclic_layer = []
+        for node in live_nodes:
+            if self._layer[node] < 0:
+                cyclic_layer.append(self._nodes[node])
+            else:
+                conf_obj_layers[self._layer[node]].append(self._nodes[node])
+
+        if cyclic_layer:
+            conf_obj_layers.append(cyclic_layer)
+        return conf_obj_layers
+
+    @property
+    def cyclic_nodes(self)->List[Any]:
+        """Configuration objects which are part of a cycle in the configuration
+        """
+        self.__check_up_to_date()
+        return [self._nodes[node] for node in self._cyclic_node_ids]
+
+    @property
+    def unreachable_cyclic_nodes(self)->List[Any]:
+        """Configuration objects in a cycle which can't be reached from any top level object, so
+        would be missing from a tree of the top level objects
+        """
+        self.__check_up_to_date()
+        if not self._cyclic_node_ids:
+            return []
+
+        reachable = self.__reachable((n for n in self.__live_nodes() if self._layer[n]==0), self._adjacency_list)
+        return [self._nodes[node] for node in self._cyclic_node_ids if node not in reachable]
 
-        self._max_distance = self._max_distance.astype(int)
-    
     @property
     def top_level_nodes(self):
+        self.__check_up_to_date()
+        return [self._nodes[node] for node in self.__live_nodes() if self._layer[node]==0]
+
+    def __check_up_to_date(self)->None:
         # Means we automatically rebuild the graph
-        if len(self._max_distance!=len(self._handler.conf_obj_list)):
+        if self._n_nodes!=self._handler.n_dals:
             self.generate_graph()
-        
-        return [dal for i, dal in enumerate(self._handler.conf_obj_list) if self._max_distance[i]==0]
-    
-    
-    
\ No newline at end of file
@@ -0,0 +1,224 @@
+'''
+In memory index used to search for configuration objects.
+
+Every object is broken up into trigrams (sets of 3 consecutive characters) of its uid, class and attribute values.
+Searching then just counts how many trigrams of the query each object shares, so the search is "fuzzy" i.e.
+typos/partial names still find the object as long as most of the query matches. Indexed text is padded at both ends,
+matching the start/end of a name only adds to the score so the query can be found anywhere in a name. Queries shorter
+than a trigram are prefix searches. Repeated trigrams are counted, so "obj-99999" shares more with itself than with "obj-999".
+
+An object whose uid is exactly the query always comes first, then objects whose uid starts with the query.
+Otherwise matches on the uid are weighted more highly than matches on the class or attribute values.
+'''
+
+import heapq
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Set
+
+from daqconf.cider.data_structures.configuration_handler import ConfigurationHandler
+
+class SearchIndex:
+    # Padding added to the start of text so prefixes of 1/2 characters still give a trigram
+    _PADDING = "$$"
+    # Padding added to the end of text so the end of a name is a trigram of its own
+    _END_PADDING = "$"
+    # Weighting of uid matches compared to class/attribute matches
+    _UID_WEIGHT = 3
+    # Fraction of objects a trigram can be found in before it's too common to look for candidates with
+    _COMMON_TRIGRAM_FRACTION = 0.2
+
+    def __init__(self, config_handler: ConfigurationHandler):
+        """Build search index over all objects in the configuration
+
+        Arguments:
+            config_handler -- ConfigurationHandler object
+        """
+        self._handler = config_handler
+
+        # trigram -> IDs of objects with a uid/attribute value containing the trigram
+        self._uid_index: Dict[str, Set[int]] = {}
+        self._attribute_index: Dict[str, Set[int]] = {}
+        # trigram -> {ID : number of times the trigram occurs} for objects where it occurs more than once, which is rare
+        self._uid_repeats: Dict[str, Dict[int, int]] = {}
+        self._attribute_repeats: Dict[str, Dict[int, int]] = {}
+        # Every object of a class shares the class trigrams so these are kept per class
+        # class name -> IDs of its objects
+        self._class_objects: Dict[str, Set[int]] = {}
+        # class name -> trigram counts
+        self._class_trigrams: Dict[str, Counter] = {}
+        # object ID -> (lower case uid, class name, uid trigram counts, attribute trigram counts), needed to rank/remove objects
+        self._obj_trigrams: Dict[int, tuple] = {}
+
+        for conf_obj in self._handler.conf_obj_list:
+            self.add_conf_obj(conf_obj)
+
+    @classmethod
+    def trigrams(cls, text: str)->Counter:
+        """Split text into (lower case) trigrams, padded at both ends
+
+        Arguments:
+            text -- Text to split
+
+        Returns:
+            Number of times each trigram occurs
+        """
+        text = cls._PADDING + text.lower() + cls._END_PADDING
+        return Counter(text[i:i+3] for i in range(len(text)-2))
+
+    def __attribute_text(self, conf_obj)->Iterable[str]:
+        """Values of all attributes of an object as strings"""
+        for attr_name in self._handler.get_class_attributes(conf_obj.className()):
+            attr_val = getattr(conf_obj, attr_name)
+            if isinstance(attr_val, list):
+                yield from (str(v) for v in attr_val)
+            elif attr_val != '' and attr_val is not None:
+                yield str(attr_val)
+
+    def add_conf_obj(self, conf_obj)->None:
+        """Add an object to the index
+
+        Arguments:
+            conf_obj -- DAL object
+        """
+        conf_obj_id = self._handler.get_conf_obj_id(conf_obj)
+        if conf_obj_id in self._obj_trigrams:
+            self.remove_conf_obj(conf_obj)
+
+        class_name = conf_obj.className()
+        if class_name not in self._class_trigrams:
+            self._class_trigrams[class_name] = self.trigrams(class_name)
+        self._class_objects.setdefault(class_name, set()).add(conf_obj_id)
+
+        uid_trigrams = self.trigrams(getattr(conf_obj, 'id'))
+        attribute_trigrams = Counter()
+        for text in self.__attribute_text(conf_obj):
+            attribute_trigrams.update(self.trigrams(text))
+
+        for trigram, count in uid_trigrams.items():
+            self._uid_index.setdefault(trigram, set()).add(conf_obj_id)
+            if count > 1:
+                self._uid_repeats.setdefault(trigram, {})[conf_obj_id] = count
+        for trigram, count in attribute_trigrams.items():
+            self._attribute_index.setdefault(trigram, set()).add(conf_obj_id)
+            if count > 1:
+                self._attribute_repeats.setdefault(trigram, {})[conf_obj_id] = count
+
+        self._obj_trigrams[conf_obj_id] = (getattr(conf_obj, 'id').lower(), class_name, uid_trigrams, attribute_trigrams)
+
+    def remove_conf_obj(self, conf_obj)->None:
+        """Remove an object from the index
+
+        Arguments:
+            conf_obj -- DAL object
+        """
+        conf_obj_id = self._handler.get_conf_obj_id(conf_obj)
+        if conf_obj_id not in self._obj_trigrams:
+            return
+        _, class_name, uid_trigrams, attribute_trigrams = self._obj_trigrams.pop(conf_obj_id)
+
+        self._class_objects[class_name].discard(conf_obj_id)
+        for trigram, count in uid_trigrams.items():
+            self._uid_index[trigram].discard(conf_obj_id)
+            if count > 1:
+                self._uid_repeats[trigram].pop(conf_obj_id, None)
+        for trigram, count in attribute_trigrams.items():
+            self._attribute_index[trigram].discard(conf_obj_id)
+            if count > 1:
+                self._attribute_repeats[trigram].pop(conf_obj_id, None)
+
+    def search(self, query: str, max_results: int=50)->List[Any]:
+        """Find the objects best matching a query
+
+        Arguments:
+            query -- Text to search for
+
+        Keyword Arguments:
+            max_results -- Maximum number of objects to return (default: {50})
+
+        Returns:
+            Matching objects, best match first
+        """
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        # Trigrams which have to match, those including the padding only add to the score so the
+        # query is found anywhere in a name. Queries too short for a trigram can only match a prefix
+        query_trigrams = Counter(query[i:i+3] for i in range(len(query)-2))
+        padded_query = self._PADDING + query
+        bonus_trigrams = [padded_query[i:i+3] for i in range(min(2, len(query)))] + [padded_query[-2:] + self._END_PADDING]
+        if not query_trigrams:
+            query_trigrams = Counter(bonus_trigrams[:-1])
+            bonus_trigrams = bonus_trigrams[-1:]
+
+        # (trigram, query count, uid postings, attribute postings) for each trigram in the query, rarest first
+        postings = sorted(((trigram, count, self._uid_index.get(trigram, set()), self._attribute_index.get(trigram, set()))
+                           for trigram, count in query_trigrams.items()), key=lambda p: len(p[2])+len(p[3]))
+
+        # Need to match most of the query in one of the uid/class/attributes to count
+        min_matches = max(1, -(-2*len(postings)//3))
+
+        # Class matches, there are few enough classes to just check them all. Many class names share
+        # words (e.g. ...Application) so only objects of the closest matching classes are candidates
+        class_scores: Counter = Counter()
+        class_hits: Dict[str, int] = {}
+        for class_name, class_trigrams in self._class_trigrams.items():
+            hits = sum(1 for trigram in query_trigrams if trigram in class_trigrams)
+            class_hits[class_name] = hits
+            class_scores[class_name] = (hits + sum(1 for trigram in bonus_trigrams if trigram in class_trigrams)
+                                        + sum(min(count, class_trigrams[trigram]) - 1 for trigram, count in query_trigrams.items()
+                                              if count > 1 and trigram in class_trigrams))
+        best_class_hits = max(min_matches, max(class_hits.values(), default=0))
+        matched_classes = [class_name for class_name, hits in class_hits.items() if hits == best_class_hits]
+
+        # Any object matching enough of its uid/attributes must contain at least one of the rarest
+        # (n_trigrams - min_matches + 1) trigrams so only those need to be looked at to find candidates
+        candidate_postings = postings[:len(postings)-min_matches+1]
+
+        # Trigrams found in a large fraction of objects (e.g. a common word in a uid) barely narrow down
+        # the search, skip these unless the query is entirely made of them
+        max_postings = self._COMMON_TRIGRAM_FRACTION*self.n_indexed
+        candidate_postings = [p for p in candidate_postings if len(p[2])+len(p[3]) < max_postings] or postings[:1]
+
+        candidates = set().union(*(uid_posting | attribute_posting for _, _, uid_posting, attribute_posting in candidate_postings),
+                                 *(self._class_objects[class_name] for class_name in matched_classes))
+
+        # Distinct query trigrams matched, plus extra matches for trigrams repeated in both the query and the object
+        uid_hits: Counter = Counter()
+        attribute_hits: Counter = Counter()
+        uid_scores: Counter = Counter()
+        attribute_scores: Counter = Counter()
+        for trigram, count, uid_posting, attribute_posting in postings:
+            uid_hits.update(uid_posting & candidates)
+            attribute_hits.update(attribute_posting & candidates)
+            if count > 1:
+                for repeats, scores in [(self._uid_repeats, uid_scores), (self._attribute_repeats, attribute_scores)]:
+                    for conf_obj_id, obj_count in repeats.get(trigram, {}).items():
+                        if conf_obj_id in candidates:
+                            scores[conf_obj_id] += min(count, obj_count) - 1
+        # Matching the start/end of a name
+        for trigram in bonus_trigrams:
+            uid_scores.update(self._uid_index.get(trigram, set()) & candidates)
+            attribute_scores.update(self._attribute_index.get(trigram, set()) & candidates)
+
+        matched_classes = set(matched_classes)
+        candidates = [conf_obj_id for conf_obj_id in candidates
+                      if max(uid_hits[conf_obj_id], attribute_hits[conf_obj_id]) >= min_matches
+                      or self._obj_trigrams[conf_obj_id][1] in matched_classes]
+
+        def rank(conf_obj_id):
+            uid, class_name, _, _ = self._obj_trigrams[conf_obj_id]
+            score = (self._UID_WEIGHT*(uid_hits[conf_obj_id] + uid_scores[conf_obj_id])
+                     + class_scores[class_name] + attribute_hits[conf_obj_id] + attribute_scores[conf_obj_id])
+            # Exact uid, then uid prefix, then score. Shorter (i.e. closer) names only decide ties
+            return (uid == query, uid.startswith(query), score, -len(uid))
+
+        best_ids = heapq.nlargest(max_results, candidates, key=rank)
+
+        return [self._handler.get_conf_obj_from_id(conf_obj_id) for conf_obj_id in best_ids]
+
+    @property
+    def n_indexed(self)->int:
+        """Number of objects in the index
+        """
+        return len(self._obj_trigrams)
@@ -1,78 +1,194 @@
 '''
 Class which defines selection menus where the menu is generated by a tree
+
+The top level of the tree is given by `relationships`, a dictionary of category : configuration objects.
+Anything below that is only generated when a node is expanded via `get_children`
 '''
 
 from abc import ABC, abstractmethod
+from typing import Any, List, Tuple
+
 from daqconf.cider.data_structures.structured_configuration import StructuredConfiguration
 from daqconf.cider.data_structures.relational_graph import RelationalGraph
+from daqconf.cider.data_structures.configuration_change import ChangeType, ConfigurationChange
 
 class SelectionInterface(ABC):
     ''' Generic Selection interface
     '''
+    # Expand the top level categories when the tree is first built
+    expand_top_level = False
+
     def __init__(self, config_handler: StructuredConfiguration):
         self._handler =  config_handler
         self._relational_dict: dict = self._build_relational_dict()
-    
+
     def recompose(self)->None:
-        # Regenerates the GUI
+        # Regenerates the GUI
         self._relational_dict = self._build_relational_dict()
-    
+
+    def apply_change(self, change: ConfigurationChange)->None:
+        """Update the relationships following an edit to the configuration, by default just rebuilds everything
+
+        Arguments:
+            change -- Change made to the configuration
+        """
+        self.recompose()
+
     @abstractmethod
     def _build_relational_dict(self):
         # Abstract method to be implemented by concrete classes
         return {}
-    
+
+    def has_children(self, conf_obj)->bool:
+        """Check if a configuration object has any children in the tree
+
+        Arguments:
+            conf_obj -- Configuration object
+        """
+        return False
+
+    def get_children(self, conf_obj)->List[Tuple[str, List[Any]]]:
+        """Get children of a configuration object in the tree
+
+        Arguments:
+            conf_obj -- Configuration object
+
+        Returns:
+            List of (category name, configuration objects in category)
+        """
+        return []
+
     @property
     def relationships(self):
         # Return the relationships between objects
         return self._relational_dict
-    
-    
+
+
 # Couple of concrete classes
 class ClassSelectionMenu(SelectionInterface):
     '''Selection menu based purely on the class of objects
     '''
     def _build_relational_dict(self):
         """Returns all classes + conf objs for class/derived classes
-        """        
+        """
         return self._handler.configuration_handler.get_all_conf_classes()
-    
+
+    def apply_change(self, change: ConfigurationChange)->None:
+        """Refresh the object lists of the class + base classes of an added/removed object
+        """
+        if change.change_type == ChangeType.EDGES_CHANGED:
+            return
+
+        for conf_class in change.conf_obj.oksTypes():
+            self._relational_dict[conf_class] = self._handler.configuration_handler.get_conf_objects_class(conf_class)
+
     def __repr__(self):
         return "ClassSelectionMenu"
-    
+
 class RelationalSelectionMenu(SelectionInterface):
     ''' Selection menu based on class relationships
-    '''    
-    def _build_relational_dict(self):                
-        configuration_dict = {f"[green]Sessions" : [self.__build_node(top_node) for top_node in self._handler.relational_graph.top_level_nodes if top_node.className() == "Session"],
-                        f"[green]Objects outside of Session" : [self.__build_node(top_node) for top_node in self._handler.relational_graph.top_level_nodes if top_node.className() != "Session"]}
-        
+    '''
+    def _build_relational_dict(self):
+        self._top_level_objs = list(self._handler.relational_graph.top_level_nodes)
+
+        return self.__build_top_level()
+
+    def __build_top_level(self):
+        """Build top level of the tree from the top level objects
+        """
+        configuration_dict = {f"[green]Sessions" : [top_node for top_node in self._top_level_objs if top_node.className() == "Session"],
+                        f"[green]Objects outside of Session" : [top_node for top_node in self._top_level_objs if top_node.className() != "Session"]}
+
+        # Cycles nothing else refers to have no top level object, show them so they aren't lost
+        cyclic_objs = self._handler.relational_graph.unreachable_cyclic_nodes
+        if cyclic_objs:
+            configuration_dict[f"[red]Objects in cycles"] = cyclic_objs
+
         return configuration_dict
-    
-    def __build_node(self, conf_obj):
-        """Build each node of the relational graph
 
-        Arguments:
-            conf_obj -- Configuration object
-        """        
-        
-        # We can deal with the schema
+    def apply_change(self, change: ConfigurationChange)->None:
+        """Update the top level objects, anything below them is generated on demand
+        """
+        graph = self._handler.relational_graph
+
+        # Only objects whose layer has changed can have moved to/from the top level
+        if change.change_type == ChangeType.NODE_REMOVED and change.conf_obj in self._top_level_objs:
+            self._top_level_objs.remove(change.conf_obj)
+
+        for conf_obj in change.relayered_objs:
+            if graph.is_top_level(conf_obj) and conf_obj not in self._top_level_objs:
+                self._top_level_objs.append(conf_obj)
+            elif not graph.is_top_level(conf_obj) and conf_obj in self._top_level_objs:
+                self._top_level_objs.remove(conf_obj)
+
+        self._relational_dict = self.__build_top_level()
+
+    def has_children(self, conf_obj)->bool:
+        return any(len(rel_objs) for _, rel_objs in self.get_children(conf_obj))
+
+    def get_children(self, conf_obj)->List[Tuple[str, List[Any]]]:
+        """Objects each relationship of a configuration object points to
+        """
         relationships = self._handler.configuration_handler.get_relationships_for_conf_object(conf_obj)
-        
-        if not len(relationships):
-            return conf_obj
-
-        relations_list = []
-        for rel_category in relationships:
-            for rel_type, rel in rel_category.items():
-                # TODO: Better data structure, need class info for now
-                if rel_type=='rel_info':
-                    continue
-                # Bit slower but configuration isn't large enough for this to really matter]
-                relations_list.append({f"[blue]{rel_type}[/blue]": [self.__build_node(r) for r in rel]})
-
-        
-        return {conf_obj: relations_list}
-    
+
+        return [(rel_type, rel) for rel_category in relationships
+                for rel_type, rel in rel_category.items() if rel_type!='rel_info']
+
+    def __repr__(self):
+        return "RelationalSelectionMenu"
+
+class SearchSelectionMenu(SelectionInterface):
+    ''' Selection menu showing the objects best matching a search query
+    '''
+    expand_top_level = True
+
+    def __init__(self, config_handler: StructuredConfiguration):
+        self._query = ""
+        super().__init__(config_handler)
+
+    def _build_relational_dict(self):
+        # Normally built while the configuration loads so it doesn't block the UI
+        if self._handler.search_index is None:
+            self._handler.build_search_index()
+        self._search_index = self._handler.search_index
+        return self.__build_results()
+
+    def __build_results(self):
+        """Objects matching the current query
+        """
+        if not self._query:
+            return {}
+
+        return {f"[green]Matches for '{self._query}'": self._search_index.search(self._query)}
+
+    def search(self, query: str)->List[Any]:
+        """Update the menu to show objects matching a query
+
+        Arguments:
+            query -- Text to search uids/classes/attribute values for
+
+        Returns:
+            Matching objects, best match first
+        """
+        self._query = query.strip()
+        self._relational_dict = self.__build_results()
+        return next(iter(self._relational_dict.values()), [])
+
+    def apply_change(self, change: ConfigurationChange)->None:
+        """Add/remove objects from the search index, objects whose attributes/uid changed are indexed again
+        """
+        match change.change_type:
+            case ChangeType.NODE_ADDED:
+                self._search_index.add_conf_obj(change.conf_obj)
+            case ChangeType.NODE_REMOVED:
+                self._search_index.remove_conf_obj(change.conf_obj)
+            case ChangeType.ATTRIBUTES_CHANGED:
+                self._search_index.remove_conf_obj(change.conf_obj)
+                self._search_index.add_conf_obj(change.conf_obj)
+            case _:
+                return
+
+        self._relational_dict = self.__build_results()
+
     def __repr__(self):
-        return "RelationalSelectionMenu"
\ No newline at end of file
+        return "SearchSelectionMenu"
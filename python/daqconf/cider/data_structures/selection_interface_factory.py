@@ -6,14 +6,14 @@ class SelectionInterfaceFactory:
         """Very simple factory for generating selection interfaces
 
         Arguments:
-            interface_name -- Name of interface (either "class-selection" or "relation-selection")
+            interface_name -- Name of interface ("class-selection", "relation-selection" or "search-selection")
             configuration -- ConfigurationHandler object
 
         Raises:
             Exception: If interface_name is not recognised
 §
         Returns:
-            SelectionInterface -- Either ClassSelectionMenu or RelationalSelectionMenu
+            SelectionInterface -- One of ClassSelectionMenu, RelationalSelectionMenu or SearchSelectionMenu
         """
         match(interface_name):
             case "class-selection":
@@ -23,6 +23,10 @@ class SelectionInterfaceFactory:
             case "relation-selection":
                 from daqconf.cider.data_structures.selection_interface import RelationalSelectionMenu
                 return RelationalSelectionMenu(configuration)
+
+            case "search-selection":
+                from daqconf.cider.data_structures.selection_interface import SearchSelectionMenu
+                return SearchSelectionMenu(configuration)
             
             case _:
                 raise Exception(f"Cannot find {interface_name}")
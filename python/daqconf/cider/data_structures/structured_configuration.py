@@ -2,27 +2,135 @@
 Structed configuration object. Effectively just a ConfigurationHandler with combined with a graph
 """
 
-from daqconf.cider.data_structures.configuration_handler import ConfigurationHandler
+from typing import List
+
+from daqconf.cider.data_structures.configuration_handler import ConfigurationHandler, ProgressCallback
 from daqconf.cider.data_structures.relational_graph import RelationalGraph
+from daqconf.cider.data_structures.search_index import SearchIndex
+from daqconf.cider.data_structures.configuration_change import ChangeType, ConfigurationChange
 
 class StructuredConfiguration:
-    def __init__(self, configuration_file_name: str):
-        """Structured configuration object, essentially a wrapper around a 
-        ConfigurationHandler object and a RelationalGraph object. 
-        
+    def __init__(self, configuration_file_name: str, progress_callback: ProgressCallback | None=None,
+                 build_graph: bool=True):
+        """Structured configuration object, essentially a wrapper around a
+        ConfigurationHandler object and a RelationalGraph object.
+
         Provides access to both the configuration and its relational structure
 
         Arguments:
             configuration_file_name -- name of the configuration .database.xml file to open
-        """        
-        self._configuration_handler = ConfigurationHandler(configuration_file_name)
-        self._relational_graph = RelationalGraph(self._configuration_handler)
-        
+
+        Keyword Arguments:
+            progress_callback -- Called periodically while loading, any exception it raises aborts loading (default: {None})
+            build_graph -- Build the relational graph straight away, otherwise call build_relational_graph later (default: {True})
+        """
+        self._configuration_handler = ConfigurationHandler(configuration_file_name, progress_callback)
+        self._relational_graph: RelationalGraph | None = None
+        self._search_index: SearchIndex | None = None
+
+        if build_graph:
+            self.build_relational_graph(progress_callback)
+
+    def build_relational_graph(self, progress_callback: ProgressCallback | None=None)->None:
+        """(Re)build the relational graph from the configuration
+
+        Keyword Arguments:
+            progress_callback -- Called periodically while the graph is built (default: {None})
+        """
+        self._relational_graph = RelationalGraph(self._configuration_handler, progress_callback)
+
+    def build_search_index(self)->None:
+        """(Re)build the search index over every object in the configuration
+        """
+        self._search_index = SearchIndex(self._configuration_handler)
+
     @property
     def configuration_handler(self)->ConfigurationHandler:
         return self._configuration_handler
-    
+
     @property
-    def relational_graph(self)->RelationalGraph:
+    def relational_graph(self)->RelationalGraph | None:
+        """Relational graph, None if it hasn't been built yet
+        """
         return self._relational_graph
-    
\ No newline at end of file
+
+    @property
+    def search_index(self)->SearchIndex | None:
+        """Search index, None if it hasn't been built yet
+        """
+        return self._search_index
+
+    #==============================  Edits ==============================#
+    # These keep the relational graph in sync with the configuration, the returned
+    # change should be passed on to anything else built from the configuration
+    def add_new_conf_obj(self, class_id: str, uid: str)->ConfigurationChange:
+        """Add new configuration object
+
+        Arguments:
+            class_id -- Class name
+            uid -- Unique object ID
+        """
+        new_dal = self._configuration_handler.add_new_conf_obj(class_id, uid)
+        return self.__apply_change(ChangeType.NODE_ADDED, new_dal)
+
+    def destroy_conf_obj(self, class_id: str, uid: str)->ConfigurationChange:
+        """Destroy a configuration object
+
+        Arguments:
+            class_id -- class name
+            uid -- unique object ID
+        """
+        dal = self._configuration_handler.get_obj(class_id, uid)
+        # Anything referring to the object has it removed from its relationships, graph isn't there
+        # while loading but edits aren't allowed then anyway
+        referrers = self._relational_graph.parents(dal) if self._relational_graph is not None else []
+        self._configuration_handler.destroy_conf_obj(class_id, uid, referrers)
+        return self.__apply_change(ChangeType.NODE_REMOVED, dal)
+
+    def modify_relationship(self, class_id: str, uid: str, relationship_name: str, updated_value,
+                            append: bool=False)->ConfigurationChange:
+        """Modify relationship of a configuration object, see ConfigurationHandler.modify_relationship
+        """
+        self._configuration_handler.modify_relationship(class_id, uid, relationship_name, updated_value, append)
+        return self.relationships_changed(self._configuration_handler.get_obj(class_id, uid))
+
+    def set_conf_obj_attribute(self, conf_obj, name: str, value)->ConfigurationChange:
+        """Set an attribute of a configuration object, see ConfigurationHandler.set_conf_obj_attribute
+        """
+        self._configuration_handler.set_conf_obj_attribute(conf_obj, name, value)
+        return self.__apply_change(ChangeType.ATTRIBUTES_CHANGED, conf_obj)
+
+    def rename_conf_obj(self, conf_obj, new_name: str)->ConfigurationChange:
+        """Rename a configuration object, see ConfigurationHandler.rename_conf_obj
+        """
+        self._configuration_handler.rename_conf_obj(conf_obj, new_name)
+        return self.__apply_change(ChangeType.ATTRIBUTES_CHANGED, conf_obj)
+
+    def undo(self)->List[ConfigurationChange]:
+        """Undo the most recent edit (or batch of edits), see ConfigurationHandler.undo
+        """
+        return [self.__apply_change(change_type, conf_obj) for change_type, conf_obj in self._configuration_handler.undo()]
+
+    def redo(self)->List[ConfigurationChange]:
+        """Redo the most recently undone edit (or batch of edits), see ConfigurationHandler.redo
+        """
+        return [self.__apply_change(change_type, conf_obj) for change_type, conf_obj in self._configuration_handler.redo()]
+
+    def relationships_changed(self, conf_obj)->ConfigurationChange:
+        """Notify that the relationships of an object have been modified directly
+
+        Arguments:
+            conf_obj -- Modified configuration object
+        """
+        return self.__apply_change(ChangeType.EDGES_CHANGED, conf_obj)
+
+    def __apply_change(self, change_type: ChangeType, conf_obj)->ConfigurationChange:
+        # Graph hasn't been built yet, it will pick up the edit when it is. Attributes aren't part of the graph
+        if self._relational_graph is None or change_type == ChangeType.ATTRIBUTES_CHANGED:
+            return ConfigurationChange(change_type, conf_obj)
+
+        # Find everything referring to the object before any links to it are removed
+        change = ConfigurationChange(change_type, conf_obj,
+                                     affected_objs=self._relational_graph.ancestors(conf_obj))
+        change.relayered_objs = self._relational_graph.apply_change(change)
+        return change
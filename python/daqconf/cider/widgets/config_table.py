@@ -1,6 +1,8 @@
 '''
 Table for displaying DAL information
 '''
+from typing import Dict
+
 from textual.widgets import Static, DataTable
 from textual.reactive import reactive
 
@@ -8,11 +10,21 @@ from daqconf.cider.widgets.popups.edit_cell_screen import EditCellScreen
 from daqconf.cider.widgets.configuration_controller import ConfigurationController
 
 class ConfigTable(Static):
+    BINDINGS = [("m", "show_more", "Show More Values")]
     
     # Columns in table
     __COLS = reactive([("Attribute", "Value", "Type", "Is Multivalue"), ("", "","","")])
     # Empty data table
     _data_table = DataTable()
+    # Number of values of a multi-value attribute shown at a time
+    _PAGE_SIZE = 16
+    # Longest string shown in full
+    _MAX_VALUE_LENGTH = 256
+    # Object currently displayed + cells displayed for each attribute
+    _displayed_obj = None
+    _displayed_rows: Dict[str, tuple] = {}
+    # Number of values shown for each paged attribute
+    _n_shown_values: Dict[str, int] = {}
     
     def on_mount(self):
         """Initialise the table object
@@ -43,30 +55,93 @@ class ConfigTable(Static):
         yield self._data_table
     
     def update_table(self, config_instance):
-        """Updates table to display currently selected configuration object
+        """Updates table to display currently selected configuration object. Only cells which have
+        changed are updated, the table is only rebuilt when the class of the object changes
 
         Arguments:
             config_instance -- DAL configuration object
         """
-        
-        # Need to clear the table first
-        self._data_table.clear()
-        
+        if config_instance is not self._displayed_obj:
+            # Start from the first page of every attribute for a new object
+            self._n_shown_values = {}
+            self._displayed_obj = config_instance
+
         # Get attributes for DAL
-        attributes = self._controller.configuration.attributes(config_instance.className(), True)
-        
-        # Loop over + dispaly attributes
-        for attr_name, attr_properties in attributes.items():
-            attr_val = getattr(config_instance, attr_name)
-            
-            # If not set we still display the default value as defined in the schema
-            if attr_val=='':
-                attr_val = attr_properties['init-value']
-                
-            # Dispalyattribute
-            else:
-                self._data_table.add_row(attr_name, attr_val, attr_properties['type'], attr_properties['multivalue'])
+        attributes = self._controller.handler.configuration_handler.get_class_attributes(config_instance.className())
+
+        rows = {attr_name: self.__make_row(config_instance, attr_name, attr_properties)
+                for attr_name, attr_properties in attributes.items()}
+
+        # Different attributes, need to clear the table first
+        if rows.keys() != self._displayed_rows.keys():
+            self._data_table.clear()
+            for attr_name, row in rows.items():
+                self._data_table.add_row(*row, key=attr_name)
+
+        else:
+            for attr_name, row in rows.items():
+                for col, cell, displayed_cell in zip(self.__COLS[0], row, self._displayed_rows[attr_name]):
+                    if cell != displayed_cell:
+                        self._data_table.update_cell(attr_name, col, cell)
+
+        self._displayed_rows = rows
+
+    def __make_row(self, config_instance, attr_name: str, attr_properties: dict)->tuple:
+        """Generate the cells displayed for a single attribute
+
+        Arguments:
+            config_instance -- DAL configuration object
+            attr_name -- Name of attribute
+            attr_properties -- Schema info for the attribute
+        """
+        attr_val = getattr(config_instance, attr_name)
+
+        # If not set we still display the default value as defined in the schema
+        if attr_val=='':
+            attr_val = attr_properties['init-value']
+
+        return (attr_name, self.__format_value(attr_name, attr_val), attr_properties['type'], attr_properties['multivalue'])
+
+    def __format_value(self, attr_name: str, attr_val)->str:
+        """Only show the first page of large multi-value attributes/long strings,
+        rendering these in full is the main cost of displaying an object
+
+        Arguments:
+            attr_name -- Name of attribute
+            attr_val -- Value of attribute
+        """
+        if isinstance(attr_val, list):
+            n_shown = self._n_shown_values.get(attr_name, self._PAGE_SIZE)
+            if len(attr_val) > n_shown:
+                return f"{attr_val[:n_shown]} ... (+{len(attr_val)-n_shown} more)"
+            return str(attr_val)
+
+        attr_val = str(attr_val)
+        if len(attr_val) > self._MAX_VALUE_LENGTH:
+            return f"{attr_val[:self._MAX_VALUE_LENGTH]} ... (+{len(attr_val)-self._MAX_VALUE_LENGTH} characters)"
+        return attr_val
+
+    def action_show_more(self)->None:
+        """Show the next page of the highlighted multi-value attribute
+        """
+        if self._displayed_obj is None or not self._data_table.row_count:
+            return
+
+        row_key = self._data_table.coordinate_to_cell_key(self._data_table.cursor_coordinate).row_key
+        attr_name = row_key.value
+        if attr_name not in self._displayed_rows:
+            return
+
+        self._n_shown_values[attr_name] = self._n_shown_values.get(attr_name, self._PAGE_SIZE) + self._PAGE_SIZE
+        self.update_table(self._displayed_obj)
                 
+    def clear_table(self)->None:
+        """Remove the displayed object from the table
+        """
+        self._data_table.clear()
+        self._displayed_obj = None
+        self._displayed_rows = {}
+
     @property
     def data_table(self)->DataTable:
         return self._data_table
@@ -1,14 +1,18 @@
 import confmodel
 
+import time
 from typing import Dict
 
+from textual import work
 from textual.widgets import Static
 from textual.message import Message
+from textual.worker import Worker, get_current_worker
 
 from daqconf.cider.data_structures.structured_configuration import StructuredConfiguration
 from daqconf.cider.data_structures.configuration_handler import ConfigurationHandler
 from daqconf.cider.data_structures.selection_interface_factory import SelectionInterfaceFactory
 from daqconf.cider.data_structures.selection_interface import SelectionInterface
+from daqconf.cider.data_structures.configuration_change import ChangeType, ConfigurationChange
 
 class ConfigurationController(Static):    
     """Controller widget for the full configuration. In principal this is 
@@ -19,6 +23,12 @@ class ConfigurationController(Static):
     _handler: StructuredConfiguration | None = None
     _selection_interfaces: Dict[str, SelectionInterface] = {}
     _current_selected_object = None
+    # Set while a configuration is being loaded in the background
+    _loading_file_name: str | None = None
+    # (handler, interfaces, selected object) to go back to if a load is abandoned after the new handler was swapped in
+    _previous_state: tuple | None = None
+    # Minimum time between progress updates in the log [s]
+    _PROGRESS_INTERVAL = 0.5
 
     def on_mount(self):
         self._logger = self.app.query_one("RichLogWError")
@@ -32,7 +42,7 @@ class ConfigurationController(Static):
             new_class -- Class of DAL
         """        
         if self.handler is not None:
-            self._current_selected_object = self.handler.configuration_handler.get_obj(new_id, new_class)
+            self._current_selected_object = self.handler.configuration_handler.get_obj(new_class, new_id)
     
     @property
     def current_dal(self):
@@ -61,13 +71,16 @@ class ConfigurationController(Static):
         """
         if self.handler is None:
             self._logger.write_error("No handler has been setup")
+            return
 
-        
+        self.__loading_error()
         try:
-            setattr(self._current_selected_object, attr_name, update_value)
-            self._handler.configuration_handler.configuration.update_dal(self._current_selected_object)        
+            change = self._handler.set_conf_obj_attribute(self._current_selected_object, attr_name, update_value)
         except Exception as _:
             self._logger.write_error(f"Could not update [yellow]{attr_name}[/yellow] to [yellow]{update_value}[/yellow] for {self.generate_rich_string(self._current_selected_object)}")
+            return
+
+        self.__propagate_change(change)
 
     def new_handler_from_str(self, file_name: str):
         """Set new handler object by file name
@@ -79,6 +92,134 @@ class ConfigurationController(Static):
             self._handler = StructuredConfiguration(file_name)
         except:
             self._logger.write_error(f"Could not load configuration from [bold yellow]{file_name}[/bold yellow]")
+
+    #==============================  Background loading ==============================#
+    class IndexReady(Message):
+        def __init__(self, file_name: str):
+            """Notify that all objects have been loaded, the relational graph may still be being built"""
+            super().__init__()
+            self.file_name = file_name
+
+    class GraphReady(Message):
+        def __init__(self, file_name: str):
+            """Notify that the relational graph has been built"""
+            super().__init__()
+            self.file_name = file_name
+
+    class LoadingAbandoned(Message):
+        def __init__(self, file_name: str):
+            """Notify that loading was cancelled or failed, the previous configuration (if any) is back in place"""
+            super().__init__()
+            self.file_name = file_name
+
+    @property
+    def is_loading(self)->bool:
+        """Check if a configuration is currently being loaded
+        """
+        return self._loading_file_name is not None
+
+    def load_configuration(self, file_name: str)->None:
+        """Load a configuration without blocking the app. Any load already in progress is cancelled.
+        Posts IndexReady once objects can be browsed and GraphReady once the relational graph is built.
+        If loading is cancelled or fails in between, the previously open configuration is restored
+        and LoadingAbandoned posted
+
+        Arguments:
+            file_name -- New database to load
+        """
+        # Starting the new worker cancels the old one, don't keep its half loaded configuration
+        if self.is_loading:
+            self.workers.cancel_group(self, "configuration-loading")
+            self.__roll_back()
+
+        self._loading_file_name = file_name
+        self._logger.write(f"[green]Loading configuration from[/green] [bold yellow]{file_name}[/bold yellow]")
+        self.__load_configuration_worker(file_name)
+
+    def cancel_loading(self)->None:
+        """Cancel the configuration currently being loaded
+        """
+        if not self.is_loading:
+            self._logger.write_error("No configuration is being loaded")
+            return
+
+        self.workers.cancel_group(self, "configuration-loading")
+        self._logger.write(f"[red]Cancelled loading[/red] [bold yellow]{self._loading_file_name}[/bold yellow]")
+        self.__roll_back()
+        self.post_message(self.LoadingAbandoned(self._loading_file_name))
+        self._loading_file_name = None
+
+    @work(thread=True, exclusive=True, group="configuration-loading")
+    def __load_configuration_worker(self, file_name: str)->None:
+        """Opens the configuration, then builds the relational graph [runs in a thread]
+        """
+        worker = get_current_worker()
+        last_update = [0.0]
+
+        def report_progress(stage: str, n_done: int, n_total: int):
+            # Only place we can stop a thread worker
+            if worker.is_cancelled:
+                raise Exception(f"Loading {file_name} cancelled")
+
+            if time.monotonic() - last_update[0] > self._PROGRESS_INTERVAL or n_done==n_total:
+                last_update[0] = time.monotonic()
+                self.app.call_from_thread(self._logger.write, f"   [green]{stage}:[/green] {n_done}/{n_total}")
+
+        try:
+            handler = StructuredConfiguration(file_name, report_progress, build_graph=False)
+            # Built here rather than when the search interface is added, which happens on the UI thread
+            handler.build_search_index()
+            report_progress("Indexing for search", 1, 1)
+            self.app.call_from_thread(self.__index_ready, worker, file_name, handler)
+
+            handler.build_relational_graph(report_progress)
+            self.app.call_from_thread(self.__graph_ready, worker, file_name)
+
+        except Exception as e:
+            if not worker.is_cancelled:
+                self.app.call_from_thread(self.__loading_failed, worker, file_name, e)
+
+    def __index_ready(self, worker: Worker, file_name: str, handler: StructuredConfiguration)->None:
+        """Swap to the newly loaded configuration, only the class view is available until the graph is built"""
+        if worker.is_cancelled:
+            return
+
+        self._previous_state = (self._handler, self._selection_interfaces, self._current_selected_object)
+        self._handler = handler
+        self._current_selected_object = None
+        self._selection_interfaces = {}
+        self.add_interface("class-selection")
+        self.add_interface("search-selection")
+        self._logger.write(f"   [green]Loaded {handler.configuration_handler.n_dals} objects, building session view[/green]")
+        self.post_message(self.IndexReady(file_name))
+
+    def __graph_ready(self, worker: Worker, file_name: str)->None:
+        if worker.is_cancelled:
+            return
+
+        self._loading_file_name = None
+        self._previous_state = None
+        self.add_interface("relation-selection")
+        self.post_message(self.GraphReady(file_name))
+
+    def __loading_failed(self, worker: Worker, file_name: str, error: Exception)->None:
+        if worker.is_cancelled:
+            return
+
+        self._loading_file_name = None
+        self._logger.write_error(f"Could not load configuration from [bold yellow]{file_name}[/bold yellow]: {error}")
+        self.__roll_back()
+        self.post_message(self.LoadingAbandoned(file_name))
+
+    def __roll_back(self)->None:
+        """Go back to the configuration open before the current load swapped in its (incomplete) handler"""
+        if self._previous_state is None:
+            return
+
+        self._handler, self._selection_interfaces, self._current_selected_object = self._previous_state
+        self._previous_state = None
+        if self._handler is not None:
+            self._logger.write("[yellow]Restored the previously opened configuration[/yellow]")
             
     @property
     def handler(self)->StructuredConfiguration | None:
@@ -136,25 +277,68 @@ class ConfigurationController(Static):
     def commit_configuration(self, message: str)->None:
         """Save configuration with a message to database
         """        
-        self._handler.configuration_handler.commit(message)
-        self._logger.write(f"[green]Saved configuration with message:[/green] [red]{message}[/red]")
+        n_pending = self._handler.configuration_handler.journal.n_pending
+        write_time = self._handler.configuration_handler.commit(message)
+        self._logger.write(f"[green]Saved configuration with message:[/green] [red]{message}[/red] "
+                           f"[green]({n_pending} modified objects, written in {write_time:.2f} s)[/green]")
 
     def rename_dal(self, new_name: str)->None:
         """Rename the currently selected object [NOT TESTED]
         """        
-        self._current_selected_object.rename(new_name)
-        self._handler.configuration_handler.configuration.update_dal(self._current_selected_object)    
+        self.__loading_error()
+        self.__propagate_change(self._handler.rename_conf_obj(self._current_selected_object, new_name))
+        # Labels of every tree the object appears in have changed
+        for interface in self._selection_interfaces.values():
+            interface.recompose()
+
+    def undo(self)->None:
+        """Undo the most recent edit
+        """
+        self.__loading_error()
+        description = self._handler.configuration_handler.journal.undo_description
+        if description is None:
+            self._logger.write_error("Nothing to undo")
+            return
+
+        for change in self._handler.undo():
+            self.__propagate_change(change)
+        self._logger.write(f"[green]Undid[/green] {description}")
+
+    def redo(self)->None:
+        """Redo the most recently undone edit
+        """
+        self.__loading_error()
+        description = self._handler.configuration_handler.journal.redo_description
+        if description is None:
+            self._logger.write_error("Nothing to redo")
+            return
+
+        for change in self._handler.redo():
+            self.__propagate_change(change)
+        self._logger.write(f"[green]Redid[/green] {description}")
+
+    def __propagate_change(self, change: ConfigurationChange)->None:
+        """Update all selection interfaces following an edit to the configuration
+        """
+        for interface in self._selection_interfaces.values():
+            interface.apply_change(change)
+
+        # Can't keep showing an object which no longer exists
+        if change.change_type == ChangeType.NODE_REMOVED and change.conf_obj is self._current_selected_object:
+            self._current_selected_object = None
 
     def add_new_conf_obj(self, class_id: str, uid: str):
         """Add new object to configuration
         """        
-        self._handler.configuration_handler.add_new_conf_obj(class_id, uid)
+        self.__loading_error()
+        self.__propagate_change(self._handler.add_new_conf_obj(class_id, uid))
         self._logger.write(f"[green]Added new configuration object[/green] [red]{class_id}[/red]@[yellow]{uid}[/yellow]")
         
     def destroy_conf_obj(self, class_id: str, uid: str):
         """Destroy object in configuration
         """
-        self._handler.configuration_handler.destroy_conf_obj(class_id, uid)
+        self.__loading_error()
+        self.__propagate_change(self._handler.destroy_conf_obj(class_id, uid))
         self._logger.write(f"[green]Destroyed configuration object[/green] [red]{class_id}[/red]@[yellow]{uid}[/yellow]")
 
     def destroy_current_object(self):
@@ -172,7 +356,7 @@ class ConfigurationController(Static):
             self._logger.write_error("No object selected")
             return False
         
-        if self._current_selected_object not in self._handler.configuration_handler.get_all_conf_classes()['Component']:
+        if not self._handler.configuration_handler.is_conf_obj_of_class(self._current_selected_object, 'Component'):
             self._logger.write_error(f"Cannot disable {self.generate_rich_string(self._current_selected_object)} must inherit from [red]Component[/red]!")
             return False
 
@@ -183,36 +367,44 @@ class ConfigurationController(Static):
         """Disable current object in configuration
         """
                 
+        self.__loading_error()
         self._logger.write("\n[red]=============================") 
         # DAL as configuration object        
         # Loop over all sessions [note currently this is badly implemented]
-        for session, toggle_enable in selection_menu:
-            session_disabled_elements = session.disabled
+        # All sessions are undone together
+        with self._handler.configuration_handler.journal.batch(f"Toggle disable {getattr(self._current_selected_object, 'id')}"):
+            for session, toggle_enable in selection_menu:
+                # Copy so the journal keeps the old value
+                session_disabled_elements = list(session.disabled)
 
 
-            # Make sure if nothing's happening we don't do anything
-            if self._current_selected_object not in session_disabled_elements and toggle_enable:
-                return
+                # Make sure if nothing's happening we don't do anything
+                if self._current_selected_object not in session_disabled_elements and toggle_enable:
+                    return
             
-            elif self._current_selected_object in session_disabled_elements and not toggle_enable:
-                return
-
-            if toggle_enable:
-                self._logger.write(f"Enabling {self.generate_rich_string(self._current_selected_object)} in {self.generate_rich_string(session)}")
-                if self._current_selected_object in session_disabled_elements:            
-                    session_disabled_elements.remove(self._current_selected_object)
-            else:
-                self._logger.write(f"Disabling {self.generate_rich_string(self._current_selected_object)} in {self.generate_rich_string(session)}")
+                elif self._current_selected_object in session_disabled_elements and not toggle_enable:
+                    return
+
+                if toggle_enable:
+                    self._logger.write(f"Enabling {self.generate_rich_string(self._current_selected_object)} in {self.generate_rich_string(session)}")
+                    if self._current_selected_object in session_disabled_elements:            
+                        session_disabled_elements.remove(self._current_selected_object)
+                else:
+                    self._logger.write(f"Disabling {self.generate_rich_string(self._current_selected_object)} in {self.generate_rich_string(session)}")
                 
-                if self._current_selected_object not in session_disabled_elements:
-                    session_disabled_elements.append(self._current_selected_object)
+                    if self._current_selected_object not in session_disabled_elements:
+                        session_disabled_elements.append(self._current_selected_object)
                 
-            session.disabled = session_disabled_elements
-            self._handler.configuration_handler.configuration.update_dal(session)        
+                self._handler.configuration_handler.set_conf_obj_attribute(session, 'disabled', session_disabled_elements)
+                self.__propagate_change(self._handler.relationships_changed(session))
         self._logger.write("[red]=============================\n")
 
 
     def get_all_sessions(self)->list:
+        # Graph may not have been built yet
+        if self._handler.relational_graph is None:
+            return self._handler.configuration_handler.get_conf_objects_class("Session")
+
         return [top_object for top_object in self._handler.relational_graph.top_level_nodes\
                             if top_object.className() == "Session"]
         
@@ -223,9 +415,15 @@ class ConfigurationController(Static):
 
     def __no_handler_error(self):
         """Raise error if no handler is setup"""
-        if self._handler.configuration_handler is None:
+        if self._handler is None or self._handler.configuration_handler is None:
             raise Exception("No handler has been setup")
 
+    def __loading_error(self):
+        """Raise error if the configuration can't be edited yet"""
+        self.__no_handler_error()
+        if self.is_loading:
+            raise Exception(f"Cannot edit configuration while {self._loading_file_name} is loading")
+
     class Changed(Message):
         def __init__(self, dal: object):
             """Notify if/when configuration is changed"""
@@ -234,22 +432,24 @@ class ConfigurationController(Static):
             
     def modify_current_dal_relationship(self, relationship_name: str, updated_value, append: bool=False):
         # Wrapper method for changing value of relationship to anythings
-        self.__no_handler_error()
-        self.handler.configuration_handler.modify_relationship(self._current_selected_object.className(),
-                                          getattr(self._current_selected_object, 'id'),
-                                          relationship_name, updated_value, append)
+        self.__loading_error()
+        self.__propagate_change(
+            self.handler.modify_relationship(self._current_selected_object.className(),
+                                             getattr(self._current_selected_object, 'id'),
+                                             relationship_name, updated_value, append))
         
     def remove_current_dal_relationship(self, relationship_name):
         # Wrapper method for setting relationship value to None
-        self.__no_handler_error()
-        self.handler.configuration_handler.modify_relationship(self._current_selected_object.className(),
-                                          getattr(self._current_selected_object, 'id'),
-                                          relationship_name, 
-                                          None)
+        self.__loading_error()
+        self.__propagate_change(
+            self.handler.modify_relationship(self._current_selected_object.className(),
+                                             getattr(self._current_selected_object, 'id'),
+                                             relationship_name,
+                                             None))
 
     def pop_dal_relationship(self, relationship_name, dal_to_remove):
         # Wrapper method for removing dal from multi-value relationship
-        self.__no_handler_error()
+        self.__loading_error()
         
         if dal_to_remove is None:
             raise Exception("Relationship is already emptied")
@@ -271,14 +471,15 @@ class ConfigurationController(Static):
         relationships.pop(dal_idx)
         
         
-        setattr(self._current_selected_object, relationship_name, relationships)
+        self._handler.configuration_handler.set_conf_obj_attribute(self._current_selected_object, relationship_name, relationships)
+        self.__propagate_change(self._handler.relationships_changed(self._current_selected_object))
         
     # Some wrapper methods to avoid needing to call the base handler object
     def get_dals_of_class(self, dal_class: str):
         return self._handler.configuration_handler.get_conf_objects_class(dal_class)
     
     def get_list_of_classes(self):
-        return list(self._handler.configuration_handler.get_all_conf_classes().keys())
+        return self._handler.configuration_handler.conf_classes
     
     def get_relations_to_current_dal(self):
         return self._handler.configuration_handler.get_relationships_for_conf_object(self.current_dal)
@@ -40,8 +40,8 @@ class EditCellScreen(ModalScreen):
         """Finds the cell that was clicked and populates the input field
         """        
         cell_input = self.query_one(Input)
-        # Harcoded...
-        cell_input.value = str(self._current_row[1])
+        # Table only shows part of large values so get the full value from the object
+        cell_input.value = str(getattr(self._controller.current_dal, self._current_row[0]))
         cell_input.focus()
 
     def on_input_submitted(self, event: Input.Submitted) -> None:
@@ -96,7 +96,8 @@ class OpenFile(__MenuWithButtons):
         
         self._button_labels = {
             "open" : {"label": "Open", "variant": "success"},
-            "browse" : {"label": "Browse [DOESN'T WORK]", "variant": "warning"}
+            "browse" : {"label": "Browse [DOESN'T WORK]", "variant": "warning"},
+            "stop" : {"label": "Stop Loading", "variant": "error"}
         }
         """
         Concrete class for opening a configuration file
@@ -132,6 +133,10 @@ class OpenFile(__MenuWithButtons):
             case "browse":
                 logger = self._main_screen.query_one("RichLogWError")
                 logger.write_error("Sorry not done this yet, please enter full file path and hit enter/open!")
+
+            case "stop":
+                # Menus waiting on the configuration are refreshed once the controller has rolled back
+                self._config_controller.cancel_loading()
             case _:
                 return
 
@@ -0,0 +1,51 @@
+from os import environ
+
+from textual.screen import ModalScreen
+from textual.app import ComposeResult
+from textual.widgets import Input, Tree
+from textual.containers import Container
+
+from daqconf.cider.widgets.configuration_controller import ConfigurationController
+from daqconf.cider.widgets.selection_menu import SelectionMenu
+
+class SearchScreen(ModalScreen):
+    css_file_path = f"{environ.get('DAQCONF_SHARE')}/config/textual_dbe/textual_css"
+
+    CSS_PATH = f"{css_file_path}/search_layout.tcss"
+
+    BINDINGS = [("escape", "app.pop_screen", "Close Search")]
+
+    def __init__(self, name: str | None = None, id: str | None = None, classes: str | None = None) -> None:
+        """Popup for searching for configuration objects by uid, class or attribute value
+        """
+        super().__init__(name=name, id=id, classes=classes)
+        main_screen = self.app.get_screen("main")
+        self._controller = main_screen.query_one(ConfigurationController)
+        self._search_interface = self._controller.get_interface()["search-selection"]
+
+    def compose(self) -> ComposeResult:
+        with Container(id="search_box"):
+            yield Input(placeholder="Search by UID, class or attribute value", id="search_input")
+            yield SelectionMenu(id="search-selection")
+
+    def on_mount(self) -> None:
+        self.query_one(Input).focus()
+
+    def on_input_changed(self, event: Input.Changed) -> None:
+        """Update matches as the query is typed
+        """
+        self._search_interface.search(event.value)
+        self.query_one(SelectionMenu).refresh(recompose=True)
+
+    def on_input_submitted(self, event: Input.Submitted) -> None:
+        """Jump straight to the best match
+        """
+        matches = self._search_interface.search(event.value)
+        if matches:
+            self._controller.current_dal = matches[0]
+            self.app.pop_screen()
+
+    def on_tree_node_selected(self, event: Tree.NodeSelected) -> None:
+        # SelectionMenu has already updated the controller
+        if event.node.data is not None:
+            self.app.pop_screen()
@@ -1,5 +1,5 @@
-from typing import Any
-import numpy as np
+from functools import partial
+from typing import Any, Callable, Dict, Tuple
 
 from textual.widgets import Static, Tree
 from textual.widgets.tree import TreeNode
@@ -7,105 +7,126 @@ from daqconf.cider.widgets.configuration_controller import ConfigurationControll
 
 class SelectionMenu(Static):
     '''
-    Basic selection menu, builds tree from selection objects
+    Basic selection menu, builds tree from selection objects. Children of a node are only
+    added to the tree once the node is expanded
     '''
     _tree = None
-    __node_states = {}
-    
-    def compose(self):            
+    # Expanded state of each node, keyed by the menu + labels leading to the node
+    __node_states: Dict[Tuple[str, ...], bool] = {}
+
+    def compose(self):
         self._build_tree()
         yield self._tree
-    
+
     def _build_tree(self):
-        """Iteratively builds tree via dictionary. This should be generated in SelectionInterface"""
+        """Builds top level of the tree via dictionary. This should be generated in SelectionInterface"""
 
         # Grab current tree + config controller
         if self._tree is not None:
             self._tree.clear()
-    
+
         self._tree = Tree("Configuration:")
+        # Functions to fill in the children of nodes which haven't been expanded yet
+        self._unexpanded_nodes: Dict[int, Callable[[], None]] = {}
+
         main_screen = self.app.get_screen("main")
         self._controller = main_screen.query_one("ConfigurationController")
 
-        # Loop over interfaces + make sure they're up to date with config
-        for key, interface in self._controller.get_interface().items():
-            interface.recompose()
-
+        # Interfaces are kept up to date with the configuration by the controller
         # Check if the current interface is in the controller
         if self.id not in self._controller.get_interface().keys():
-            raise ValueError(f"Cannot find {self._interface_label} in controller. \n  \
-                             available interfaces are {self._controller.get_interface()}")
+            # Some interfaces need the whole configuration to be processed so are only added once loading finishes
+            if self._controller.is_loading:
+                self._tree.root.add_leaf("[yellow]Still loading configuration...[/yellow]")
+            else:
+                self._tree.root.add_leaf("[red]Not available, configuration did not finish loading[/red]")
+            self._tree.root.expand()
+            return
 
-        # Grab root of tree        
+        self._interface = self._controller.get_interface()[self.id]
+
+        # Grab root of tree
         tree_root = self._tree.root
         tree_root.expand()
-        
-        # Sort out the tree nodes to be alphabetical + loop overtop level noes  
-        for key, branch in sorted(self._controller.get_interface()[self.id].relationships.items()):
-            tree_node = tree_root.add(f"[green]{key}[/green]", expand=False)
-            if  self.__node_states.get(tree_node.id):
-                tree_node.expand()
-                
-            self.__build_tree_node(tree_node, branch, is_disabled=False, disabled_elements=[])
-        
-
-    def __build_tree_node(self, input_node: TreeNode, input_list: list, is_disabled: bool=False, disabled_elements: list=[]):
-        """Recursively build tree nodes from a list of dictionaries"""
-        
-        # Check if we need to remove the node since it's empty
-        if len(input_list)==0:
-            input_node.remove()
-
-        # Loop over the input list
-        for config_item in input_list:
-            # Check if it has sub-levels
-            if isinstance(config_item, dict):
-                # Print the DAL name
-                config_key = list(config_item.keys())[0]
-                config_objects = list(config_item.values())[0]
-
-                # Need to be able to add categories so check if it's just a string
-                if isinstance(config_key, str):
-                    item_disabled = is_disabled
-                    dal_str = config_key
-                    stored_data=None #
-
-                else: 
-                    if config_key.className() == "Session":
-                        disabled_elements = config_key.disabled
-                        # Remove the ResourceBase object since it just doubly defines disabled items
-                
-                    # Check if the item is disabled
-                    item_disabled = self.__check_item_disabled(config_key, disabled_elements) or is_disabled
-                    
-                    dal_str = self._controller.generate_rich_string(config_key, item_disabled)
-                    stored_data = config_key
-                
-                # Bit confusing, set ensure we're not multiply defining things in the tree,
-                # for example disabled items in a session may also be defined elsewhere
-                tree_node = input_node.add(dal_str, data=stored_data)
-                if self.__node_states.get(tree_node.id):
-                    tree_node.expand()
-
-                self.__build_tree_node(tree_node, config_objects, item_disabled, disabled_elements)
-                                
-            else:
-                # No sub-levels, just add the leaf
-                item_disabled = self.__check_item_disabled(config_item, disabled_elements) or is_disabled
-                input_node.add_leaf(self._controller.generate_rich_string(config_item, item_disabled), data=config_item)
+
+        # Sort out the tree nodes to be alphabetical + loop overtop level noes
+        for key, branch in sorted(self._interface.relationships.items()):
+            self.__add_category_node(tree_root, f"[green]{key}[/green]", branch, is_disabled=False, disabled_elements=[],
+                                     expand=self._interface.expand_top_level)
+
+    def __add_category_node(self, input_node: TreeNode, label: str, conf_objs: list,
+                            is_disabled: bool=False, disabled_elements: list=[], expand: bool=False):
+        """Add node grouping a list of configuration objects, skipped if there are no objects"""
+        if len(conf_objs)==0:
+            return
+
+        tree_node = input_node.add(label, expand=False)
+        self._unexpanded_nodes[tree_node.id] = partial(self.__add_conf_obj_nodes, tree_node, conf_objs,
+                                                       is_disabled, disabled_elements)
+        self.__restore_node_state(tree_node, expand)
+
+    def __add_conf_obj_nodes(self, input_node: TreeNode, conf_objs: list, is_disabled: bool=False,
+                             disabled_elements: list=[]):
+        """Add a node for each configuration object"""
+        for conf_obj in conf_objs:
+            # No sub-levels, just add the leaf
+            if not self._interface.has_children(conf_obj):
+                item_disabled = self.__check_item_disabled(conf_obj, disabled_elements) or is_disabled
+                input_node.add_leaf(self._controller.generate_rich_string(conf_obj, item_disabled), data=conf_obj)
+                continue
+
+            obj_disabled_elements = disabled_elements
+            if conf_obj.className() == "Session":
+                obj_disabled_elements = conf_obj.disabled
+
+            # Check if the item is disabled
+            item_disabled = self.__check_item_disabled(conf_obj, obj_disabled_elements) or is_disabled
+
+            tree_node = input_node.add(self._controller.generate_rich_string(conf_obj, item_disabled), data=conf_obj)
+            self._unexpanded_nodes[tree_node.id] = partial(self.__add_relation_nodes, tree_node, conf_obj,
+                                                           item_disabled, obj_disabled_elements)
+            self.__restore_node_state(tree_node)
+
+    def __add_relation_nodes(self, input_node: TreeNode, conf_obj: Any, is_disabled: bool=False,
+                             disabled_elements: list=[]):
+        """Add a node for each relationship of a configuration object"""
+        for rel_name, rel_objs in self._interface.get_children(conf_obj):
+            self.__add_category_node(input_node, f"[blue]{rel_name}[/blue]", rel_objs, is_disabled, disabled_elements)
+
+    def __populate_node(self, tree_node: TreeNode):
+        """Add children to a node if they haven't been added already"""
+        add_children = self._unexpanded_nodes.pop(tree_node.id, None)
+        if add_children is not None:
+            add_children()
+
+    def __restore_node_state(self, tree_node: TreeNode, expand: bool=False):
+        """Expand node if it was expanded before the tree was rebuilt"""
+        if self.__node_states.get(self.__node_path(tree_node), expand):
+            self.__populate_node(tree_node)
+            tree_node.expand()
+
+    def __node_path(self, tree_node: TreeNode)->Tuple[str, ...]:
+        """Labels leading to a node, node IDs change whenever the tree is rebuilt"""
+        path = [self.id]
+        while tree_node is not None:
+            path.append(str(tree_node.label))
+            tree_node = tree_node.parent
+        return tuple(path)
+
+    def on_tree_node_expanded(self, event: Tree.NodeExpanded):
+        self.__populate_node(event.node)
+        self.__node_states[self.__node_path(event.node)] = True
+
+    def on_tree_node_collapsed(self, event: Tree.NodeCollapsed):
+        self.__node_states[self.__node_path(event.node)] = False
 
     def on_tree_node_selected(self, event):
-        # Selector
-        controller:ConfigurationController = self.app.query_one("ConfigurationController")
-        
-        if event.node.data is not None: 
+        # Selector, the menu may be on a popup (e.g. search) so look on the main screen
+        controller:ConfigurationController = self.app.get_screen("main").query_one("ConfigurationController")
+
+        if event.node.data is not None:
             controller.current_dal = event.node.data
-    
-        self.__node_states[event.node.id] = event.node.is_expanded
-    
+
     def __check_item_disabled(self, item, disabled_elements):
         """Check if an item is disabled [currently unecessary extra method but may be useful in extended version]"""
         return item in disabled_elements
-    
-    # Cache the tree state?
-    
\ No newline at end of file
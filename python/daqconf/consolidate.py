@@ -1,121 +1,402 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
 from pathlib import Path
 import conffwk
-import sys
+import hashlib
+import multiprocessing
 import os
+import time
 from logging import getLogger
+
+from daqconf.dal_helpers import dal_key, find_reachable, get_object_summary
+from daqconf.oks_includes import locate_include_file, parse_includes
 log = getLogger('daqconf.consolidate')
 
 
-def get_all_includes(db, file):
-    includes = db.get_includes(file)
-    for include in includes:
-        if "data.xml" not in include:
+class PhaseTimer:
+    """Time consecutive phases of a consolidation"""
+    def __init__(self):
+        self.timings = {}
+        self._start = self._last = time.perf_counter()
+
+    def __call__(self, phase):
+        """End a phase, started when the previous phase ended"""
+        now = time.perf_counter()
+        self.timings[phase] = now - self._last
+        self._last = now
+
+    def report(self, what):
+        self.timings["total"] = time.perf_counter() - self._start
+        log.info(f"{what} timings: " + ", ".join(f"{phase} {t:.3f} s" for phase, t in self.timings.items()))
+
+
+@dataclass
+class IncludeGraph:
+    """Include DAG of a configuration, keyed by absolute path. Only data files are expanded, schema
+    files are leaves
+
+    Arguments:
+        includes -- Files included directly by each file, None for the top level databases
+        names -- Each included file as written in the first file found including it
+    """
+    includes: dict[str | None, list[str]] = field(default_factory=dict)
+    names: dict[str, str] = field(default_factory=dict)
+
+    def all_includes(self, file: str | None = None) -> list[str]:
+        """Every file included by a file (by the top level files if None), directly or not, without duplicates"""
+        found = {}
+        top_files = self.includes.get(None, []) if file is None else [file]
+        stack = list(reversed([include for f in top_files for include in self.includes.get(f, [])]))
+        while stack:
+            include = stack.pop()
+            if include in found:
+                continue
+            found[include] = None
+            stack += reversed(self.includes.get(include, []))
+        return list(found)
+
+    def data_includes(self, file: str | None = None) -> list[str]:
+        """Data files included directly by a file. The top level files are always data files,
+        whatever their name, unless they are schema files"""
+        if file is None:
+            return [f for f in self.includes.get(None, []) if "schema.xml" not in f]
+        return [f for f in self.includes.get(file, []) if "data.xml" in f]
+
+    def include_names(self, files: list[str]) -> list[str]:
+        """Files as they were written in the files including them"""
+        return [self.names.get(f, f) for f in files]
+
+    @property
+    def data_files(self) -> list[str]:
+        return [f for f in self.all_includes() if "data.xml" in f]
+
+    @property
+    def schema_files(self) -> list[str]:
+        return [f for f in self.all_includes() if "schema.xml" in f]
+
+    def topological_order(self) -> list[str]:
+        """Data files, including the top level files, ordered so every file comes after the data files it includes"""
+        order = []
+        done = set()
+        # Iterative post-order walk, (file, included files still to visit)
+        stack = [(None, iter(self.data_includes(None)))]
+        while stack:
+            file, remaining = stack[-1]
+            include = next((i for i in remaining if i not in done), None)
+            if include is None:
+                stack.pop()
+                if file is not None:
+                    order.append(file)
+                continue
+            done.add(include)
+            stack.append((include, iter(self.data_includes(include))))
+        return order
+
+
+def _locate_input_file(input_file):
+    """Absolute path of a database given on the command line, relative to the current directory or DUNEDAQ_DB_PATH"""
+    if os.path.exists(input_file):
+        return os.path.abspath(input_file)
+    return locate_include_file(input_file)
+
+
+def get_include_graph(input_files, memo=None):
+    """Build the include DAG of a configuration iteratively. Only the include lists are read from
+    each file, so every file is read once however many files include it
+
+    Includes are resolved as OKS does, relative to the including file then in DUNEDAQ_DB_PATH.
+
+    Arguments:
+        input_files -- Top level databases
+        memo -- Includes of files already read, absolute path : [(include as written, absolute path)].
+                Can be shared between calls for databases which include the same files
+
+    Returns:
+        IncludeGraph
+    """
+    if memo is None:
+        memo = {}
+    graph = IncludeGraph()
+    graph.includes[None] = []
+    for input_file in input_files:
+        source = _locate_input_file(input_file)
+        if source is None:
+            raise RuntimeError(f"Could not find database {input_file}")
+        graph.includes[None].append(source)
+        graph.names.setdefault(source, input_file)
+
+    stack = list(reversed(graph.includes[None]))
+    while stack:
+        source = stack.pop()
+        if source in graph.includes:
+            continue
+        if source not in memo:
+            with open(source, "rb") as f:
+                includes = parse_includes(f.read())
+            resolved = []
+            for include in includes:
+                include_file = locate_include_file(include, source)
+                if include_file is None:
+                    raise RuntimeError(f"Could not find {include} included by {source}")
+                resolved.append((include, include_file))
+            memo[source] = resolved
+
+        graph.includes[source] = [include_file for _, include_file in memo[source]]
+        for include, include_file in memo[source]:
+            graph.names.setdefault(include_file, include)
+        stack += [f for f in reversed(graph.data_includes(source)) if f not in graph.includes]
+    return graph
+
+
+def get_all_includes(oksfile):
+    """Every file included by a database, directly or not, as written in the including files"""
+    graph = get_include_graph([oksfile])
+    return graph.include_names(graph.all_includes())
+
+
+def index_objects(dbs):
+    """Index the objects of several databases by uid@class, the first database defining an object wins
+
+    Arguments:
+        dbs -- Databases, in order of precedence
+
+    Returns:
+        (dictionary of uid@class : DAL object, list of uid@class defined differently by several databases)
+    """
+    index = {}
+    divergent = {}
+    for db in dbs:
+        for dal in db.get_all_dals().values():
+            key = dal_key(dal)
+            first = index.get(key)
+            if first is None:
+                index[key] = dal
+            elif first is not dal and key not in divergent and get_object_summary(first) != get_object_summary(dal):
+                divergent[key] = None
+    return index, list(divergent)
+
+
+def add_objects(new_db, dals):
+    """Add objects to a database without committing, skipping any already defined in it or its includes
+
+    Arguments:
+        new_db -- Database to add the objects to
+        dals -- DAL objects to add
+
+    Returns:
+        Number of objects added
+    """
+    existing = {dal_key(dal) for dal in new_db.get_all_dals().values()}
+    n_added = 0
+    for dal in dals:
+        if dal_key(dal) in existing:
             continue
-        includes += get_all_includes(db, include)
+        new_db.add_dal(dal)
+        n_added += 1
+    return n_added
 
-    return list(set(includes))
 
-def consolidate_db(oksfile, output_file):
+def consolidate_db(oksfile, output_file, root=None):
+    """Put every object of a database and the data files it includes into a single file,
+    which only includes the schema files
+
+    Arguments:
+        oksfile -- Input database
+        output_file -- Output database
+
+    Keyword Arguments:
+        root -- uid@class of an object, e.g. a Session. If given only the objects it refers to, directly
+                or not, are copied (default: {None})
+
+    Returns:
+        dictionary of phase : time in seconds
+    """
     log.info(f"Consolidating database into output database \'{output_file}\'. Input database: \'{oksfile}\'.")
 
-    sys.setrecursionlimit(10000)  # for example
+    timer = PhaseTimer()
     log.debug("Reading database")
     db = conffwk.Configuration("oksconflibs:" + oksfile)
 
-    schemafiles = []
-    includes = get_all_includes(db, None)
-    schemafiles += [i for i in includes if "schema.xml" in i]
+    graph = get_include_graph([oksfile])
+    schemafiles = graph.include_names(graph.schema_files)
     log.debug(f"Included schemas: {schemafiles}")
+    timer("read")
+
+    if root is None:
+        dals = list(db.get_all_dals().values())
+    else:
+        # Split on the last "@", the class name cannot contain one
+        uid, _, class_name = root.rpartition("@")
+        if not uid or not class_name:
+            raise ValueError(f"Root object \'{root}\' must be given as uid@class")
+        try:
+            root_dal = db.get_dal(class_name, uid)
+        except Exception as e:
+            raise ValueError(f"Root object \'{root}\' not found in \'{oksfile}\'") from e
+        dals = list(find_reachable([root_dal]).values())
+        log.info(f"Keeping {len(dals)} objects reachable from {root}")
+    timer("select")
 
     log.debug("Creating new database")
     new_db = conffwk.Configuration("oksconflibs")
     new_db.create_db(output_file, schemafiles)
-
-    new_db.commit()
-
-    log.debug("Reading dal objects from old db")
-    dals = db.get_all_dals()
+    timer("create")
 
     log.debug(f"Copying objects to new db")
-
     for dal in dals:
-        this_dal = db.get_dal(dals[dal].className(), dals[dal].id)
-        new_db.add_dal(this_dal)
+        new_db.add_dal(dal)
+    timer("copy")
 
     log.debug("Saving database")
     new_db.commit()
+    timer("commit")
+    timer.report("consolidate_db")
+    return timer.timings
 
 
-def copy_configuration(dest_dir : Path, input_files: list):
-    if len(input_files) == 0:
-        return []
-
-    log.info(f"Copying configuration represented by databases: \'{input_files}\' to \'{dest_dir}\'")
-    dest_dir = dest_dir.resolve() # Always include by absolute path when copying
-    sys.setrecursionlimit(10000)  # for example
+def _copy_database(source, output_file, dest_dir):
+    """Copy the objects of one database, its data includes must already have been copied to dest_dir"""
+    db = conffwk.Configuration("oksconflibs:" + source)
+    includes = db.get_includes(None)
+    schemas = [i for i in includes if "schema.xml" in i]
+    newdbs = [str(dest_dir / os.path.basename(i)) for i in includes if "data.xml" in i]
 
-    output_dbs = []
+    new_db = conffwk.Configuration("oksconflibs")
+    new_db.create_db(output_file, schemas + newdbs)
+    # Objects of the included files are already in their own copies
+    add_objects(new_db, db.get_all_dals().values())
+    new_db.commit()
 
-    for input_file in input_files:
-        db = conffwk.Configuration("oksconflibs:" + input_file)
-        includes = db.get_includes(None)
-        schemas = [i for i in includes if "schema.xml" in i]
-        dbs = [i for i in includes if "data.xml" in i]
-        newdbs = copy_configuration(dest_dir, dbs)
 
-        output_file = dest_dir / os.path.basename(input_file)
+def copy_configuration(dest_dir : Path, input_files: list, max_workers=None):
+    """Copy databases and every data file they include to a directory, include paths are
+    rewritten to the copies
 
-        new_db = conffwk.Configuration("oksconflibs")
-        new_db.create_db(str(output_file), schemas + newdbs)
-        new_db.commit()
+    Each distinct data file is copied once, after the files it includes. Files which don't depend on
+    each other are copied concurrently, each in its own process. A file is not copied again if its
+    copy was made from identical content (of the file and everything it includes).
 
-        dals = db.get_all_dals()
+    Arguments:
+        dest_dir -- Directory to copy to
+        input_files -- Top level databases
 
-        for dal in dals:
+    Keyword Arguments:
+        max_workers -- Maximum number of files copied at once (default: {number of CPUs})
 
-            db.get_dal(dals[dal].className(), dals[dal].id)
+    Returns:
+        list of the copies of input_files
+    """
+    if len(input_files) == 0:
+        return []
 
-            new_db.add_dal(dals[dal])
+    log.info(f"Copying configuration represented by databases: \'{input_files}\' to \'{dest_dir}\'")
+    dest_dir = dest_dir.resolve() # Always include by absolute path when copying
 
-        new_db.commit()
-        output_dbs.append(str(output_file))
+    graph = get_include_graph(input_files)
+    order = graph.topological_order()
+
+    outputs = {}
+    for source in order:
+        output_file = str(dest_dir / os.path.basename(source))
+        other = next((s for s, o in outputs.items() if o == output_file), None)
+        if other is not None:
+            raise RuntimeError(f"{source} and {other} would both be copied to {output_file}")
+        outputs[source] = output_file
+
+    # Hash of each file's content and the hashes of its includes, so changes propagate to the files including it
+    hashes = {}
+    for source in order:
+        hasher = hashlib.sha256()
+        with open(source, "rb") as f:
+            hasher.update(f.read())
+        for include in graph.data_includes(source):
+            hasher.update(hashes[include].encode())
+        hashes[source] = hasher.hexdigest()
+
+    def hash_file(source):
+        return os.path.join(dest_dir, f".{os.path.basename(source)}.copy-hash")
+
+    to_copy = []
+    for source in order:
+        if os.path.exists(outputs[source]) and os.path.exists(hash_file(source)):
+            with open(hash_file(source)) as f:
+                if f.read().strip() == hashes[source]:
+                    log.debug(f"{outputs[source]} is up to date")
+                    continue
+        to_copy.append(source)
+    log.info(f"Copying {len(to_copy)} of {len(order)} data files")
+
+    # Files still waiting for some of their includes to be copied
+    waiting_for = {source: {i for i in graph.data_includes(source) if i in to_copy} for source in to_copy}
+
+    # conffwk is not fork safe, so use fresh interpreters for the workers
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        running = {}
+        while waiting_for or running:
+            for source in [s for s, includes in waiting_for.items() if not includes]:
+                del waiting_for[source]
+                log.debug(f"Copying {source} to {outputs[source]}")
+                running[pool.submit(_copy_database, source, outputs[source], dest_dir)] = source
+
+            if not running:
+                raise RuntimeError(f"Include cycle between {sorted(waiting_for)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                source = running.pop(future)
+                future.result()
+                with open(hash_file(source), "w") as f:
+                    f.write(hashes[source])
+                for includes in waiting_for.values():
+                    includes.discard(source)
     log.debug("DONE")
 
-    return output_dbs
+    return [outputs[source] for source in graph.includes[None]]
 
 
 def consolidate_files(oksfile, *input_files):
-    includes = []
+    """Merge the objects of several databases into one file, keeping the data files they include
+    (other than the input files) as includes
+
+    Every object is indexed by uid@class first, objects defined by several inputs are only added once
+    (the first definition is kept, differing definitions are reported) and the output is written with
+    a single commit.
+
+    Arguments:
+        oksfile -- Output database
+
+    Returns:
+        dictionary of phase : time in seconds
+    """
     dbs = []
     str_in_files = '\n'.join(input_files)
     log.info(f"Consolidating {len(input_files)} databases into output database \'{oksfile}\'. Input databases: {str_in_files}")
-    sys.setrecursionlimit(10000)  # for example
+    timer = PhaseTimer()
 
     for input_file in input_files:
         dbs.append(conffwk.Configuration("oksconflibs:" + input_file))
-        includes += get_all_includes(dbs[len(dbs) - 1], None)
 
-    includes = list(set(includes))
-    includes = [i for i in includes if i not in input_files]
+    graph = get_include_graph(input_files)
+    includes = graph.include_names([i for i in graph.all_includes() if i not in graph.includes[None]])
     log.debug(f"Included files: {includes}")
+    timer("read")
+
+    log.debug("Indexing objects")
+    index, divergent = index_objects(dbs)
+    for key in divergent:
+        log.warning(f"{key} is defined differently in several input databases, keeping the first definition")
+    timer("index")
 
     new_db = conffwk.Configuration("oksconflibs")
     new_db.create_db(oksfile, includes)
+    timer("create")
 
-    new_db.commit()
-
-    for db in dbs:
-        log.debug(f"Reading dal objects from old db {db}")
-        dals = db.get_all_dals()
-
-        log.debug(f"Copying objects to new db {new_db}")
-        for dal in dals:
-
-            try:
-                new_db.get_dal(dals[dal].className(), dals[dal].id)
-            except:
-                new_db.add_dal(dals[dal])
-            new_db.commit()
+    log.debug(f"Copying {len(index)} objects to new db {new_db}")
+    n_added = add_objects(new_db, index.values())
+    log.debug(f"Added {n_added} objects, {len(index)-n_added} already defined by included files")
+    timer("copy")
 
     log.debug(f"Saving database {new_db}")
-    new_db.commit()
\ No newline at end of file
+    new_db.commit()
+    timer("commit")
+    timer.report("consolidate_files")
+    return timer.timings
@@ -43,32 +43,137 @@ def compare_dal_obj(a, b):
     return (a_attrs == b_attrs) and (a_rels == b_rels)
 
 
-#---------------
-def find_related(dal_obj, dal_group: set):
+def get_object_summary(o):
+    """Attributes and relationships of a dal object, relationships given as uid@class,
+    so objects from different databases can be compared"""
+    def key(obj):
+        return None if obj is None else f"{obj.id}@{obj.className()}"
+
+    summary = {}
+    for attr in get_attribute_info(o):
+        summary[attr] = getattr(o, attr)
+    for rel in get_relation_info(o):
+        value = getattr(o, rel)
+        summary[rel] = [key(x) for x in value] if isinstance(value, list) else key(value)
+    return summary
+
+
+def get_related_objects(dal_obj):
+    """Objects a dal object refers to directly, through any of its relationships"""
+    related = []
+    for rel in get_relation_list(dal_obj):
+        rel_val = getattr(dal_obj, rel)
+        if rel_val is None:
+            continue
+        related += [o for o in rel_val if o is not None] if isinstance(rel_val, list) else [rel_val]
+    return related
 
 
-    rels = get_relation_list(dal_obj)
+def dal_key(dal_obj) -> str:
+    return f"{dal_obj.id}@{dal_obj.className()}"
 
-    rel_objs = set()
-    for rel in rels:
-        rel_val = getattr(dal_obj, rel)
 
-        if rel_val is None:
-            continue
+def walk_references(roots, get_related, include_roots: bool = False) -> dict:
+    """Every object reached from the root objects by repeatedly following get_related, depth first.
+    Iterative, so deep or cyclic configurations need no recursion limit
 
-        rel_objs.update(rel_val if isinstance(rel_val,list) else [rel_val])
+    Arguments:
+        roots -- dal objects to start from
+        get_related -- Gives the objects to follow from an object, e.g. get_related_objects
 
-    # Isolate relationship objects that are not in the dal_group yet
-    new_rel_objs = rel_objs - dal_group
+    Keyword Arguments:
+        include_roots -- Include the roots, otherwise a root is only included if it is reached from
+                         another object, i.e. is part of a cycle (default: {False})
+
+    Returns:
+        dictionary of uid@class : dal object, in the order objects were reached
+    """
+    reached = {}
+    # (object, whether to add it)
+    stack = [(o, include_roots) for o in reversed(roots)]
+    while stack:
+        o, add = stack.pop()
+        if add:
+            key = dal_key(o)
+            if key in reached:
+                continue
+            reached[key] = o
+        stack += [(r, True) for r in reversed(get_related(o)) if dal_key(r) not in reached]
+    return reached
+
+
+def find_reachable(roots):
+    """Every object reachable from the root objects through relationships, including the roots
+
+    Arguments:
+        roots -- dal objects to start from
+
+    Returns:
+        dictionary of uid@class : dal object, in the order objects were reached
+    """
+    return walk_references(roots, get_related_objects, include_roots=True)
+
+
+def find_related(dal_obj, dal_group: set):
+    """Add every object reachable from dal_obj through relationships to dal_group.
+    dal_obj itself is only added if it is part of a cycle. Objects already in dal_group aren't followed again"""
+    dal_group.update(walk_references([dal_obj], lambda o: [r for r in get_related_objects(o) if r not in dal_group]).values())
+
+
+class ReferenceIndex:
+    """Forward and reverse references between all the objects of a database
+
+    The relationships of every object are read once when the index is built, reachability and
+    referrer queries then only visit the objects in their result.
+    """
+    def __init__(self, dals):
+        """Build the index
+
+        Arguments:
+            dals -- Every dal object of the database, e.g. cfg.get_all_dals().values()
+        """
+        # uid@class : dal object
+        self.objects = {}
+        # uid@class : uid@class of the objects it refers to / is referred to by
+        self.forward = {}
+        self.reverse = {}
+
+        for o in dals:
+            key = self.key(o)
+            self.objects[key] = o
+            related = get_related_objects(o)
+            self.forward[key] = [self.key(r) for r in related]
+            for r in related:
+                r_key = self.key(r)
+                self.objects.setdefault(r_key, r)
+                self.reverse.setdefault(r_key, []).append(key)
+
+    @staticmethod
+    def key(dal_obj) -> str:
+        return dal_key(dal_obj)
+
+    def __walk(self, roots, edges) -> list:
+        """Objects reached from the roots following edges, the roots are only included if part of a cycle"""
+        return list(walk_references(roots, lambda o: [self.objects[key] for key in edges.get(self.key(o), [])]).values())
+
+    def reachable(self, roots) -> list:
+        """Every object the roots refer to, directly or not"""
+        return self.__walk(roots, self.forward)
+
+    def referrers(self, dal_obj, transitive: bool = False) -> list:
+        """Objects referring to an object
+
+        Arguments:
+            dal_obj -- Referred to object
+
+        Keyword Arguments:
+            transitive -- Also include objects referring to it through other objects (default: {False})
+        """
+        if transitive:
+            return self.__walk([dal_obj], self.reverse)
+        return [self.objects[key] for key in dict.fromkeys(self.reverse.get(self.key(dal_obj), []))]
 
-    # Safely add the new object to the group
-    dal_group.update(rel_objs)
-    for o in new_rel_objs:
-        if o is None:
-            continue
 
-        find_related(o, dal_group)
-        
 from collections.abc import Iterable
 def find_duplicates( collection: Iterable ):
     """
@@ -1,8 +1,9 @@
 import conffwk
 import os
-import json
 import sys
 
+from daqconf.utils import find_oksincludes, iter_json_file
+
 def dro_json_to_oks(jsonfile, oksfile, source_id_offset, nomap, lcores):
     """Simple script to convert a JSON readout map file to an OKS file."""
 
@@ -14,16 +15,14 @@ def dro_json_to_oks(jsonfile, oksfile, source_id_offset, nomap, lcores):
         f"Converting RO map from {jsonfile} to OKS in {oksfile} offsetting source_ids by {source_id_offset}"
     )
 
-    with open(jsonfile) as f:
-        jsonmap = json.loads(f.read())
-        f.close()
-
-    schemafiles = [
+    res, schemafiles = find_oksincludes([
         "schema/confmodel/dunedaq.schema.xml",
         "schema/appmodel/application.schema.xml",
         "schema/appmodel/fdmodules.schema.xml",
         "schema/appmodel/wiec.schema.xml"
-    ]
+    ])
+    if not res:
+        return
     dal = conffwk.dal.module("dal", schemafiles[-1])
     db = conffwk.Configuration("oksconflibs")
     db.create_db(oksfile, schemafiles)
@@ -33,7 +32,6 @@ def dro_json_to_oks(jsonfile, oksfile, source_id_offset, nomap, lcores):
     flx_streams = []
     eth_senders = []
     flx_senders = []
-    links = []
     last_eth_pars = None
     last_felix_pars = None
     last_hermes_id = None
@@ -44,7 +42,9 @@ def dro_json_to_oks(jsonfile, oksfile, source_id_offset, nomap, lcores):
     link_number = 0
     last_tx_mac = None
     last_tx_host = None
-    for entry in jsonmap:
+    # Entries are read one at a time, each connection's objects are created as soon as
+    # the rx host/FELIX card changes so the readout map is never held in memory
+    for entry in iter_json_file(jsonfile):
         source_id = entry["src_id"] + source_id_offset
         geo_id = entry["geo_id"]
         geo_dal = dal.GeoId(f"geoId-{source_id}",
@@ -104,7 +104,6 @@ def dro_json_to_oks(jsonfile, oksfile, source_id_offset, nomap, lcores):
                     uses = txnic_dal
                 )
                 db.update_dal(link_dal)
-                links.append(link_dal)
                 link_number = link_number + 1
                 eth_senders.append(link_dal)
                 hermes_streams = []
@@ -222,7 +221,6 @@ def dro_json_to_oks(jsonfile, oksfile, source_id_offset, nomap, lcores):
                     uses = txnic_dal
                 )
                 db.update_dal(link_dal)
-                links.append(link_dal)
 
         rset_dal = dal.ResourceSetAND(
             f"{last_eth_pars['rx_host']}-senders",
@@ -1,11 +1,20 @@
 from dataclasses import dataclass
 from daqconf.assets import resolve_asset_file
+from daqconf.incremental import base_includes, generate_incremental
+from daqconf.readout_plan import plan_readout
 from daqconf.utils import find_oksincludes
 import conffwk
-import glob
+import functools
+import multiprocessing
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 
+@base_includes(
+    "schema/confmodel/dunedaq.schema.xml",
+    "schema/appmodel/application.schema.xml",
+)
 def generate_dataflow(
     oksfile,
     include,
@@ -20,10 +29,7 @@ def generate_dataflow(
     any other OKS files you specify.
     """
 
-    includefiles = [
-        "schema/confmodel/dunedaq.schema.xml",
-        "schema/appmodel/application.schema.xml",
-    ]
+    includefiles = list(generate_dataflow.base_includes)
 
     res, extra_includes = find_oksincludes(include, os.path.dirname(oksfile))
     if res:
@@ -184,6 +190,11 @@ def generate_dataflow(
     return
 
 
+@base_includes(
+    "schema/confmodel/dunedaq.schema.xml",
+    "schema/appmodel/application.schema.xml",
+    "schema/appmodel/trigger.schema.xml",
+)
 def generate_hsi(
     oksfile,
     include,
@@ -197,11 +208,7 @@ def generate_hsi(
 
     """
 
-    includefiles = [
-        "schema/confmodel/dunedaq.schema.xml",
-        "schema/appmodel/application.schema.xml",
-        "schema/appmodel/trigger.schema.xml",
-    ]
+    includefiles = list(generate_hsi.base_includes)
 
     res, extra_includes = find_oksincludes(include, os.path.dirname(oksfile))
     if res:
@@ -312,6 +319,13 @@ def generate_hsi(
     return
 
 
+@base_includes(
+    "schema/confmodel/dunedaq.schema.xml",
+    "schema/appmodel/application.schema.xml",
+    "schema/appmodel/trigger.schema.xml",
+    "schema/appmodel/fdmodules.schema.xml",
+    "schema/appmodel/wiec.schema.xml",
+)
 def generate_readout(
     readoutmap,
     oksfile,
@@ -320,6 +334,8 @@ def generate_readout(
     emulated_file_name="asset://?checksum=e96fd6efd3f98a9a3bfaba32975b476e",
     tpg_enabled=True,
     hosts_to_use=[],
+    commit_per_connection=False,
+    dry_run=False,
 ):
     """Simple script to create an OKS configuration file for all
   ReadoutApplications defined in a readout map.
@@ -347,6 +363,16 @@ def generate_readout(
   NB: Currently FSM generation is not implemented so you must include
   an fsm file in order to generate a Segment
 
+  All new objects are staged in memory and the output file is written
+  once at the end. Set commit_per_connection to write the file after
+  every DetectorToDaqConnection instead (much slower for large maps).
+
+    With dry_run nothing is written, the plan of what would be generated
+  is printed and returned instead. Only the readout map is loaded so
+  hosts_to_use (or vlocalhost) are not checked against the includes.
+  Applications are assigned to hosts_to_use in the order given, both
+  when planning and generating.
+
   """
 
     if not readoutmap.endswith(".data.xml"):
@@ -354,60 +380,19 @@ def generate_readout(
 
     print(f"Readout map file {readoutmap}")
 
-    includefiles = [
-        "schema/confmodel/dunedaq.schema.xml",
-        "schema/appmodel/application.schema.xml",
-        "schema/appmodel/trigger.schema.xml",
-        "schema/appmodel/fdmodules.schema.xml",
-        "schema/appmodel/wiec.schema.xml",
-        readoutmap,
-    ]
+    if dry_run:
+        db = conffwk.Configuration("oksconflibs:" + readoutmap)
+        plan = plan_readout(db.get_dals(class_name="DetectorToDaqConnection"),
+                            list(dict.fromkeys(hosts_to_use)) or ["vlocalhost"], emulated_file_name, tpg_enabled)
+        print(plan.report())
+        return plan
 
-    searchdirs = [path for path in os.environ["DUNEDAQ_DB_PATH"].split(":")]
-    searchdirs.append(os.path.dirname(oksfile))
-    for inc in include:
-        # print (f"Searching for {inc}")
-        match = False
-        inc = inc.removesuffix(".xml")
-        if inc.endswith(".data"):
-            sub_dirs = ["config", "data"]
-        elif inc.endswith(".schema"):
-            sub_dirs = ["schema"]
-        else:
-            sub_dirs = ["*"]
-            inc = inc + "*"
-        for path in searchdirs:
-            # print (f"   {path}/{inc}.xml")
-            matches = glob.glob(f"{inc}.xml", root_dir=path)
-            if len(matches) == 0:
-                for search_dir in sub_dirs:
-                    # print (f"   {path}/{search_dir}/{inc}.xml")
-                    matches = glob.glob(f"{search_dir}/{inc}.xml", root_dir=path)
-                    for filename in matches:
-                        if filename not in includefiles:
-                            print(f"Adding {filename} to include list")
-                            includefiles.append(filename)
-                        else:
-                            print(f"{filename} already in include list")
-                        match = True
-                        break
-                    if match:
-                        break
-                if match:
-                    break
-            else:
-                for filename in matches:
-                    if filename not in includefiles:
-                        print(f"Adding {filename} to include list")
-                        includefiles.append(filename)
-                    else:
-                        print(f"{filename} already in include list")
-                    match = True
-                    break
-
-        if not match:
-            print(f"Error could not find include file for {inc}")
-            return
+    includefiles = list(generate_readout.base_includes) + [readoutmap]
+
+    res, extra_includes = find_oksincludes(include, os.path.dirname(oksfile))
+    if not res:
+        return
+    includefiles += [inc for inc in extra_includes if inc not in includefiles]
 
     dal = conffwk.dal.module("generated", includefiles)
     db = conffwk.Configuration("oksconflibs")
@@ -417,9 +402,24 @@ def generate_readout(
     db.create_db(oksfile, includefiles)
     db.set_active(oksfile)
 
+    # Objects shared between connections only need to be looked up once
+    @functools.cache
+    def get_shared_dal(class_name, uid):
+        return db.get_dal(class_name=class_name, uid=uid)
+
     detector_connections = db.get_dals(class_name="DetectorToDaqConnection")
-    daqapp_control = db.get_dal(class_name="Service", uid="daqapp_control")
-    rccontroller_control = db.get_dal(class_name="Service", uid="rccontroller_control")
+    daqapp_control = get_shared_dal("Service", "daqapp_control")
+    rccontroller_control = get_shared_dal("Service", "rccontroller_control")
+
+    # Services
+    dataRequests = get_shared_dal("Service", "dataRequests")
+    timeSyncs = get_shared_dal("Service", "timeSyncs")
+    triggerActivities = get_shared_dal("Service", "triggerActivities")
+    triggerPrimitives = get_shared_dal("Service", "triggerPrimitives")
+
+    # Action Plans
+    readout_start = get_shared_dal("ActionPlan", "readout-start")
+    readout_stop = get_shared_dal("ActionPlan", "readout-stop")
 
     try:
         rule = db.get_dal(
@@ -465,80 +465,37 @@ def generate_readout(
             db.update_dal(host)
             hosts.append("vlocalhost")
     else:
-        for vhost in db.get_dals(class_name="VirtualHost"):
-            if vhost.id in hosts_to_use:
-                hosts.append(vhost.id)
+        # In the order given, as the dry run plans them
+        vhosts = {vhost.id for vhost in db.get_dals(class_name="VirtualHost")}
+        hosts = [host for host in dict.fromkeys(hosts_to_use) if host in vhosts]
     assert len(hosts) > 0
 
     rohw = dal.RoHwConfig(f"rohw-{detector_connections[0].id}")
     db.update_dal(rohw)
 
-    opmon_conf = db.get_dal(class_name="OpMonConf", uid="slow-all-monitoring")
+    opmon_conf = get_shared_dal("OpMonConf", "slow-all-monitoring")
+    tphandler = get_shared_dal("DataHandlerConf", "def-tp-handler")
+
+    plan = plan_readout(detector_connections, hosts, emulated_file_name, tpg_enabled)
 
     appnum = 0
-    nicrec = None
-    flxcard = None
     wm_conf = None
     hermes_conf = None
+    data_readers = {}
     ruapps = []
-    for connection in detector_connections:
-
-        det_id = 0
-        for resource in connection.contains:
-            if "ResourceSetAND" in resource.oksTypes():
-                for stream in resource.contains:
-                    det_id = stream.contains[0].geo_id.detector_id
-                    break
-                break
-
-        if det_id == 0:
-            raise Exception(f"Unable to determine detector ID from Hardware Map!")
-
-        tphandler = db.get_dal(class_name="DataHandlerConf", uid="def-tp-handler")
-
-        if det_id == 2:
-            if "DAPHNEStream" in emulated_file_name:
-                linkhandler = db.get_dal(
-                    class_name="DataHandlerConf", uid="def-pds-stream-link-handler"
-                )
-                det_q = db.get_dal(
-                    class_name="QueueConnectionRule", uid="pds-stream-raw-data-rule"
-                )
-            else:
-                linkhandler = db.get_dal(
-                    class_name="DataHandlerConf", uid="def-pds-link-handler"
-                )
-                det_q = db.get_dal(
-                    class_name="QueueConnectionRule", uid="pds-raw-data-rule"
-                )
+    for row, connection in enumerate(detector_connections):
+        if plan.skip_reason[row] is not None:
+            print(f"ReadoutGroup contains {plan.skip_reason[row]}")
+            continue
 
-        elif det_id == 3:
-            linkhandler = db.get_dal(
-                class_name="DataHandlerConf", uid="def-link-handler"
-            )
-            det_q = db.get_dal(
-                class_name="QueueConnectionRule", uid="wib-eth-raw-data-rule"
-            )
-        elif det_id == 11:
-            linkhandler = db.get_dal(
-                class_name="DataHandlerConf", uid="def-tde-link-handler"
-            )
-            det_q = db.get_dal(
-                class_name="QueueConnectionRule", uid="tde-raw-data-rule"
-            )
+        host = get_shared_dal("VirtualHost", plan.host[row])
+        linkhandler = get_shared_dal("DataHandlerConf", plan.link_handler[row])
+        det_q = get_shared_dal("QueueConnectionRule", plan.queue_rule[row])
+        receiver_class = plan.receiver_class[row]
 
-        hostnum = appnum % len(hosts)
-        # print(f"Looking up host[{hostnum}] ({hosts[hostnum]})")
-        host = db.get_dal(class_name="VirtualHost", uid=hosts[hostnum])
-
-        # Find which type of DataReceiver we need for this connection
-        for resource in connection.contains:
-            if "DetDataReceiver" in resource.oksTypes():
-                receiver = resource
-                break
-        # Emulated stream
-        if type(receiver).__name__ == "FakeDataReceiver":
-            if nicrec == None:
+        datareader = data_readers.get(plan.data_reader[row])
+        if datareader is None:
+            if receiver_class == "FakeDataReceiver":
                 try:
                     stream_emu = db.get_dal(
                         class_name="StreamEmulationParameters", uid="stream-emu"
@@ -559,21 +516,26 @@ def generate_readout(
                     db.update_dal(stream_emu)
 
                 print("Generating fake DataReaderConf")
-                nicrec = dal.DPDKReaderConf(
-                    f"nicrcvr-fake-gen",
+                datareader = dal.DPDKReaderConf(
+                    plan.data_reader[row],
                     template_for="FDFakeReaderModule",
                     emulation_mode=1,
                     emulation_conf=stream_emu,
                 )
-                db.update_dal(nicrec)
-            datareader = nicrec
-        elif type(receiver).__name__ == "DPDKReceiver":
-            if nicrec == None:
+            elif receiver_class == "DPDKReceiver":
                 print("Generating DPDKReaderConf")
-                nicrec = dal.DPDKReaderConf(
-                    f"nicrcvr-dpdk-gen", template_for="DPDKReaderModule"
+                datareader = dal.DPDKReaderConf(
+                    plan.data_reader[row], template_for="DPDKReaderModule"
+                )
+            else:
+                print("Generating Felix DataReaderConf")
+                datareader = dal.DataReaderConf(
+                    plan.data_reader[row], template_for="FelixReaderModule"
                 )
-                db.update_dal(nicrec)
+            db.update_dal(datareader)
+            data_readers[plan.data_reader[row]] = datareader
+
+        if receiver_class == "DPDKReceiver":
             if wm_conf == None:
                 try:
                     wm_conf = db.get_dal("WIBModuleConf", "def-wib-conf")
@@ -589,8 +551,6 @@ def generate_readout(
                         'Expected HermesModuleConf "def-hermes-conf" not found in input databases!'
                     )
 
-            datareader = nicrec
-
             wiec_app = dal.WIECApplication(
                 f"wiec-{connection.id}",
                 application_name="daq_application",
@@ -602,34 +562,11 @@ def generate_readout(
             )
             db.update_dal(wiec_app)
 
-        elif type(receiver).__name__ == "FelixInterface":
-            if flxcard == None:
-                print("Generating Felix DataReaderConf")
-                flxcard = dal.DataReaderConf(
-                    f"flxConf-1", template_for="FelixReaderModule"
-                )
-                db.update_dal(flxcard)
-            datareader = flxcard
-        else:
-            print(
-                f"ReadoutGroup contains unknown interface type {type(receiver).__name__}"
-            )
-            continue
-
-        db.commit()
-
-        # Services
-        dataRequests = db.get_dal(class_name="Service", uid="dataRequests")
-        timeSyncs = db.get_dal(class_name="Service", uid="timeSyncs")
-        triggerActivities = db.get_dal(class_name="Service", uid="triggerActivities")
-        triggerPrimitives = db.get_dal(class_name="Service", uid="triggerPrimitives")
-
-        # Action Plans
-        readout_start = db.get_dal(class_name="ActionPlan", uid="readout-start")
-        readout_stop = db.get_dal(class_name="ActionPlan", uid="readout-stop")
+        if commit_per_connection:
+            db.commit()
 
         ru = dal.ReadoutApplication(
-            f"ru-{connection.id}",
+            plan.app[row],
             application_name="daq_application",
             runs_on=host,
             contains=[connection],
@@ -647,9 +584,7 @@ def generate_readout(
         if tpg_enabled:
             ru.tp_handler = tphandler
             tp_sources = []
-            tpbaseid = (appnum * 3) + 100
-            for plane in range(3):
-                s_id = tpbaseid + plane
+            for s_id in plan.tp_source_ids[row]:
                 tps_dal = dal.SourceIDConf(
                     f"tp-srcid-{s_id}", sid=s_id, subsystem="Trigger"
                 )
@@ -660,14 +595,13 @@ def generate_readout(
         appnum = appnum + 1
         print(f"{ru=}")
         db.update_dal(ru)
-        db.commit()
+        if commit_per_connection:
+            db.commit()
         ruapps.append(ru)
     if appnum == 0:
         print(f"No ReadoutApplications generated\n")
         return
 
-    db.commit()
-
     if generate_segment:
         # fsm = db.get_dal(class_name="FSMconfiguration", uid="fsmConf-test")
         fsm = db.get_dal(class_name="FSMconfiguration", uid="FSMconfiguration_noAction")
@@ -680,16 +614,19 @@ def generate_readout(
             exposes_service=[rccontroller_control],
         )
         db.update_dal(controller)
-        db.commit()
 
         seg = dal.Segment(f"ru-segment", controller=controller, applications=ruapps)
         db.update_dal(seg)
-        db.commit()
 
+    # Everything is written in one go
     db.commit()
     return
 
 
+@base_includes(
+    "schema/confmodel/dunedaq.schema.xml",
+    "schema/appmodel/application.schema.xml",
+)
 def generate_fakedata(
     oksfile, include, generate_segment, n_streams, n_apps, det_id
 ):
@@ -700,10 +637,7 @@ def generate_fakedata(
 
     """
 
-    includefiles = [
-        "schema/confmodel/dunedaq.schema.xml",
-        "schema/appmodel/application.schema.xml",
-    ]
+    includefiles = list(generate_fakedata.base_includes)
 
     res, extra_includes = find_oksincludes(include, os.path.dirname(oksfile))
     if res:
@@ -825,6 +759,11 @@ def generate_fakedata(
     return
 
 
+@base_includes(
+    "schema/confmodel/dunedaq.schema.xml",
+    "schema/appmodel/application.schema.xml",
+    "schema/appmodel/trigger.schema.xml",
+)
 def generate_trigger(
     oksfile,
     include,
@@ -839,11 +778,7 @@ def generate_trigger(
 
     """
 
-    includefiles = [
-        "schema/confmodel/dunedaq.schema.xml",
-        "schema/appmodel/application.schema.xml",
-        "schema/appmodel/trigger.schema.xml",
-    ]
+    includefiles = list(generate_trigger.base_includes)
 
     res, extra_includes = find_oksincludes(include, os.path.dirname(oksfile))
     if res:
@@ -978,6 +913,10 @@ def generate_trigger(
     return
 
 
+@base_includes(
+    "schema/confmodel/dunedaq.schema.xml",
+    "schema/appmodel/application.schema.xml",
+)
 def generate_session(
     oksfile,
     include,
@@ -993,10 +932,7 @@ def generate_session(
 
     """
 
-    includefiles = [
-        "schema/confmodel/dunedaq.schema.xml",
-        "schema/appmodel/application.schema.xml",
-    ]
+    includefiles = list(generate_session.base_includes)
     res, extra_includes = find_oksincludes(include, os.path.dirname(oksfile))
     if res:
         includefiles += extra_includes
@@ -1088,3 +1024,113 @@ def generate_session(
 
     db.commit()
     return
+
+
+def _timed_generate(generator, incremental, **kwargs):
+    """Run one of the generators above (in a worker process), returning how long it took"""
+    start = time.perf_counter()
+    if incremental:
+        generate_incremental(generator, **kwargs)
+    else:
+        generator(**kwargs)
+    return time.perf_counter() - start
+
+
+def generate_full_session(
+    outdir,
+    include,
+    readoutmap,
+    session_name,
+    op_env,
+    n_dfapps=1,
+    n_data_writers=1,
+    tpwriting_enabled=False,
+    tpg_enabled=True,
+    hsi_enabled=False,
+    hosts_to_use=[],
+    max_workers=None,
+    incremental=False,
+):
+    """Create OKS configuration files for a complete session: readout,
+    trigger, dataflow and (optionally) HSI segments plus the session
+    containing them.
+
+      The includes are resolved once and shared by every file. The
+    segment files don't depend on each other so they are generated
+    concurrently, each in its own process, then the session file is
+    generated including all of them.
+
+    Files are written to outdir as <segment>-segment.data.xml and
+    <session_name>.data.xml, segment files left by a previous run are
+    replaced.
+
+    With incremental, files are only regenerated if their inputs changed
+    and only rewritten if their objects changed, see daqconf.incremental.
+
+    Returns:
+        dictionary of stage : wall-clock time in seconds, None if generation failed
+    """
+    timings = {}
+    total_start = time.perf_counter()
+
+    os.makedirs(outdir, exist_ok=True)
+    res, includefiles = find_oksincludes(include, outdir)
+    if not res:
+        return None
+    timings["resolve includes"] = time.perf_counter() - total_start
+
+    # segment name : (output file, generator, other generator arguments)
+    segments = {
+        "readout": (os.path.join(outdir, "readout-segment.data.xml"), generate_readout,
+                    dict(readoutmap=readoutmap, include=includefiles, generate_segment=True,
+                         tpg_enabled=tpg_enabled, hosts_to_use=hosts_to_use)),
+        "trigger": (os.path.join(outdir, "trigger-segment.data.xml"), generate_trigger,
+                    dict(include=includefiles, generate_segment=True, tpg_enabled=tpg_enabled, hsi_enabled=hsi_enabled)),
+        "dataflow": (os.path.join(outdir, "dataflow-segment.data.xml"), generate_dataflow,
+                     dict(include=includefiles, n_dfapps=n_dfapps, tpwriting_enabled=tpwriting_enabled,
+                          generate_segment=True, n_data_writers=n_data_writers)),
+    }
+    if hsi_enabled:
+        segments["hsi"] = (os.path.join(outdir, "hsi-segment.data.xml"), generate_hsi,
+                           dict(include=includefiles, generate_segment=True))
+
+    # Remove output from a previous run so it can't be mistaken for a new file below
+    if not incremental:
+        for segment_file, _, _ in segments.values():
+            if os.path.exists(segment_file):
+                print(f"Replacing existing {segment_file}")
+                os.remove(segment_file)
+
+    # conffwk is not fork safe, so use fresh interpreters for the workers
+    segments_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers or len(segments),
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {name: pool.submit(_timed_generate, generator, incremental, oksfile=segment_file, **kwargs)
+                   for name, (segment_file, generator, kwargs) in segments.items()}
+        for name, future in futures.items():
+            try:
+                timings[f"{name} segment"] = future.result()
+            except RuntimeError as e:
+                # Incremental generation leaves the previous file in place, don't build on it
+                print(f"Error {name} segment generation failed: {e}")
+                return None
+    timings["segments (wall)"] = time.perf_counter() - segments_start
+
+    for name, (segment_file, _, _) in segments.items():
+        # Generators return without writing anything if they couldn't find their includes
+        if not os.path.exists(segment_file):
+            print(f"Error {name} segment file {segment_file} was not generated")
+            return None
+    segment_files = [os.path.basename(segment_file) for segment_file, _, _ in segments.values()]
+
+    session_start = time.perf_counter()
+    try:
+        _timed_generate(generate_session, incremental, oksfile=os.path.join(outdir, f"{session_name}.data.xml"),
+                        include=includefiles + segment_files, session_name=session_name, op_env=op_env)
+    except RuntimeError as e:
+        print(f"Error session generation failed: {e}")
+        return None
+    timings["session"] = time.perf_counter() - session_start
+
+    timings["total"] = time.perf_counter() - total_start
+    return timings
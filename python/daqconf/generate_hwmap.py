@@ -6,7 +6,24 @@ import json
 import sys
 
 def generate_hwmap(oksfile, n_streams, n_apps = 1, det_id = 3, app_host = "localhost",
-                             eth_protocol = "udp", flx_mode = "fix_rate"):
+                             eth_protocol = "udp", flx_mode = "fix_rate",
+                             hosts = [], streams_per_slot = None, slots_per_crate = 10,
+                             commit_per_stream = False, verbose = False):
+    """Create an OKS hardware map with n_apps DetectorToDaqConnections of
+    n_streams FakeDataSender streams each.
+
+    By default every GeoId is crate=app+1, slot=0, stream=stream number.
+    Giving streams_per_slot instead numbers the streams consecutively
+    across slots_per_crate slots per crate, like a real detector.
+
+    If hosts are given a VirtualHost v<host> is created for each of them
+    so the readout applications can be spread over them with
+    generate_readoutOKS --host v<host> ...
+
+    All objects are built in memory and written with a single commit,
+    commit_per_stream restores the old (very slow) behaviour of
+    committing after every stream.
+    """
 
     schemafiles = [
         "schema/confmodel/dunedaq.schema.xml",
@@ -20,53 +37,68 @@ def generate_hwmap(oksfile, n_streams, n_apps = 1, det_id = 3, app_host = "local
 
     group_name = os.path.basename(oksfile).removesuffix(".data.xml")
     groups = []
-    streams = []
     senders = []
     source_id = 0
 
+    for host in hosts:
+        cpus = dal.ProcessingResource(f"cpus-{host}", cpu_cores=[0, 1, 2, 3])
+        phdal = dal.PhysicalHost(host, contains=[cpus])
+        vhost = dal.VirtualHost(f"v{host}", runs_on=phdal, uses=[cpus])
+        db.update_dal(vhost)
+
     for app in range(n_apps):
         print (f"Generating {app=}")
         for stream_no in range(n_streams):
-            print (f"Generating {stream_no=}")
+            if verbose:
+                print (f"Generating {stream_no=}")
+
+            if streams_per_slot is None:
+                crate_id, slot_id, stream_id = app+1, 0, stream_no
+            else:
+                slot = source_id // streams_per_slot
+                crate_id = slot // slots_per_crate + 1
+                slot_id = slot % slots_per_crate
+                stream_id = source_id % streams_per_slot
 
             geo_dal = dal.GeoId(
                 f"geioId-{source_id}",
                 detector_id=det_id,
-                crate_id=app+1,
-                slot_id=0,
-                stream_id=stream_no,
+                crate_id=crate_id,
+                slot_id=slot_id,
+                stream_id=stream_id,
             )
-            db.update_dal(geo_dal)
             stream = dal.DetectorStream(
                 f"stream-{source_id}",
                 source_id=source_id,
                 geo_id=geo_dal,
             )
-            db.update_dal(stream)
-            streams.append(stream)
-            db.commit()
 
             sender_dal = dal.FakeDataSender(
                 f"sender-{source_id}",
                 contains=[stream]
             )
-            db.update_dal(sender_dal)
             senders.append(sender_dal)
-            db.commit()
+
+            if commit_per_stream:
+                db.update_dal(geo_dal)
+                db.update_dal(stream)
+                db.commit()
+                db.update_dal(sender_dal)
+                db.commit()
 
             source_id = source_id + 1
 
         sender_set = dal.ResourceSetAND(f"senders-{app}", contains=senders)
-        db.update_dal(sender_set)
 
-        print(f"New nic adding nic with id nic-{app}")
+        if verbose:
+            print(f"New nic adding nic with id nic-{app}")
         nic_dal = dal.FakeDataReceiver(
             f"ROInterface-{app}"
         )
-        db.update_dal(nic_dal)
         detconn_dal = dal.DetectorToDaqConnection(
             f"det-conn-{app}",
             contains=[nic_dal, sender_set])
+        # update_dal also writes everything the connection refers to
         db.update_dal(detconn_dal)
         groups.append(detconn_dal)
         senders = []
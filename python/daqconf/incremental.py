@@ -0,0 +1,230 @@
+"""
+Incremental regeneration of OKS files made by the generators in daqconf.generate.
+
+The inputs of a generator (its arguments, the contents of every file it includes, directly or
+through other files, including the schema and data files it always includes, the readout map and the
+generator code itself) are hashed and the hash kept next to the output file. When several generators
+write the same file in turn, one hash of all their inputs is kept for the file. If the hash is unchanged nothing is done. Otherwise the file is generated
+again to a temporary file and the objects compared with the existing file, which is only replaced
+if any object was created, updated or destroyed.
+"""
+import hashlib
+import inspect
+import os
+import sys
+from logging import getLogger
+
+from daqconf.dal_helpers import get_object_summary
+from daqconf.oks_includes import get_include_resolver, locate_include_file, parse_includes
+log = getLogger('daqconf.incremental')
+
+
+def base_includes(*includefiles):
+    """Declare the OKS files a generator always includes, so they are part of its input hash
+
+    Arguments:
+        includefiles -- Schema/data files, as given to Configuration.create_db
+    """
+    def decorate(generator):
+        generator.base_includes = list(includefiles)
+        return generator
+    return decorate
+
+
+def _hash_file_tree(hasher, filename: str, seen: set[str]) -> None:
+    """Add a file and everything it includes to the hash"""
+    if filename in seen:
+        return
+    seen.add(filename)
+
+    with open(filename, "rb") as f:
+        content = f.read()
+    hasher.update(filename.encode())
+    hasher.update(hashlib.sha256(content).digest())
+
+    # OKS looks for includes relative to the including file, then in DUNEDAQ_DB_PATH
+    for include in parse_includes(content):
+        include_file = locate_include_file(include, filename)
+        if include_file is None:
+            hasher.update(f"missing:{include}".encode())
+            continue
+        _hash_file_tree(hasher, include_file, seen)
+
+
+def _daqconf_modules(module) -> list:
+    """A module and every daqconf module it uses, directly or not"""
+    found = {}
+    stack = [module]
+    while stack:
+        module = stack.pop()
+        if module.__name__ in found:
+            continue
+        found[module.__name__] = module
+        # Modules imported whole or things imported from them
+        for value in vars(module).values():
+            name = value.__name__ if inspect.ismodule(value) else getattr(value, "__module__", None)
+            if isinstance(name, str) and name.split(".")[0] == "daqconf" and name not in found and name in sys.modules:
+                stack.append(sys.modules[name])
+    return [found[name] for name in sorted(found)]
+
+
+def hash_generator_inputs(generator, arguments: dict) -> str:
+    """Hash of everything which affects the output of a generator
+
+    Arguments:
+        generator -- Generator function, e.g. daqconf.generate.generate_readout
+        arguments -- Generator arguments by name
+
+    Returns:
+        Hex digest
+    """
+    hasher = hashlib.sha256()
+    hasher.update(f"{generator.__module__}.{generator.__qualname__}".encode())
+    # The generator code and the daqconf code it calls
+    for module in _daqconf_modules(inspect.getmodule(generator)):
+        hasher.update(module.__name__.encode())
+        hasher.update(inspect.getsource(module).encode())
+    for name, value in sorted(arguments.items()):
+        hasher.update(f"{name}={value!r};".encode())
+    # Environment variables read by the generators/OKS
+    for var in ["DUNEDAQ_DB_PATH", "TRACE_FILE"]:
+        hasher.update(f"{var}={os.environ.get(var)!r};".encode())
+
+    oksfile_dir = os.path.dirname(arguments.get("oksfile", ""))
+    seen = set()
+    include_files = list(getattr(generator, "base_includes", [])) + list(arguments.get("include", []))
+    if "readoutmap" in arguments:
+        include_files.append(arguments["readoutmap"])
+    for include in include_files:
+        include_file = include if os.path.exists(include) else get_include_resolver().locate(include, oksfile_dir)
+        if include_file is None:
+            hasher.update(f"missing:{include}".encode())
+            continue
+        _hash_file_tree(hasher, os.path.abspath(include_file), seen)
+
+    return hasher.hexdigest()
+
+
+def diff_oks_files(old_file: str, new_file: str):
+    """Objects created, updated and destroyed going from one OKS file to another
+
+    Returns:
+        (created, updated, destroyed) lists of uid@class, None if the include lists differ
+    """
+    import conffwk
+
+    old_db = conffwk.Configuration("oksconflibs:" + old_file)
+    new_db = conffwk.Configuration("oksconflibs:" + new_file)
+    if sorted(old_db.get_includes(None)) != sorted(new_db.get_includes(None)):
+        return None
+
+    old_dals = {f"{d.id}@{d.className()}": d for d in old_db.get_all_dals().values()}
+    new_dals = {f"{d.id}@{d.className()}": d for d in new_db.get_all_dals().values()}
+
+    created = sorted(new_dals.keys() - old_dals.keys())
+    destroyed = sorted(old_dals.keys() - new_dals.keys())
+    updated = sorted(k for k in new_dals.keys() & old_dals.keys()
+                     if get_object_summary(new_dals[k]) != get_object_summary(old_dals[k]))
+    return created, updated, destroyed
+
+
+def _bind_step(generator, args, kwargs):
+    """Bind a generator's arguments, with oksfile normalised to end in .data.xml"""
+    bound = inspect.signature(generator).bind(*args, **kwargs)
+    bound.apply_defaults()
+    oksfile = bound.arguments["oksfile"]
+    if not oksfile.endswith(".data.xml"):
+        oksfile = oksfile + ".data.xml"
+    bound.arguments["oksfile"] = oksfile
+    return bound
+
+
+def generate_incremental(generator, *args, **kwargs) -> str:
+    """Run a generator only if its inputs have changed since its output file was last generated,
+    and only replace the output file if the generated objects are different
+
+    Arguments:
+        generator -- Generator function taking the output file as an `oksfile` argument
+        args/kwargs -- Arguments passed to the generator
+
+    Returns:
+        "unchanged", "updated" or "created"
+    """
+    return generate_incremental_steps([(generator, args, kwargs)])
+
+
+def generate_incremental_steps(steps) -> str:
+    """As generate_incremental, for several generators run in turn on the same output file
+
+    A single hash of the inputs of all the steps is kept for the output file, so the steps do not
+    overwrite each other's hash.
+
+    Arguments:
+        steps -- List of (generator, args, kwargs), all with the same `oksfile` argument
+
+    Raises:
+        RuntimeError: If a generator did not write the output file, the existing file is left as it was
+
+    Returns:
+        "unchanged", "updated" or "created"
+    """
+    bound_steps = [(generator, _bind_step(generator, args, kwargs)) for generator, args, kwargs in steps]
+    oksfiles = {bound.arguments["oksfile"] for _, bound in bound_steps}
+    if len(oksfiles) != 1:
+        raise ValueError(f"Incremental generation steps must all write the same file, got {sorted(oksfiles)}")
+    oksfile = oksfiles.pop()
+
+    hash_file = os.path.join(os.path.dirname(oksfile), f".{os.path.basename(oksfile)}.inputs-hash")
+    if len(bound_steps) == 1:
+        generator, bound = bound_steps[0]
+        input_hash = hash_generator_inputs(generator, dict(bound.arguments))
+    else:
+        hasher = hashlib.sha256()
+        for generator, bound in bound_steps:
+            hasher.update(hash_generator_inputs(generator, dict(bound.arguments)).encode())
+        input_hash = hasher.hexdigest()
+
+    exists = os.path.exists(oksfile)
+    if exists and os.path.exists(hash_file):
+        with open(hash_file) as f:
+            if f.read().strip() == input_hash:
+                log.info(f"{oksfile} is up to date")
+                return "unchanged"
+
+    # Generate next to the output so relative includes still work
+    tmp_file = os.path.join(os.path.dirname(oksfile), f".{os.path.basename(oksfile).removesuffix('.data.xml')}.tmp.data.xml")
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    try:
+        for generator, bound in bound_steps:
+            bound.arguments["oksfile"] = tmp_file
+            generator(*bound.args, **bound.kwargs)
+
+            # Generators return without writing anything if they couldn't find their includes
+            if not os.path.exists(tmp_file):
+                raise RuntimeError(f"{generator.__name__} did not generate {oksfile}")
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    status = "created"
+    if exists:
+        diff = diff_oks_files(oksfile, tmp_file)
+        if diff is not None and not any(diff):
+            log.info(f"{oksfile} objects are unchanged")
+            os.remove(tmp_file)
+            status = "unchanged"
+        else:
+            if diff is None:
+                log.info(f"Updating {oksfile}, includes changed")
+            else:
+                created, updated, destroyed = diff
+                log.info(f"Updating {oksfile}: {len(created)} objects created, {len(updated)} updated, {len(destroyed)} destroyed")
+            status = "updated"
+
+    if status != "unchanged":
+        os.replace(tmp_file, oksfile)
+
+    with open(hash_file, "w") as f:
+        f.write(input_hash)
+    return status
@@ -1,17 +1,43 @@
 import conffwk
+import hashlib
 import json
 from logging import getLogger
+import os
 import sys
 from rich import print
 log = getLogger('daqconf.jsonify')
 
 
+def hash_key(key_name):
+    """Stable signed 64 bit ID of a uid@class key, the same in every process (unlike hash())"""
+    return int.from_bytes(hashlib.blake2b(key_name.encode(), digest_size=8).digest(), "big", signed=True)
+
+
 def hash_function(obj):
     # I guess we could get ObjectId from MongoDB
-    return hash(f'{obj.id}@{obj.className()}')
+    return hash_key(f'{obj.id}@{obj.className()}')
+
+
+class SchemaCache:
+    """Attribute names and relations (name : multivalue) of each class, only read from the database once per class"""
+    def __init__(self, db):
+        self._db = db
+        self._classes = {}
 
+    def get(self, class_name):
+        if class_name not in self._classes:
+            self._classes[class_name] = (
+                list(self._db.attributes(class_name, all=True)),
+                {name: info.get('multivalue', False) for name, info in self._db.relations(class_name, all=True).items()},
+            )
+        return self._classes[class_name]
+
+
+def convert_to_dict(db, obj, schema_cache=None):
+    if schema_cache is None:
+        schema_cache = SchemaCache(db)
+    attribute_names, relations = schema_cache.get(obj.className())
 
-def convert_to_dict(db, obj):
     dal_dict = {
         "__type": obj.className(),
         "_id": {
@@ -19,16 +45,16 @@ def convert_to_dict(db, obj):
         }
     }
 
-    for attribute_name, attribute_value in db.attributes(obj.className(), all=True).items():
+    for attribute_name in attribute_names:
         dal_dict[attribute_name] = getattr(obj, attribute_name)
 
-    for relation_name, relation_value in db.relations(obj.className(), all=True).items():
+    for relation_name, multivalue in relations.items():
         relation_object = getattr(obj, relation_name, None)
 
         if relation_object is None:
             dal_dict[relation_name] = None
 
-        elif not relation_value.get('multivalue', False):
+        elif not multivalue:
             dal_dict[relation_name] = {
                 # "$ref": "run-registry"
                 '$id': hash_function(relation_object),
@@ -46,29 +72,169 @@ def convert_to_dict(db, obj):
     return dict(sorted(dal_dict.items()))
 
 
-def jsonify_xml_data(oksfile, output):
+json_formats = ["indent", "compact", "ndjson"]
 
-    sys.setrecursionlimit(10000)
+def write_json(db, f, format="indent"):
+    """Write every object in a database as JSON, one object at a time in sorted key order
+    so the whole document is never held in memory
 
-    log.info(f"JSonifying database \'{oksfile}\' to \'{output}\'.")
+    Arguments:
+        db -- conffwk Configuration
+        f -- Open text file to write to
+        format -- "indent" (same as json.dump with indent=4), "compact" (a single line)
+                  or "ndjson" (one {key: object} document per line)
 
-    log.debug("Reading database")
-    db = conffwk.Configuration("oksconflibs:" + oksfile)
+    Returns:
+        Number of objects written
+    """
+    if format not in json_formats:
+        raise ValueError(f"Unknown JSON format {format}, expected one of {json_formats}")
 
     dals = db.get_all_dals()
-    the_big_dict = {}
-
+    keys = {}
+    oids = {}
     for dal_str in dals:
         dal = dals[dal_str]
         key_name = f"{dal.id}@{dal.className()}"
-        log.debug(f"Processing DAL {key_name}")
-        if key_name in the_big_dict:
+        if key_name in keys:
             log.error(f"Duplicate DAL id {key_name}")
             continue
+        keys[key_name] = dal_str
 
-        dal_dict = convert_to_dict(db, dal)
-        the_big_dict[key_name] = dal_dict
+        # References would be ambiguous if two objects had the same ID
+        oid = hash_key(key_name)
+        if oid in oids:
+            raise RuntimeError(f"Object ID collision between {oids[oid]} and {key_name}")
+        oids[oid] = key_name
 
-    with open(output, 'w') as f:
-        json.dump(dict(sorted(the_big_dict.items())), f, indent=4)
+    schema_cache = SchemaCache(db)
+    encoder = json.JSONEncoder(indent=4) if format == "indent" else json.JSONEncoder(separators=(",", ":"))
+
+    if format != "ndjson":
+        f.write("{")
+    for n, key_name in enumerate(sorted(keys)):
+        log.debug(f"Processing DAL {key_name}")
+        dal_dict = convert_to_dict(db, dals[keys[key_name]], schema_cache)
 
+        if format == "ndjson":
+            f.write(encoder.encode({key_name: dal_dict}))
+            f.write("\n")
+        elif format == "compact":
+            f.write(f"{',' if n else ''}{encoder.encode(key_name)}:{encoder.encode(dal_dict)}")
+        else:
+            # Nested objects are indented one more level than encoding them on their own gives
+            value = encoder.encode(dal_dict).replace("\n", "\n    ")
+            f.write(f"{',' if n else ''}\n    {encoder.encode(key_name)}: {value}")
+    if format == "indent" and keys:
+        f.write("\n")
+    if format != "ndjson":
+        f.write("}")
+
+    return len(keys)
+
+
+def jsonify_xml_data(oksfile, output, format="indent"):
+
+    sys.setrecursionlimit(10000)
+
+    log.info(f"JSonifying database \'{oksfile}\' to \'{output}\'.")
+
+    log.debug("Reading database")
+    db = conffwk.Configuration("oksconflibs:" + oksfile)
+
+    with open(output, 'w') as f:
+        n_objects = write_json(db, f, format)
+
+    log.info(f"Wrote {n_objects} objects to \'{output}\'")
+
+
+def read_json_objects(jsonfile):
+    """Yield (uid@class, object dict) from a file written by write_json in any format"""
+    with open(jsonfile) as f:
+        # compact and NDJSON files have complete documents on each line, indented JSON has
+        # nothing after the opening brace on the first line
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        if not first:
+            # Nothing exported, e.g. an empty database as NDJSON
+            return
+        one_per_line = bool(f.readline().strip())
+        f.seek(0)
+
+        if one_per_line:
+            for line in f:
+                if line.strip():
+                    yield from json.loads(line).items()
+        else:
+            yield from json.load(f).items()
+
+
+def dejsonify_json_data(jsonfile, oksfile, include):
+    """Rebuild an OKS data file from the JSON written by jsonify_xml_data
+
+    Objects are created in two passes, first every object with its attributes then the
+    relationships, resolved through the $oid of each object, and written with a single commit.
+    Objects already defined in the included files are not created again.
+
+    Arguments:
+        jsonfile -- JSON or NDJSON file written by jsonify_xml_data
+        oksfile -- OKS data file to create
+        include -- Schema (and data) files to include, the exported objects' classes must be defined in them
+
+    Returns:
+        Number of objects created, None if the includes could not be found
+    """
+    from daqconf.utils import find_oksincludes
+
+    log.info(f"Dejsonifying \'{jsonfile}\' to database \'{oksfile}\'.")
+
+    res, includefiles = find_oksincludes(include, os.path.dirname(oksfile))
+    if not res:
+        return None
+
+    dal = conffwk.dal.module("generated", includefiles)
+    db = conffwk.Configuration("oksconflibs")
+    if not oksfile.endswith(".data.xml"):
+        oksfile = oksfile + ".data.xml"
+    db.create_db(oksfile, includefiles)
+    db.set_active(oksfile)
+
+    schema_cache = SchemaCache(db)
+    objects = {}   # $oid : DAL object
+    relations = [] # (DAL object, relation name, multivalue, JSON value) to resolve once everything exists
+    new_objects = []
+
+    log.debug("Creating objects")
+    for key_name, obj_dict in read_json_objects(jsonfile):
+        uid, class_name = key_name.rsplit("@", 1)
+        attribute_names, class_relations = schema_cache.get(class_name)
+
+        try:
+            conf_obj = db.get_dal(class_name, uid)
+        except:
+            conf_obj = getattr(dal, class_name)(uid, **{name: obj_dict[name] for name in attribute_names if name in obj_dict})
+            new_objects.append(conf_obj)
+            relations += [(conf_obj, name, multivalue, obj_dict[name]) for name, multivalue in class_relations.items()
+                          if obj_dict.get(name) is not None]
+
+        objects[obj_dict["_id"]["$oid"]] = conf_obj
+
+    log.debug("Resolving relationships")
+    missing = 0
+    for conf_obj, name, multivalue, value in relations:
+        refs = value if multivalue else [value]
+        targets = [objects.get(ref["$id"]) for ref in refs]
+        if None in targets:
+            missing += targets.count(None)
+            log.error(f"{conf_obj.id}@{conf_obj.className()}.{name} refers to objects not in {jsonfile}")
+            targets = [t for t in targets if t is not None]
+        setattr(conf_obj, name, targets if multivalue else (targets[0] if targets else None))
+
+    log.debug("Saving database")
+    for conf_obj in new_objects:
+        db.update_dal(conf_obj)
+    db.commit()
+
+    log.info(f"Created {len(new_objects)} objects in \'{oksfile}\'" + (f", {missing} references could not be resolved" if missing else ""))
+    return len(new_objects)
@@ -0,0 +1,214 @@
+"""
+Resolution of OKS include names (e.g. "appmodel/moduleconfs", "hosts", "schema/confmodel/dunedaq.schema.xml")
+to files in the DUNEDAQ_DB_PATH directories.
+
+Directory listings are read once and kept in memory, so resolving includes for several generators
+in the same process doesn't walk the same directories again. Listings can also be kept on disk
+between processes by setting DAQCONF_INCLUDE_CACHE to a file path, a cached listing is only used
+while the modification time of its directory is unchanged.
+"""
+import fnmatch
+import json
+import os
+import re
+from logging import getLogger
+log = getLogger('daqconf.oks_includes')
+
+_OKS_INCLUDE = re.compile(rb'<file\s+path="([^"]+)"')
+
+
+class OksIncludeResolver:
+    def __init__(self, cache_file: str | None = None):
+        """Include resolver
+
+        Arguments:
+            cache_file -- JSON file to load/save directory listings from/to, listings are only kept in memory if None
+        """
+        # directory -> (mtime, files, sub directories)
+        self._listings: dict[str, tuple[int, list[str], list[str]]] = {}
+        self._cache_file = cache_file
+        self._cache_dirty = False
+
+        if cache_file is not None and os.path.exists(cache_file):
+            try:
+                with open(cache_file) as f:
+                    self._listings = {d: tuple(listing) for d, listing in json.load(f).items()}
+            except (OSError, ValueError) as e:
+                log.warning(f"Ignoring unreadable include cache {cache_file}: {e}")
+
+    @staticmethod
+    def search_dirs(extra_dirs: list[str] | str = []) -> list[str]:
+        """DUNEDAQ_DB_PATH directories followed by any extra directories"""
+        if isinstance(extra_dirs, str):
+            extra_dirs = [extra_dirs]
+        return [path for path in os.environ["DUNEDAQ_DB_PATH"].split(":")] + list(extra_dirs)
+
+    def __listing(self, directory: str) -> tuple[list[str], list[str]]:
+        """Files and sub directories of a directory, only read again if the directory has been modified.
+        Generators can include files written by earlier generators so the mtime is always checked"""
+        directory = os.path.abspath(directory or ".")
+
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            mtime = -1
+
+        cached = self._listings.get(directory)
+        if cached is None or cached[0] != mtime:
+            files, dirs = [], []
+            if mtime != -1:
+                try:
+                    with os.scandir(directory) as entries:
+                        for entry in entries:
+                            (dirs if entry.is_dir() else files).append(entry.name)
+                except OSError:
+                    pass
+            self._listings[directory] = (mtime, sorted(files), sorted(dirs))
+            self._cache_dirty = True
+
+        _, files, dirs = self._listings[directory]
+        return files, dirs
+
+    def glob(self, pattern: str, root_dir: str) -> list[str]:
+        """Equivalent of glob.glob(pattern, root_dir=root_dir) for file patterns, using the cached listings
+
+        Returns:
+            Sorted paths of matching files relative to root_dir
+        """
+        parts = pattern.split("/")
+        matches = [""]
+        for i, part in enumerate(parts):
+            last = i == len(parts)-1
+            next_matches = []
+            for rel_dir in matches:
+                files, dirs = self.__listing(os.path.join(root_dir, rel_dir))
+                names = files if last else dirs
+                if any(c in part for c in "*?["):
+                    # Like glob, wildcards don't match hidden files
+                    found = [n for n in fnmatch.filter(names, part) if not n.startswith(".") or part.startswith(".")]
+                else:
+                    found = [part] if part in names else []
+                next_matches += [os.path.join(rel_dir, n) for n in found]
+            matches = next_matches
+            if not matches:
+                break
+        return sorted(matches)
+
+    def find(self, include: str, searchdirs: list[str]) -> str | None:
+        """Find the file for a single include, searching the directories in order
+
+        Arguments:
+            include -- Include name, ".xml" is optional. Names without a ".data"/".schema" suffix
+                       match any file starting with the name
+            searchdirs -- Directories to search
+
+        Returns:
+            Path of the file relative to the directory it was found in, None if not found
+        """
+        inc = include.removesuffix(".xml")
+        if inc.endswith(".data"):
+            sub_dirs = ["config", "data"]
+        elif inc.endswith(".schema"):
+            sub_dirs = ["schema"]
+        else:
+            sub_dirs = ["*"]
+            inc = inc + "*"
+
+        for path in searchdirs:
+            for pattern in [f"{inc}.xml"] + [f"{sub_dir}/{inc}.xml" for sub_dir in sub_dirs]:
+                matches = self.glob(pattern, path)
+                if matches:
+                    return matches[0]
+        return None
+
+    def locate(self, include: str, extra_dirs: list[str] | str = []) -> str | None:
+        """Absolute path of the file for an include, see find
+
+        Arguments:
+            include -- Include name
+            extra_dirs -- Directories to search after DUNEDAQ_DB_PATH
+
+        Returns:
+            Absolute path of the file, None if not found
+        """
+        for path in self.search_dirs(extra_dirs):
+            filename = self.find(include, [path])
+            if filename is not None:
+                return os.path.abspath(os.path.join(path, filename))
+        return None
+
+    def resolve(self, includes: list[str], extra_dirs: list[str] | str = []) -> list[str] | None:
+        """Find the files for a list of includes
+
+        Arguments:
+            includes -- Include names
+            extra_dirs -- Directories to search after DUNEDAQ_DB_PATH
+
+        Returns:
+            Files to include without duplicates, None if any include could not be found
+        """
+        searchdirs = self.search_dirs(extra_dirs)
+
+        includefiles = []
+        try:
+            for inc in includes:
+                filename = self.find(inc, searchdirs)
+                if filename is None:
+                    print(f"Error could not find include file for {inc}")
+                    return None
+                if filename not in includefiles:
+                    print(f"Adding {filename} to include list")
+                    includefiles.append(filename)
+        finally:
+            self.save_cache()
+
+        return includefiles
+
+    def save_cache(self) -> None:
+        """Write directory listings to the cache file, if there is one and anything changed"""
+        if self._cache_file is None or not self._cache_dirty:
+            return
+
+        try:
+            tmp_file = f"{self._cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(self._listings, f)
+            os.replace(tmp_file, self._cache_file)
+            self._cache_dirty = False
+        except OSError as e:
+            log.warning(f"Could not write include cache {self._cache_file}: {e}")
+
+
+def parse_includes(content: bytes) -> list[str]:
+    """Include paths listed in the contents of an OKS file, without parsing the whole file"""
+    return [include.decode() for include in _OKS_INCLUDE.findall(content)]
+
+
+def locate_include_file(include: str, including_file: str | None = None) -> str | None:
+    """Absolute path of an include as written in an OKS file, OKS looks for it relative to the
+    including file first then in DUNEDAQ_DB_PATH
+
+    Arguments:
+        include -- Include path
+        including_file -- File containing the include
+
+    Returns:
+        Absolute path of the file, None if not found
+    """
+    if os.path.isabs(include):
+        return include if os.path.exists(include) else None
+    if including_file is not None:
+        candidate = os.path.join(os.path.dirname(including_file), include)
+        if os.path.exists(candidate):
+            return os.path.abspath(candidate)
+    return get_include_resolver().locate(include)
+
+
+_resolver = None
+
+def get_include_resolver() -> OksIncludeResolver:
+    """Resolver shared by everything in this process"""
+    global _resolver
+    if _resolver is None:
+        _resolver = OksIncludeResolver(os.environ.get("DAQCONF_INCLUDE_CACHE"))
+    return _resolver
@@ -0,0 +1,170 @@
+"""
+Planning stage of generate_readout.
+
+The hardware map is read into a table with one row per DetectorToDaqConnection, every assignment
+(application names, hosts, handlers/rules, data readers, TP source IDs) is then worked out for the
+whole table before any object is created. The plan can be printed as a dry-run report.
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+
+# Receiver class : uid of the DataReaderConf the ReadoutApplications use
+# FakeDataReceiver and DPDKReceiver share a single DPDKReaderConf, whichever type is seen first
+_RECEIVER_READERS = {
+    "FakeDataReceiver": None,
+    "DPDKReceiver": None,
+    "FelixInterface": "flxConf-1",
+}
+_NIC_READERS = {
+    "FakeDataReceiver": "nicrcvr-fake-gen",
+    "DPDKReceiver": "nicrcvr-dpdk-gen",
+}
+
+# Detector ID : (link handler, raw data queue rule)
+_DET_HANDLERS = {
+    2: ("def-pds-link-handler", "pds-raw-data-rule"),
+    3: ("def-link-handler", "wib-eth-raw-data-rule"),
+    11: ("def-tde-link-handler", "tde-raw-data-rule"),
+}
+_DAPHNE_STREAM_HANDLERS = ("def-pds-stream-link-handler", "pds-stream-raw-data-rule")
+
+# First TP source ID, each application gets one per plane
+_TP_SOURCE_ID_BASE = 100
+_N_TP_PLANES = 3
+
+
+@dataclass
+class ReadoutPlan:
+    """Everything generate_readout will create, stored as columns with one entry per DetectorToDaqConnection"""
+    # Read from the hardware map
+    connection: list[str] = field(default_factory=list)
+    receiver_class: list[str] = field(default_factory=list)
+    det_id: list[int] = field(default_factory=list)
+    n_streams: list[int] = field(default_factory=list)
+    min_source_id: list[int | None] = field(default_factory=list)
+    max_source_id: list[int | None] = field(default_factory=list)
+    # Assignments, None for connections which are skipped
+    app: list[str | None] = field(default_factory=list)
+    host: list[str | None] = field(default_factory=list)
+    link_handler: list[str | None] = field(default_factory=list)
+    queue_rule: list[str | None] = field(default_factory=list)
+    data_reader: list[str | None] = field(default_factory=list)
+    tp_source_ids: list[list[int]] = field(default_factory=list)
+    skip_reason: list[str | None] = field(default_factory=list)
+
+    def __len__(self):
+        return len(self.connection)
+
+    @property
+    def n_apps(self) -> int:
+        return sum(app is not None for app in self.app)
+
+    def report(self) -> str:
+        """Human readable summary of the plan followed by a row per connection"""
+        columns = ["connection", "receiver_class", "det_id", "n_streams", "min_source_id", "max_source_id",
+                   "app", "host", "link_handler", "queue_rule", "data_reader", "tp_source_ids"]
+        rows = [[("-" if v is None else ",".join(map(str, v)) if isinstance(v, list) else str(v))
+                 for v in (getattr(self, c)[i] for c in columns)] for i in range(len(self))]
+        widths = [max([len(c)] + [len(r[j]) for r in rows]) for j, c in enumerate(columns)]
+
+        lines = [f"{self.n_apps} ReadoutApplications planned for {len(self)} DetectorToDaqConnections"]
+        lines.append("  per host: " + ", ".join(f"{h}={n}" for h, n in sorted(Counter(h for h in self.host if h).items())))
+        lines.append("  per receiver: " + ", ".join(f"{r}={n}" for r, n in sorted(Counter(self.receiver_class).items())))
+        lines.append("  per detector ID: " + ", ".join(f"{d}={n}" for d, n in sorted(Counter(self.det_id).items())))
+        for connection, reason in zip(self.connection, self.skip_reason):
+            if reason is not None:
+                lines.append(f"  skipping {connection}: {reason}")
+        lines.append("")
+        lines.append("  ".join(c.ljust(w) for c, w in zip(columns, widths)).rstrip())
+        lines += ["  ".join(v.ljust(w) for v, w in zip(row, widths)).rstrip() for row in rows]
+        return "\n".join(lines)
+
+
+def _connection_row(connection):
+    """(receiver class, detector ID, stream source IDs) of a DetectorToDaqConnection"""
+    receiver_class = None
+    det_id = 0
+    source_ids = []
+    for resource in connection.contains:
+        types = resource.oksTypes()
+        if receiver_class is None and "DetDataReceiver" in types:
+            receiver_class = resource.className()
+        elif "ResourceSetAND" in types:
+            for sender in resource.contains:
+                for stream in sender.contains:
+                    if det_id == 0:
+                        det_id = stream.geo_id.detector_id
+                    source_ids.append(stream.source_id)
+    return receiver_class, det_id, source_ids
+
+
+def extract_hardware_map(detector_connections) -> ReadoutPlan:
+    """Read the columns of the plan which come from the hardware map, assignments are left empty
+
+    Arguments:
+        detector_connections -- DetectorToDaqConnection DAL objects
+    """
+    plan = ReadoutPlan()
+    for connection in detector_connections:
+        receiver_class, det_id, source_ids = _connection_row(connection)
+        plan.connection.append(connection.id)
+        plan.receiver_class.append(receiver_class)
+        plan.det_id.append(det_id)
+        plan.n_streams.append(len(source_ids))
+        plan.min_source_id.append(min(source_ids) if source_ids else None)
+        plan.max_source_id.append(max(source_ids) if source_ids else None)
+    return plan
+
+
+def plan_readout(detector_connections, hosts: list[str], emulated_file_name: str = "", tpg_enabled: bool = True) -> ReadoutPlan:
+    """Work out everything generate_readout will create for a hardware map
+
+    Arguments:
+        detector_connections -- DetectorToDaqConnection DAL objects
+        hosts -- uids of the VirtualHosts to assign applications to, round-robin
+
+    Keyword Arguments:
+        emulated_file_name -- Emulated data file, DAPHNE stream files need their own handler (default: {""})
+        tpg_enabled -- Assign TP source IDs (default: {True})
+
+    Returns:
+        Complete plan
+    """
+    plan = extract_hardware_map(detector_connections)
+
+    # Connections with an unknown receiver are skipped and don't use up a host slot/TP source IDs
+    skip_reason = [None if receiver in _RECEIVER_READERS else f"unknown interface type {receiver}"
+                   for receiver in plan.receiver_class]
+
+    # Skipped connections get no link handler, so their detector ID doesn't matter
+    used_det_ids = [d for d, reason in zip(plan.det_id, skip_reason) if reason is None]
+    if 0 in used_det_ids:
+        raise Exception(f"Unable to determine detector ID from Hardware Map!")
+    unknown_det_ids = set(used_det_ids) - set(_DET_HANDLERS)
+    if unknown_det_ids:
+        raise Exception(f"No link handler defined for detector ID(s) {sorted(unknown_det_ids)}")
+
+    det_handlers = dict(_DET_HANDLERS)
+    if "DAPHNEStream" in emulated_file_name:
+        det_handlers[2] = _DAPHNE_STREAM_HANDLERS
+
+    app_index = []
+    n_apps = 0
+    for reason in skip_reason:
+        app_index.append(None if reason is not None else n_apps)
+        n_apps += reason is None
+
+    nic_reader = next((_NIC_READERS[r] for r, reason in zip(plan.receiver_class, skip_reason)
+                       if reason is None and r in _NIC_READERS), None)
+
+    plan.skip_reason = skip_reason
+    plan.app = [None if i is None else f"ru-{c}" for c, i in zip(plan.connection, app_index)]
+    plan.host = [None if i is None else hosts[i % len(hosts)] for i in app_index]
+    plan.link_handler = [None if i is None else det_handlers[d][0] for d, i in zip(plan.det_id, app_index)]
+    plan.queue_rule = [None if i is None else det_handlers[d][1] for d, i in zip(plan.det_id, app_index)]
+    plan.data_reader = [None if i is None else (_RECEIVER_READERS[r] or nic_reader)
+                        for r, i in zip(plan.receiver_class, app_index)]
+    plan.tp_source_ids = [[] if i is None or not tpg_enabled else
+                          [_TP_SOURCE_ID_BASE + i*_N_TP_PLANES + p for p in range(_N_TP_PLANES)]
+                          for i in app_index]
+    return plan
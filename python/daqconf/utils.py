@@ -1,8 +1,10 @@
-import glob
+import json
 import logging
-import os
+import re
 from rich.logging import RichHandler
 
+from daqconf.oks_includes import get_include_resolver
+
 
 log_levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
 
@@ -34,54 +36,83 @@ def setup_logging(level:str="INFO"):
 
 
 def find_oksincludes(includes:list[str], extra_dirs:list[str] = []):
-    includefiles = []
-
-    searchdirs = [path for path in os.environ["DUNEDAQ_DB_PATH"].split(":")]
-    for dir in extra_dirs:
-        searchdirs.append(dir)
-
-    for inc in includes:
-        # print (f"Searching for {inc}")
-        match = False
-        inc = inc.removesuffix(".xml")
-        if inc.endswith(".data"):
-            sub_dirs = ["config", "data"]
-        elif inc.endswith(".schema"):
-            sub_dirs = ["schema"]
-        else:
-            sub_dirs = ["*"]
-            inc = inc + "*"
-        for path in searchdirs:
-            # print (f"   {path}/{inc}.xml")
-            matches = glob.glob(f"{inc}.xml", root_dir=path)
-            if len(matches) == 0:
-                for search_dir in sub_dirs:
-                    # print (f"   {path}/{search_dir}/{inc}.xml")
-                    matches = glob.glob(f"{search_dir}/{inc}.xml", root_dir=path)
-                    for filename in matches:
-                        if filename not in includefiles:
-                            print(f"Adding {filename} to include list")
-                            includefiles.append(filename)
-                        #else:
-                        #    print(f"{filename} already in include list")
-                        match = True
-                        break
-                    if match:
-                        break
-                if match:
-                    break
-            else:
-                for filename in matches:
-                    if filename not in includefiles:
-                        print(f"Adding {filename} to include list")
-                        includefiles.append(filename)
-                    #else:
-                    #    print(f"{filename} already in include list")
-                    match = True
-                    break
-
-        if not match:
-            print(f"Error could not find include file for {inc}")
-            return [False, []]
+    """Find the files for a list of OKS includes in DUNEDAQ_DB_PATH followed by extra_dirs
+
+    Returns:
+        [True, files to include] or [False, []] if any include could not be found
+    """
+    includefiles = get_include_resolver().resolve(includes, extra_dirs)
+    if includefiles is None:
+        return [False, []]
 
     return [True, includefiles]
+
+
+_JSON_WHITESPACE = re.compile(r"\s*")
+
+def iter_json_array(f, chunk_size:int = 1 << 16):
+    """Yield the elements of a JSON array one at a time while reading the file,
+    so the whole array never has to be held in memory
+
+    Arguments:
+        f -- Open text file containing a single JSON array
+        chunk_size -- Number of characters to read at a time
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def next_char():
+        """Skip whitespace, reading more of the file if needed, and return the next character ('' at the end)"""
+        nonlocal buffer, pos, eof
+        while True:
+            pos = _JSON_WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer) or eof:
+                return buffer[pos:pos+1]
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+    if next_char() != "[":
+        raise ValueError("Expected a JSON array")
+    pos += 1
+    if next_char() == "]":
+        return
+
+    while True:
+        next_char()
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+            # A number split between chunks decodes as a shorter number, so only accept
+            # the element once the separator after it has been read
+            separator_pos = _JSON_WHITESPACE.match(buffer, end).end()
+            complete = buffer[separator_pos:separator_pos+1] in (",", "]") or eof
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+
+        if not complete:
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+
+        pos = end
+        yield element
+
+        separator = next_char()
+        pos += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(f"Expected ',' or ']' in JSON array, found {separator!r}")
+
+
+def iter_json_file(filename:str, chunk_size:int = 1 << 16):
+    """Yield the elements of the JSON array in a file one at a time, see iter_json_array"""
+    with open(filename) as f:
+        yield from iter_json_array(f, chunk_size)
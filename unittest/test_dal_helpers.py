@@ -0,0 +1,80 @@
+"""
+Tests of the reachability helpers in daqconf.dal_helpers, run with pytest
+"""
+import pytest
+
+from daqconf.dal_helpers import ReferenceIndex, find_reachable, find_related
+
+
+class Dal:
+    """Minimal dal object with a single multi-valued relationship"""
+    __schema__ = {"attribute": {}, "relation": {"uses": {}}}
+
+    def __init__(self, uid):
+        self.id = uid
+        self.uses = []
+
+    def className(self):
+        return "Dal"
+
+
+@pytest.fixture
+def dals():
+    """session -> app -> (conf, service), conf -> service, loop-a <-> loop-b -> service"""
+    objs = {uid: Dal(uid) for uid in ["session", "app", "conf", "service", "loop-a", "loop-b"]}
+    objs["session"].uses = [objs["app"]]
+    objs["app"].uses = [objs["conf"], objs["service"]]
+    objs["conf"].uses = [objs["service"]]
+    objs["loop-a"].uses = [objs["loop-b"]]
+    objs["loop-b"].uses = [objs["loop-a"], objs["service"]]
+    return objs
+
+
+def uids(dal_objs):
+    return sorted(o.id for o in dal_objs)
+
+
+def test_find_reachable_includes_roots(dals):
+    reached = find_reachable([dals["session"]])
+    assert list(reached) == ["session@Dal", "app@Dal", "conf@Dal", "service@Dal"]
+
+
+def test_find_reachable_cycle(dals):
+    assert uids(find_reachable([dals["loop-a"]]).values()) == ["loop-a", "loop-b", "service"]
+
+
+def test_find_related(dals):
+    group = set()
+    find_related(dals["session"], group)
+    assert uids(group) == ["app", "conf", "service"]
+
+    # Roots are only added if part of a cycle
+    find_related(dals["loop-a"], group)
+    assert uids(group) == ["app", "conf", "loop-a", "loop-b", "service"]
+
+
+def test_reachable(dals):
+    index = ReferenceIndex(dals.values())
+    assert uids(index.reachable([dals["session"]])) == ["app", "conf", "service"]
+    assert uids(index.reachable([dals["loop-a"]])) == ["loop-a", "loop-b", "service"]
+    assert index.reachable([dals["service"]]) == []
+
+
+def test_referrers(dals):
+    index = ReferenceIndex(dals.values())
+    assert uids(index.referrers(dals["service"])) == ["app", "conf", "loop-b"]
+    assert index.referrers(dals["session"]) == []
+
+
+def test_transitive_referrers(dals):
+    index = ReferenceIndex(dals.values())
+    assert uids(index.referrers(dals["service"], transitive=True)) == ["app", "conf", "loop-a", "loop-b", "session"]
+    assert uids(index.referrers(dals["loop-a"], transitive=True)) == ["loop-a", "loop-b"]
+
+
+def test_matches_find_related(dals):
+    index = ReferenceIndex(dals.values())
+    for dal_obj in dals.values():
+        group = set()
+        find_related(dal_obj, group)
+        assert uids(index.reachable([dal_obj])) == uids(group)
@@ -0,0 +1,97 @@
+"""
+Tests of the cider search index, run with pytest
+"""
+import pytest
+
+from daqconf.benchmark import SyntheticDal
+from daqconf.cider.data_structures.search_index import SearchIndex
+
+
+class Handler:
+    """The parts of the ConfigurationHandler interface used by SearchIndex"""
+    def __init__(self, conf_objs):
+        self.conf_obj_list = conf_objs
+        self._ids = {self.key(conf_obj): i for i, conf_obj in enumerate(conf_objs)}
+
+    @staticmethod
+    def key(conf_obj):
+        return f"{conf_obj.id}@{conf_obj.className()}"
+
+    def get_conf_obj_id(self, conf_obj):
+        return self._ids.get(self.key(conf_obj))
+
+    def get_conf_obj_from_id(self, conf_obj_id):
+        return self.conf_obj_list[conf_obj_id]
+
+    def get_class_attributes(self, class_name):
+        return {"description": {}}
+
+
+@pytest.fixture
+def index():
+    conf_objs = [SyntheticDal(f"obj-{i}", f"Class{i%7}") for i in range(300)]
+    conf_objs += [SyntheticDal("np04-wib-readout-app", "ReadoutApplication"),
+                  SyntheticDal("ru-det-conn-0", "DetectorToDaqConnection"),
+                  SyntheticDal("df-01", "ReadoutApplication"),
+                  SyntheticDal("ru-readout", "NetworkInterface")]
+    return SearchIndex(Handler(conf_objs))
+
+
+def uids(results):
+    return [conf_obj.id for conf_obj in results]
+
+
+@pytest.mark.parametrize("query, uid", [("wib", "np04-wib-readout-app"),
+                                        ("conn", "ru-det-conn-0"),
+                                        ("bj-19", "obj-19")])
+def test_infix(index, query, uid):
+    assert uids(index.search(query))[0] == uid
+
+
+@pytest.mark.parametrize("query, uid", [("np04", "np04-wib-readout-app"),
+                                        ("ru-d", "ru-det-conn-0"),
+                                        ("n", "np04-wib-readout-app")])
+def test_prefix(index, query, uid):
+    assert uid in uids(index.search(query))
+
+
+def test_prefix_ranks_first(index):
+    results = uids(index.search("obj-19", 11))
+    assert results[0] == "obj-19"
+    assert sorted(results[1:]) == [f"obj-19{i}" for i in range(10)]
+
+
+def test_exact_ranks_first(index):
+    assert uids(index.search("obj-2"))[0] == "obj-2"
+    assert uids(index.search("OBJ-299"))[0] == "obj-299"
+
+
+@pytest.mark.parametrize("query, uid", [("np04-wib-raedout", "np04-wib-readout-app"),
+                                        ("ru-det-con-0", "ru-det-conn-0")])
+def test_typo(index, query, uid):
+    assert uids(index.search(query))[0] == uid
+
+
+def test_uid_match_ranks_above_class_match(index):
+    results = uids(index.search("readout"))
+    assert set(results) == {"np04-wib-readout-app", "ru-readout", "df-01"}
+    assert results[-1] == "df-01"
+
+
+def test_class_match(index):
+    results = index.search("Class3")
+    assert len(results) == 43
+    assert all(conf_obj.className() == "Class3" for conf_obj in results)
+
+
+def test_no_match(index):
+    assert index.search("zzzz") == []
+    assert index.search("  ") == []
+
+
+def test_add_remove(index):
+    conf_obj = index._handler.conf_obj_list[0]
+    index.remove_conf_obj(conf_obj)
+    assert "obj-0" not in uids(index.search("obj-0"))
+    index.add_conf_obj(conf_obj)
+    assert uids(index.search("obj-0"))[0] == "obj-0"